@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2024, Mikhail Shurutov <shurutov@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+
+class ModuleDocFragment(object):
+    # Options of LXD_COMMON_ARGS, every LXD module of the role has them
+    DOCUMENTATION = '''
+options:
+    auth_cache:
+        description:
+          - Path of a file on the target host the LXD servers trusting the
+            client certificate are remembered in, keyed by I(url) and the
+            certificate fingerprint.
+          - When I(trust_password) is set, the trust is checked with
+            GET /1.0 and the password is only sent if the certificate is
+            not trusted yet. Servers found in the file are not asked again.
+          - If a server refuses a request with HTTP 403 or reports the
+            certificate as untrusted, its entry is dropped and the
+            certificate is authenticated again once.
+        required: false
+        type: path
+        default: '"{}/.config/lxc/auth_cache.json" .format(os.environ["HOME"])'
+    client_cert:
+        description:
+          - The client certificate file path.
+        required: false
+        default: '"{}/.config/lxc/client.crt" .format(os.environ["HOME"])'
+        aliases: [ cert_file ]
+    client_key:
+        description:
+          - The client certificate key file path.
+        required: false
+        default: '"{}/.config/lxc/client.key" .format(os.environ["HOME"])'
+        aliases: [ key_file ]
+    log_max_body:
+        description:
+          - Maximum number of characters of a request or response body
+            kept in a log entry, longer bodies are truncated.
+        required: false
+        type: int
+        default: 4096
+    log_max_entries:
+        description:
+          - Maximum number of requests kept in I(logs), older ones are
+            dropped.
+        required: false
+        type: int
+        default: 100
+    log_path:
+        description:
+          - Path of a file on the target host every request is appended to
+            as a JSON line as soon as its response is read.
+          - Requests are written even if ansible-playbook is not invoked
+            with -vvvv.
+        required: false
+        type: path
+    max_requests:
+        description:
+          - Maximum number of requests sent at the same time to the LXD
+            server, so parallel requests do not overload the daemon.
+          - Waits for operations are not counted.
+        required: false
+        type: int
+        default: 8
+    retry_timeout:
+        description:
+          - Seconds a request failing with a transient error, like a busy
+            database, an operation in progress or HTTP 503, is retried for.
+          - Retries back off exponentially with random jitter, starting
+            from 0.1 up to 5 seconds. Requests which may have reached the
+            server are only sent again if they are idempotent.
+          - Set 0 to never retry.
+        required: false
+        type: int
+        default: 30
+    trust_password:
+        description:
+          - The client trusted password.
+          - You need to set this password on the LXD server before
+            running this module using the following command.
+            lxc config set core.trust_password <some random password>
+            See U(https://www.stgraber.org/2016/04/18/lxd-api-direct-interaction/)
+          - If trust_password is set, this module send a request for
+            authentication before sending any requests, unless the client
+            certificate is already trusted, see I(auth_cache).
+        required: false
+    url:
+        description:
+          - The unix domain socket path or the https URL for the LXD server.
+        required: false
+        default: unix:/var/lib/lxd/unix.socket
+'''
+
+    # Options of LXD_TIMINGS_ARGS
+    TIMINGS = '''
+options:
+    timings:
+        description:
+          - Whether I(timings) are returned.
+        required: false
+        type: bool
+        default: false
+    timings_format:
+        choices:
+          - json
+          - prometheus
+        description:
+          - Format of the file I(timings_path).
+          - With C(json) the timings of every run are appended to the file
+            as a JSON line.
+          - With C(prometheus) the file is replaced by metrics for the
+            textfile collector of the node exporter, so every module needs
+            its own file.
+        required: false
+        default: json
+    timings_path:
+        description:
+          - Path of a file on the target host the timings are exported to,
+            also if I(timings) is not set.
+        required: false
+        type: path
+'''
+
+    # Options of LXD_WORKER_ARGS
+    WORKER = '''
+options:
+    worker_idle_timeout:
+        description:
+          - Seconds without requests after which the worker started for
+            I(worker_socket) exits.
+        required: false
+        type: int
+        default: 600
+    worker_socket:
+        description:
+          - Path of a unix domain socket on the target host the module run
+            is handed to a long-lived worker through, so repeated runs
+            reuse its connection to the LXD server and the server metadata
+            it has read.
+          - A worker is started in the background if none listens on the
+            socket. It runs as the user of the module, so every user
+            needs its own path.
+          - The worker keeps the I(max_requests) of its first run per
+            server.
+          - A worker running other module_utils than the module, e.g.
+            after the role was updated, exits and a new one is started.
+        required: false
+        type: path
+'''
+
+    # Options of LXD_SCHEMA_ARGS
+    SCHEMA_CACHE = '''
+options:
+    schema_cache:
+        description:
+          - Path of a file on the target host the config key schema of the
+            LXD server, read from /1.0/metadata/configuration, is cached
+            in per LXD version.
+          - The cached schema is used without asking the server. If it
+            finds errors, the version of the server is checked and the
+            schema read again if it was upgraded.
+          - Set an empty string to read the schema on every run.
+        required: false
+        type: path
+        default: '"{}/.config/lxc/schema_cache.json" .format(os.environ["HOME"])'
+'''
@@ -0,0 +1,397 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# (c) 2024, Mikhail Shurutov <shurutov@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+
+DOCUMENTATION = '''
+---
+module: libvirt_domains
+short_description: Manage many libvirt domains at once
+version_added: "2.15"
+description:
+  - Management of libvirt domains in bulk.
+  - One connection to libvirt is opened and the defined domains are listed
+    once. The XML of every VM is built from the I(vms) structure and
+    compared with the persistent XML of the domain, only domains which
+    differ are defined again.
+  - Only what is given for a VM is compared, the UUID, device addresses,
+    controllers and other defaults libvirt fills in are ignored. Sizes are
+    compared in KiB whatever the unit given is.
+author: "Mikhail Shurutov"
+requirements:
+  - libvirt-python
+options:
+    propose_pinning:
+        description:
+          - Read the NUMA topology of the host from
+            C(/sys/devices/system/node) and return NUMA-local pinning of
+            the VMs in I(pinning).
+          - The proposal is not applied, put it in the I(tuning) of the
+            VMs to use it.
+        required: false
+        type: bool
+        default: false
+    uri:
+        description:
+          - The libvirt connection URI.
+        required: false
+        type: str
+        default: qemu:///system
+    vms:
+        description:
+          - List of VMs, in the structure of the libvirt_libvirt_vms role
+            variable.
+          - Every item accepts the I(type) and I(vmid) of the domain and
+            the I(general), I(osboot), I(sysinfo), I(cpu), I(iothreads),
+            I(memory), I(numa) and I(devices) domain XML sections, the
+            domain name is the I(name) entry of I(general).
+          - I(cpu), I(iothreads), I(memory) and I(numa) are lists of
+            elements put in the domain as they are, e.g. C(vcpu) and
+            C(cputune), C(iothreads) and C(iothreadids), C(memtune) and
+            C(memoryBacking), C(numatune). I(devices) is a list of
+            elements put in the C(devices) element of the domain.
+          - An element of a section is a dict with its tag in I(name), its
+            attributes in I(attrs) as a list of I(name) and I(value)
+            pairs, its text in I(value) and its child elements in
+            I(parameters).
+          - I(tuning) is a dict of performance tuning keys which are
+            validated and written to the domain XML. I(iothreads) is the
+            number of IOThreads, I(iothreadpin) and I(vcpupin) map
+            IOThread ids from 1 and vCPU ids from 0 to cpusets,
+            I(emulatorpin) is a cpuset. I(hugepages) is C(true) or a dict
+            of the page I(size), I(unit) and I(nodeset). I(numatune) is a
+            dict of the memory I(mode) and I(nodeset). I(net_queues) and
+            I(blk_queues) are the numbers of queues of virtio interfaces
+            and disks.
+          - Elements written from I(tuning) cannot be given in the
+            sections as well.
+          - I(autostart) is whether the domain is started on boot of the
+            host, C(false) by default.
+          - I(state) is one of C(running), C(shutdown), C(destroyed) or
+            C(paused), C(shutdown) by default.
+        required: true
+        type: list
+        elements: dict
+notes:
+  - A domain defined again while running gets the new XML on its next
+    start.
+  - Check mode is supported, the domain XML is only compared.
+'''
+
+EXAMPLES = '''
+# An example for defining libvirt VMs
+- hosts: kvm_hosts
+  tasks:
+    - name: Define VMs
+      libvirt_domains:
+        vms:
+          - type: kvm
+            autostart: true
+            state: running
+            general:
+              - name: name
+                value: vm1
+              - name: memory
+                attrs:
+                  - name: unit
+                    value: GiB
+                value: 2
+              - name: vcpu
+                value: 2
+            osboot:
+              head:
+                name: os
+              type:
+                name: type
+                attrs:
+                  - name: arch
+                    value: x86_64
+                value: hvm
+              parameters:
+                - name: boot
+                  attrs:
+                    - name: dev
+                      value: hd
+            tuning:
+              iothreads: 1
+              vcpupin:
+                0: 2
+                1: 3
+              emulatorpin: 0-1
+              hugepages:
+                size: 2
+                unit: MiB
+              numatune:
+                mode: strict
+                nodeset: 0
+              blk_queues: 2
+            devices:
+              - name: disk
+                attrs:
+                  - name: type
+                    value: file
+                  - name: device
+                    value: disk
+                parameters:
+                  - name: source
+                    attrs:
+                      - name: file
+                        value: /var/lib/libvirt/images/vm1.qcow2
+                  - name: target
+                    attrs:
+                      - name: dev
+                        value: vda
+                      - name: bus
+                        value: virtio
+'''
+
+RETURN = '''
+old_state:
+  description:
+    - The state of every domain before the module run, one of C(absent),
+      C(running), C(shutdown) or C(paused).
+  returned: success
+  type: dict
+  sample: '{"vm1": "absent", "vm2": "running"}'
+actions:
+  description:
+    - List of actions performed per domain, C(define), C(autostart),
+      C(noautostart), C(start), C(resume), C(shutdown), C(destroy) and
+      C(suspend).
+  returned: success
+  type: dict
+  sample: '{"vm1": ["define", "autostart", "start"], "vm2": []}'
+pinning:
+  description:
+    - NUMA-local I(tuning) keys proposed per VM.
+  returned: when I(propose_pinning) is set and the host has NUMA nodes.
+  type: dict
+  sample: '{"vm1": {"vcpupin": {"0": "0", "1": "1"}, "emulatorpin": "0-7",
+                    "numatune": {"mode": "strict", "nodeset": "0"}}}'
+diff:
+  description:
+    - The canonical XML of every defined domain before and after, with the
+      domain name in the headers.
+  returned: when ansible-playbook is invoked with --diff.
+  type: list
+  sample: '[{"before": "", "after": "<domain type=\\"kvm\\">...</domain>",
+             "before_header": "vm1", "after_header": "vm1"}]'
+'''
+
+import copy
+import xml.etree.ElementTree as ET
+
+from ansible.module_utils.basic import AnsibleModule, missing_required_lib
+from ansible.module_utils.common.text.converters import to_native, to_text
+from ansible.module_utils.libvirt_domain import (
+    LibvirtDomainException, build_domain, canonical_xml, canonicalize, domain_differs, vm_name
+)
+from ansible.module_utils.libvirt_numa import NODE_ROOT, numa_topology, propose_pinning
+
+try:
+    import libvirt
+except ImportError:
+    HAS_LIBVIRT = False
+else:
+    HAS_LIBVIRT = True
+
+
+# DOMAIN_STATES is a list of states supported.
+DOMAIN_STATES = [
+    'running', 'shutdown', 'destroyed', 'paused'
+]
+
+# LIBVIRT_STATES maps libvirt domain states to module states.
+LIBVIRT_STATES = {
+    1: 'running',   # VIR_DOMAIN_RUNNING
+    2: 'running',   # VIR_DOMAIN_BLOCKED
+    3: 'paused',    # VIR_DOMAIN_PAUSED
+    4: 'running',   # VIR_DOMAIN_SHUTDOWN, being shut down
+    5: 'shutdown',  # VIR_DOMAIN_SHUTOFF
+    6: 'shutdown',  # VIR_DOMAIN_CRASHED
+    7: 'paused',    # VIR_DOMAIN_PMSUSPENDED
+}
+
+# STATE_ACTIONS maps (current state, desired state) pairs to actions.
+STATE_ACTIONS = {
+    ('shutdown', 'running'): ['start'],
+    ('paused', 'running'): ['resume'],
+    ('running', 'shutdown'): ['shutdown'],
+    ('paused', 'shutdown'): ['shutdown'],
+    ('running', 'destroyed'): ['destroy'],
+    ('paused', 'destroyed'): ['destroy'],
+    ('shutdown', 'paused'): ['start', 'suspend'],
+    ('running', 'paused'): ['suspend'],
+}
+
+
+class LibvirtDomainsManagement(object):
+    def __init__(self, module):
+        """Management of many libvirt domains via Ansible.
+
+        :param module: Processed Ansible Module.
+        :type module: ``object``
+        """
+        self.module = module
+        self.uri = self.module.params['uri']
+        self.vms = self.module.params['vms']
+        self.conn = None
+        self.actions = {}
+        self.old_state = {}
+        self.diffs = []
+
+    def _domain_state(self, domain):
+        if domain is None:
+            return 'absent'
+        return LIBVIRT_STATES.get(domain.state()[0], 'shutdown')
+
+    def _build_domains(self):
+        desired = []
+        for vm in self.vms:
+            name = vm_name(vm)
+            try:
+                desired.append(build_domain(vm))
+            except LibvirtDomainException as e:
+                raise LibvirtDomainException('{0}: {1}'.format(name, e.msg))
+        return desired
+
+    def _define(self, name, desired, domain):
+        if domain is not None:
+            actual = canonicalize(ET.fromstring(domain.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE)))
+            if not domain_differs(canonicalize(copy.deepcopy(desired)), actual):
+                return domain
+            # A domain is redefined by name only with the same UUID
+            if desired.find('uuid') is None:
+                ET.SubElement(desired, 'uuid').text = actual.findtext('uuid')
+        self.actions[name].append('define')
+        if self.module._diff:
+            self.diffs.append({
+                'before': canonical_xml(actual) if domain is not None else '',
+                'after': canonical_xml(copy.deepcopy(desired)),
+                'before_header': name,
+                'after_header': name
+            })
+        if self.module.check_mode:
+            return domain
+        return self.conn.defineXML(to_native(ET.tostring(desired)))
+
+    def _set_autostart(self, name, vm, domain):
+        autostart = bool(vm.get('autostart', False))
+        current = bool(domain.autostart()) if domain is not None else False
+        if autostart == current:
+            return
+        self.actions[name].append('autostart' if autostart else 'noautostart')
+        if not self.module.check_mode:
+            domain.setAutostart(1 if autostart else 0)
+
+    def _set_state(self, name, vm, domain):
+        state = vm.get('state', None) or 'shutdown'
+        if state not in DOMAIN_STATES:
+            raise LibvirtDomainException(
+                'state of {0} must be one of {1}, got {2}'.format(name, ', '.join(DOMAIN_STATES), state)
+            )
+        current = self._domain_state(domain)
+        if current == 'absent':
+            current = 'shutdown'
+        for action in STATE_ACTIONS.get((current, state), []):
+            self.actions[name].append(action)
+            if self.module.check_mode:
+                continue
+            if action == 'start':
+                domain.create()
+            elif action == 'resume':
+                domain.resume()
+            elif action == 'shutdown':
+                domain.shutdown()
+            elif action == 'destroy':
+                domain.destroy()
+            else:
+                domain.suspend()
+
+    def _state_changed(self):
+        return any(len(actions) > 0 for actions in self.actions.values())
+
+    def run(self):
+        """Run the main method."""
+
+        try:
+            # All VMs are checked before any domain is touched
+            desired_domains = self._build_domains()
+            self.conn = libvirt.open(self.uri)
+            domains = dict((to_text(d.name()), d) for d in self.conn.listAllDomains())
+            for vm, desired in zip(self.vms, desired_domains):
+                name = vm_name(vm)
+                domain = domains.get(name, None)
+                self.old_state[name] = self._domain_state(domain)
+                self.actions[name] = []
+                domain = self._define(name, desired, domain)
+                self._set_autostart(name, vm, domain)
+                self._set_state(name, vm, domain)
+
+            result_json = {
+                'changed': self._state_changed(),
+                'old_state': self.old_state,
+                'actions': self.actions
+            }
+            if self.module._diff:
+                result_json['diff'] = self.diffs
+            if self.module.params['propose_pinning']:
+                topology = numa_topology()
+                if topology:
+                    result_json['pinning'] = propose_pinning(topology, self.vms)
+                else:
+                    self.module.warn('No NUMA topology found in {0}, no pinning is proposed'.format(NODE_ROOT))
+            self.module.exit_json(**result_json)
+        except (LibvirtDomainException, libvirt.libvirtError) as e:
+            fail_params = {
+                'msg': getattr(e, 'msg', None) or to_text(e),
+                'changed': self._state_changed(),
+                'actions': self.actions
+            }
+            self.module.fail_json(**fail_params)
+        finally:
+            if self.conn is not None:
+                self.conn.close()
+
+
+def main():
+    """Ansible Main module."""
+
+    module = AnsibleModule(
+        argument_spec=dict(
+            propose_pinning=dict(
+                type='bool',
+                default=False
+            ),
+            uri=dict(
+                type='str',
+                default='qemu:///system'
+            ),
+            vms=dict(
+                type='list',
+                elements='dict',
+                required=True
+            )
+        ),
+        supports_check_mode=True,
+    )
+
+    if not HAS_LIBVIRT:
+        module.fail_json(msg=missing_required_lib('libvirt-python'))
+
+    libvirt_manage = LibvirtDomainsManagement(module=module)
+    libvirt_manage.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# (c) 2024, Mikhail Shurutov <shurutov@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+
+DOCUMENTATION = '''
+---
+module: lxd_bootstrap
+short_description: Install python into LXD instances
+version_added: "2.15"
+description:
+  - Makes /usr/bin/python available in LXD instances, so Ansible can
+    manage them directly.
+  - Commands are run through the LXD exec API
+    POST /1.0/instances/<name>/exec
+    in up to I(max_parallel) instances at the same time.
+  - Every instance is probed first and instances where /usr/bin/python
+    already works are skipped.
+author: "Mikhail Shurutov"
+options:
+    instances:
+        description:
+          - List of running instances to bootstrap.
+          - Only the I(name), I(project), I(distro) and I(source) keys of
+            an item are used, so items of libvirt_lxd_hosts can be passed
+            as is.
+          - If I(distro) is not set, it is guessed from I(source.alias) -
+            C(debian), C(alt) and C(gentoo) are recognized, any other
+            distro is C(generic).
+        required: true
+        type: list
+        elements: dict
+    max_parallel:
+        description:
+          - Maximum number of instances bootstrapped at the same time.
+        required: false
+        type: int
+        default: 4
+    timeout:
+        description:
+          - Seconds to wait for every command run in an instance.
+        required: false
+        type: int
+        default: 300
+extends_documentation_fragment:
+  - lxd_common
+notes:
+  - C(debian) and C(alt) instances get the python3 package installed.
+    C(debian) and C(generic) instances get /usr/bin/python set by
+    update-alternatives, C(alt) instances by their alternatives files.
+    Nothing is run in C(gentoo) instances.
+'''
+
+EXAMPLES = '''
+# An example for bootstrapping python in containers
+- hosts: localhost
+  connection: local
+  tasks:
+    - name: Bootstrap python
+      lxd_bootstrap:
+        instances:
+          - name: web1
+            source:
+              alias: debian/12
+          - name: web2
+            distro: alt
+'''
+
+RETURN = '''
+old_state:
+  description:
+    - Whether /usr/bin/python worked before, C(present) or C(absent), keyed
+      by instance name.
+  returned: success
+  type: dict
+  sample: '{"web1": "absent", "web2": "present"}'
+actions:
+  description: Lists of bootstrap steps run in the instances keyed by name.
+  returned: success
+  type: dict
+  sample: '{"web1": ["install_python", "set_python_alternative"], "web2": []}'
+timings:
+  description: Seconds spent to bootstrap every instance keyed by name.
+  returned: success
+  type: dict
+  sample: '{"web1": 14.2, "web2": 0.08}'
+logs:
+  description:
+    - The last I(log_max_entries) requests sent to the LXD server.
+    - Every entry has the C(method), C(url), response C(status) and
+      C(etag), C(bytes_sent), C(bytes_received), the duration in seconds
+      in C(elapsed), whether the kept-alive connection was C(reused) or
+      C(new), and the C(request) and C(response) bodies cut to
+      I(log_max_body) characters.
+  returned: when ansible-playbook is invoked with -vvvv.
+  type: list
+  sample: "(too long to be placed here)"
+retries:
+  description:
+    - Number of requests retried after transient errors as C(count), and
+      the seconds spent backing off before them as C(backoff).
+  returned: when a request was retried.
+  type: dict
+  sample: '{"count": 2, "backoff": 0.274}'
+'''
+
+import re
+import time
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.lxd_client import (
+    LXDClient, LXDClientException, request_limiter, request_log, run_concurrently
+)
+from ansible.module_utils.lxd_common import lxd_argument_spec
+from ansible.module_utils.lxd_timings import report_retries
+from ansible.module_utils.six.moves.urllib.parse import urlencode
+
+
+# BOOTSTRAP_PROBE exits with 0 if /usr/bin/python is a working interpreter.
+BOOTSTRAP_PROBE = [
+    '/bin/sh', '-c', '/usr/bin/python -c "import sys" >/dev/null 2>&1'
+]
+
+# BOOTSTRAP_STEPS is a list of (action, command) pairs run per distro.
+BOOTSTRAP_STEPS = {
+    'debian': [
+        ('install_python', ['apt-get', 'install', '-y', 'python3']),
+        ('set_python_alternative', [
+            'update-alternatives', '--install', '/usr/bin/python', 'python', '/usr/bin/python3', '3'
+        ]),
+    ],
+    'alt': [
+        ('install_python', ['apt-get', 'install', '-y', 'python3']),
+        ('set_python_alternative', [
+            '/bin/sh', '-c',
+            "printf '/usr/bin/python\\t/usr/bin/python3\\t200\\n' > /etc/alternatives/packages.d/python"
+        ]),
+        ('validate_alternatives', ['alternatives-validate']),
+        ('update_alternatives', ['alternatives-update']),
+    ],
+    'gentoo': [],
+    'generic': [
+        ('set_python_alternative', [
+            'update-alternatives', '--install', '/usr/bin/python', 'python', '/usr/bin/python3', '3'
+        ]),
+    ],
+}
+
+# BOOTSTRAP_ENVIRONMENT is passed to every command, LXD adds a default PATH.
+BOOTSTRAP_ENVIRONMENT = {
+    'DEBIAN_FRONTEND': 'noninteractive'
+}
+
+
+class LXDBootstrap(object):
+    def __init__(self, module):
+        """Bootstrap of python in LXD instances via Ansible.
+
+        :param module: Processed Ansible Module.
+        :type module: ``object``
+        """
+        self.module = module
+        self.cert_file = self.module.params.get('client_cert', None)
+        self.key_file = self.module.params.get('client_key', None)
+        self.instances = self.module.params['instances']
+        self.max_parallel = self.module.params['max_parallel']
+        self.timeout = self.module.params['timeout']
+        self.trust_password = self.module.params.get('trust_password', None)
+        self.url = self.module.params['url']
+        self.debug = self.module._verbosity >= 4
+        try:
+            self.client = LXDClient(
+                self.url, key_file=self.key_file, cert_file=self.cert_file,
+                debug=self.debug, log=request_log(self.module.params, self.debug),
+                limiter=request_limiter(self.module.params),
+                retry_timeout=self.module.params.get('retry_timeout', None)
+            )
+        except LXDClientException as e:
+            self.module.fail_json(msg=e.msg)
+        self.actions = {}
+        self.old_state = {}
+        self.timings = {}
+
+    @staticmethod
+    def _distro(instance):
+        if instance.get('distro', None) is not None:
+            return instance['distro']
+        alias = ((instance.get('source', None) or {}).get('alias', None) or '').lower()
+        for distro in ('debian', 'alt', 'gentoo'):
+            if re.search(distro, alias):
+                return distro
+        return 'generic'
+
+    def _exec(self, client, instance, command):
+        """Run a command in an instance.
+
+        :returns: Exit code of the command.
+        :rtype: ``int``
+        """
+        url = '/1.0/instances/{0}/exec'.format(instance['name'])
+        if instance.get('project', None) is not None:
+            url = '{0}?{1}'.format(url, urlencode({'project': instance['project']}))
+        body_json = {
+            'command': command,
+            'environment': BOOTSTRAP_ENVIRONMENT,
+            'interactive': False,
+            'record-output': False,
+            'wait-for-websocket': False
+        }
+        resp_json = client.do('POST', url, body_json, wait_timeout=self.timeout)
+        return (resp_json['metadata'].get('metadata', None) or {}).get('return', -1)
+
+    def _bootstrap_instance(self, client, instance):
+        name = instance['name']
+        actions = self.actions[name]
+        if self._exec(client, instance, BOOTSTRAP_PROBE) == 0:
+            self.old_state[name] = 'present'
+            return
+        self.old_state[name] = 'absent'
+        distro = self._distro(instance)
+        if not BOOTSTRAP_STEPS[distro]:
+            raise LXDClientException(
+                '/usr/bin/python is not found and no bootstrap is known for {0}'.format(distro)
+            )
+        for action, command in BOOTSTRAP_STEPS[distro]:
+            if not self.module.check_mode:
+                code = self._exec(client, instance, command)
+                if code != 0:
+                    raise LXDClientException(
+                        '{0} exited with {1}'.format(' '.join(command), code)
+                    )
+            actions.append(action)
+        if not self.module.check_mode and self._exec(client, instance, BOOTSTRAP_PROBE) != 0:
+            raise LXDClientException('/usr/bin/python does not work after bootstrap')
+
+    def _reconcile_instance(self, client, instance):
+        started = time.time()
+        try:
+            self._bootstrap_instance(client, instance)
+        finally:
+            self.timings[instance['name']] = round(time.time() - started, 6)
+
+    def _state_changed(self):
+        return any(len(actions) > 0 for actions in self.actions.values())
+
+    def run(self):
+        """Run the main method."""
+
+        try:
+            if self.trust_password is not None:
+                self.client.authenticate(
+                    self.trust_password, self.module.params.get('auth_cache', None)
+                )
+
+            for instance in self.instances:
+                if 'name' not in instance:
+                    self.module.fail_json(msg='every item of instances must have a name')
+                if self._distro(instance) not in BOOTSTRAP_STEPS:
+                    self.module.fail_json(
+                        msg='unknown distro {0} of {1}'.format(self._distro(instance), instance['name'])
+                    )
+                self.actions[instance['name']] = []
+
+            calls = [
+                lambda client, instance=instance: self._reconcile_instance(client, instance)
+                for instance in self.instances
+            ]
+            results = run_concurrently(self.client, calls, self.max_parallel)
+            errors = [
+                '{0}: {1}'.format(instance['name'], e.msg)
+                for instance, (dummy, e) in zip(self.instances, results)
+                if e is not None
+            ]
+
+            state_changed = self._state_changed()
+            result_json = {
+                'changed': state_changed,
+                'old_state': self.old_state,
+                'actions': self.actions,
+                'timings': self.timings
+            }
+            report_retries(self.client, result_json)
+            if self.client.debug:
+                result_json['logs'] = self.client.logs
+            if errors:
+                self.module.fail_json(msg='; '.join(errors), **result_json)
+            self.module.exit_json(**result_json)
+        except LXDClientException as e:
+            state_changed = self._state_changed()
+            fail_params = {
+                'msg': e.msg,
+                'changed': state_changed,
+                'actions': self.actions
+            }
+            report_retries(self.client, fail_params)
+            if self.client.debug:
+                fail_params['logs'] = e.kwargs.get('logs', self.client.logs)
+            self.module.fail_json(**fail_params)
+
+
+def main():
+    """Ansible Main module."""
+
+    argument_spec = lxd_argument_spec()
+    argument_spec.update(
+        instances=dict(
+            type='list',
+            elements='dict',
+            required=True
+        ),
+        max_parallel=dict(
+            type='int',
+            default=4
+        ),
+        timeout=dict(
+            type='int',
+            default=300
+        )
+    )
+
+    module = AnsibleModule(
+        argument_spec=argument_spec,
+        supports_check_mode=True,
+    )
+
+    lxd_manage = LXDBootstrap(module=module)
+    lxd_manage.run()
+
+
+if __name__ == '__main__':
+    main()
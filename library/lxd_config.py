@@ -22,18 +22,6 @@ description:
   - Management of LXD config parameters
 author: "Michail Shurutov"
 options:
-    client_cert:
-        description:
-          - The client certificate file path.
-        required: false
-        default: '"{}/.config/lxc/client.crt" .format(os.environ["HOME"])'
-        aliases: [ cert_file ]
-    client_key:
-        description:
-          - The client certificate key file path.
-        required: false
-        default: '"{}/.config/lxc/client.key" .format(os.environ["HOME"])'
-        aliases: [ key_file ]
     config:
         description:
           - 'The config parameters (e.g. {"core.https_address": "192.168.0.1:8443"}).
@@ -46,25 +34,54 @@ options:
             a value of none will be defaulted.
         required: true
         default: {'ipv4.address': none, 'ipv6.address': none}
-    trust_password:
+    state_cache:
         description:
-          - The client trusted password.
-          - You need to set this password on the LXD server before
-            running this module using the following command.
-            lxc config set core.trust_password <some random password>
-            See U(https://www.stgraber.org/2016/04/18/lxd-api-direct-interaction/)
-          - If trust_password is set, this module send a request for
-            authentication before sending any requests.
+          - Path of a file caching the ETag of the server configuration
+            which matched the desired state on the last run.
+          - If both the ETag and the desired state are unchanged, the
+            response is neither decoded nor compared.
+          - The file is kept on the host the module runs on. Delegate the
+            task to the controller with a https I(url) to keep it there.
         required: false
-    url:
+    update_mode:
+        choices:
+          - patch
+          - put
         description:
-          - The unix domain socket path or the https URL for the LXD server.
+          - How the configuration of an existing server configuration is updated.
+          - C(patch) sends only the changed I(config) keys with
+            PATCH, keys which are not listed are kept as is.
+          - C(put) sends the whole server configuration with PUT, as earlier versions of
+            this module did, so I(config) keys which are not listed are
+            removed.
+          - Values are compared as LXD reads them, e.g. C(yes) equals
+            C(true), so only changed keys are sent.
         required: false
-        default: unix:/var/lib/lxd/unix.socket
+        default: patch
+    validate_config:
+        description:
+          - Check the config keys and value types of the server config
+            against the schema of the LXD server before any request
+            changing them is sent, and fail with every error found.
+          - Servers not serving /1.0/metadata/configuration and unknown entities
+            are not checked.
+        required: false
+        type: bool
+        default: true
+extends_documentation_fragment:
+  - lxd_common
+  - lxd_common.timings
+  - lxd_common.worker
+  - lxd_common.schema_cache
 notes:
   - Networks must have a unique name. If you attempt to create a network
     with a name that already existed in the users namespace the module will
     simply return as "unchanged".
+  - Updates are sent with the If-Match header carrying the ETag of the
+    server configuration, so an update fails instead of overwriting a
+    concurrent change.
+  - In check mode nothing is written to LXD, I(diff) shows the planned
+    changes.
 '''
 
 EXAMPLES = '''
@@ -98,156 +115,94 @@ EXAMPLES = '''
 '''
 
 RETURN = '''
+timings:
+  description:
+    - Time spent by the module run. C(total) is the wall time in seconds
+      since the connection to the LXD server was set up.
+    - C(phases) holds the seconds spent to C(authenticate), C(read)
+      objects, compute the C(diff), C(write) changes and save the
+      C(cache). Time spent in a C(read) or C(write) during the C(diff) is
+      not counted in the C(diff).
+    - C(requests) sums the count, the latency in seconds and the bytes sent
+      and received of all requests, C(calls) lists every request with the
+      phase it was sent in.
+    - C(retries) counts the requests retried after transient errors and
+      the seconds spent backing off before them.
+  returned: when I(timings) is set.
+  type: dict
+  sample: '{"total": 0.052, "phases": {"read": 0.004, "diff": 0.001, "write": 0.041},
+            "requests": {"count": 3, "elapsed": 0.044, "bytes_sent": 61, "bytes_received": 2418},
+            "calls": [{"method": "GET", "url": "/1.0/networks?recursion=1", "status": 200, "phase": "read",
+                       "elapsed": 0.004, "bytes_sent": 0, "bytes_received": 2177}]}'
 logs:
-  description: The logs of requests and responses.
+  description:
+    - The last I(log_max_entries) requests sent to the LXD server.
+    - Every entry has the C(method), C(url), response C(status) and
+      C(etag), C(bytes_sent), C(bytes_received), the duration in seconds
+      in C(elapsed), whether the kept-alive connection was C(reused) or
+      C(new), and the C(request) and C(response) bodies cut to
+      I(log_max_body) characters.
   returned: when ansible-playbook is invoked with -vvvv.
   type: list
   sample: "(too long to be placed here)"
+diff:
+  description:
+    - Key-level changes applied to the configuration of the server.
+  returned: success
+  type: dict
+  sample: '{"before": {"config": {"core.https_address": "192.168.0.1:8443"}}, "after": {"config": {"core.https_address": "192.168.0.2:8443"}}}'
 actions:
   description: List of actions performed for the network.
   returned: success
   type: list
   sample: '["create"]'
+retries:
+  description:
+    - Number of requests retried after transient errors as C(count), and
+      the seconds spent backing off before them as C(backoff).
+  returned: when a request was retried.
+  type: dict
+  sample: '{"count": 2, "backoff": 0.274}'
 '''
 
-import os
-
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.lxd import LXDClient, LXDClientException
-
-# CONFIG_PARAMS is a list of config attribute names.
-CONFIG_PARAMS = [
-    'config'
-]
-
-# CONFIG_DEFAULTS is the default config deployed.
-CONFIG_DEFAULTS = {}
-
-
-class LXDConfig(object):
-    def __init__(self, module):
-        """Management of LXC containers via Ansible.
-
-        :param module: Processed Ansible Module.
-        :type module: ``object``
-        """
-        self.module = module
-        self.cert_file = self.module.params.get('client_cert', None)
-        self.key_file = self.module.params.get('client_key', None)
-        self._build_config()
-        self.trust_password = self.module.params.get('trust_password', None)
-        self.url = self.module.params['url']
-        self.debug = self.module._verbosity >= 4
-        try:
-            self.client = LXDClient(
-                self.url, key_file=self.key_file, cert_file=self.cert_file,
-                debug=self.debug
-            )
-        except LXDClientException as e:
-            self.module.fail_json(msg=e.msg)
-        self.actions = []
-
-    def _build_config(self):
-        self.config = {}
-        for attr in CONFIG_PARAMS:
-            param_val = self.module.params.get(attr, None)
-            if attr == 'config':
-                if param_val is None:
-                    param_val = {}
-                CONFIG_DEFAULTS.update(param_val)
-                param_val = CONFIG_DEFAULTS
-            if param_val is not None:
-                self.config[attr] = param_val
-
-    def _get_config_json(self):
-        return self.client.do(
-            'GET', '/1.0'.format(self),
-            ok_error_codes=[404]
-        )
-
-    def _update_config(self):
-        if self._needs_to_apply_config_configs():
-            self._apply_config_configs()
-
-    def _needs_to_change_config_config(self, key):
-        if key not in self.config:
-            return False
-        old_configs = self.old_config_json['metadata'].get(key, None)
-        return self.config[key] != old_configs
-
-    def _needs_to_apply_config_configs(self):
-        return (
-            self._needs_to_change_config_config('config')
-        )
-
-    def _apply_config_configs(self):
-        config = self.old_config_json.copy()
-        for k, v in self.config.items():
-            config[k] = v
-        self.client.do('PUT', '/1.0'.format(self), config)
-        self.actions.append('apply_config_configs')
-
-    def run(self):
-        """Run the main method."""
-
-        try:
-            if self.trust_password is not None:
-                self.client.authenticate(self.trust_password)
-
-            self.old_config_json = self._get_config_json()
-
-            self._update_config()
-
-            state_changed = len(self.actions) > 0
-            result_json = {
-                'changed': state_changed,
-                'actions': self.actions
-            }
-            if self.client.debug:
-                result_json['logs'] = self.client.logs
-            self.module.exit_json(**result_json)
-        except LXDClientException as e:
-            state_changed = len(self.actions) > 0
-            fail_params = {
-                'msg': e.msg,
-                'changed': state_changed,
-                'actions': self.actions
-            }
-            if self.client.debug:
-                fail_params['logs'] = e.kwargs['logs']
-            self.module.fail_json(**fail_params)
+from ansible.module_utils.lxd_common import (
+    LXD_SCHEMA_ARGS, LXD_TIMINGS_ARGS, LXD_WORKER_ARGS, lxd_argument_spec
+)
+from ansible.module_utils.lxd_diff import UPDATE_MODES
+from ansible.module_utils.lxd_config_engine import LXDConfig
+from ansible.module_utils.lxd_worker import run_in_worker
 
 
 def main():
     """Ansible Main module."""
 
-    module = AnsibleModule(
-        argument_spec=dict(
-            client_cert=dict(
-                type='str',
-                default='{}/.config/lxc/client.crt'.format(os.environ['HOME']),
-                aliases=['cert_file']
-            ),
-            client_key=dict(
-                type='str',
-                default='{}/.config/lxc/client.key'.format(os.environ['HOME']),
-                aliases=['key_file']
-            ),
-            config=dict(
-                type='dict',
-            ),
-            trust_password=dict(
-                type='str',
-                no_log=True
-            ),
-            url=dict(
-                type='str',
-                default='unix:/var/lib/lxd/unix.socket'
-            )
+    argument_spec = lxd_argument_spec(LXD_TIMINGS_ARGS, LXD_WORKER_ARGS, LXD_SCHEMA_ARGS)
+    argument_spec.update(
+        config=dict(
+            type='dict',
+        ),
+        state_cache=dict(
+            type='path',
         ),
+        update_mode=dict(
+            choices=UPDATE_MODES,
+            default='patch'
+        ),
+        validate_config=dict(
+            type='bool',
+            default=True
+        )
+    )
+
+    module = AnsibleModule(
+        argument_spec=argument_spec,
         supports_check_mode=True,
     )
 
+    if module.params['worker_socket'] is not None:
+        run_in_worker(module, 'config')
+
     lxd_manage = LXDConfig(module=module)
     lxd_manage.run()
 
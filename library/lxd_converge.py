@@ -0,0 +1,292 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# (c) 2024, Mikhail Shurutov <shurutov@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+
+DOCUMENTATION = '''
+---
+module: lxd_converge
+short_description: Converge LXD server config, storage pools, networks, projects and profiles at once
+version_added: "2.15"
+description:
+  - Runs lxd_config, lxd_storage, lxd_network, lxd_projects and
+    lxd_profiles in one module run, so the whole LXD server setup of a
+    host costs one remote execution.
+  - All of them share one connection to the LXD server.
+  - The server config is converged first, then storage pools, networks,
+    projects and profiles. Kinds of objects which are not given are
+    skipped.
+author: "Mikhail Shurutov"
+options:
+    config:
+        description:
+          - The server config, as the I(config) option of lxd_config.
+        required: false
+        type: dict
+    max_parallel:
+        description:
+          - Maximum number of storage pools created at the same time, as
+            the I(max_parallel) option of lxd_storage.
+        required: false
+        type: int
+        default: 1
+    merge_profile:
+        description:
+          - Whether I(profiles) are merged into existing profiles, as the
+            I(merge_profile) option of lxd_profiles.
+        required: false
+        type: bool
+        default: false
+    merge_project:
+        description:
+          - Whether I(projects) are merged into existing projects, as the
+            I(merge_project) option of lxd_projects.
+        required: false
+        type: bool
+        default: false
+    networks:
+        description:
+          - List of networks, as the I(networks) option of lxd_network.
+        required: false
+        type: list
+        elements: dict
+    pools:
+        description:
+          - List of storage pools, as the I(pools) option of lxd_storage.
+        required: false
+        type: list
+        elements: dict
+    profiles:
+        description:
+          - List of profiles, as the I(profiles) option of lxd_profiles.
+        required: false
+        type: list
+        elements: dict
+    projects:
+        description:
+          - List of projects, as the I(projects) option of lxd_projects.
+        required: false
+        type: list
+        elements: dict
+    rename:
+        description:
+          - Whether I(new_name) of I(networks) items is applied, as the
+            I(rename) option of lxd_network.
+        required: false
+        type: bool
+        default: true
+    state_cache:
+        description:
+          - Path of a file caching the ETag of the server config when it
+            matched I(config) on the last run, as the I(state_cache) option
+            of lxd_config.
+          - The recursive listings of the other kinds carry no ETags, their
+            items are always compared.
+        required: false
+        type: path
+    update_mode:
+        choices:
+          - patch
+          - put
+        description:
+          - How existing objects are updated, see lxd_config.
+        required: false
+        default: patch
+    validate_config:
+        description:
+          - Check the config keys and value types of the server config,
+            storage pools and networks against the schema of the LXD
+            server before any request changing them is sent, and fail with
+            every error found.
+          - All kinds are checked before the first one is converged.
+            Projects, profiles and servers not serving
+            /1.0/metadata/configuration are not checked.
+        required: false
+        type: bool
+        default: true
+    wait_timeout:
+        description:
+          - Seconds to wait for asynchronous operations, as the
+            I(wait_timeout) option of lxd_storage and lxd_network.
+        required: false
+        type: int
+extends_documentation_fragment:
+  - lxd_common
+  - lxd_common.timings
+  - lxd_common.worker
+  - lxd_common.schema_cache
+notes:
+  - Check mode is supported the same way as by the converged modules.
+'''
+
+EXAMPLES = '''
+# An example for converging a LXD server in one task
+- hosts: lxd_hosts
+  tasks:
+    - name: Converge LXD server
+      lxd_converge:
+        config:
+          core.https_address: "[::]:8443"
+        pools:
+          - name: default
+            driver: dir
+        networks:
+          - name: lxdbr0
+            type: bridge
+            config:
+              ipv4.address: 10.0.3.1/24
+'''
+
+RETURN = '''
+converged:
+  description:
+    - Results of the converged kinds of objects keyed by C(config),
+      C(pools), C(networks), C(projects) and C(profiles), every one as
+      returned by the module converging the kind.
+  returned: success
+  type: dict
+  sample: '{"config": {"changed": false, "actions": []},
+            "pools": {"changed": true, "actions": {"default": ["create"]}, "old_state": {"default": "absent"}}}'
+diff:
+  description:
+    - Key-level changes of all converged objects with the kind or the
+      name of every object in the headers.
+  returned: success
+  type: list
+  sample: '[{"before": {"config": {"rsync.bwlimit": "0"}}, "after": {"config": {"rsync.bwlimit": "100MiB"}},
+             "before_header": "default", "after_header": "default"}]'
+timings:
+  description:
+    - Time spent by the module run. C(total) is the wall time in seconds
+      since the connection to the LXD server was set up.
+    - C(phases) holds the seconds spent to C(authenticate), C(read)
+      objects, compute the C(diff), C(write) changes and save the
+      C(cache). Time spent in a C(read) or C(write) during the C(diff) is
+      not counted in the C(diff).
+    - C(requests) sums the count, the latency in seconds and the bytes sent
+      and received of all requests, C(calls) lists every request with the
+      phase it was sent in.
+    - C(retries) counts the requests retried after transient errors and
+      the seconds spent backing off before them.
+  returned: when I(timings) is set.
+  type: dict
+  sample: '{"total": 0.052, "phases": {"read": 0.004, "diff": 0.001, "write": 0.041},
+            "requests": {"count": 3, "elapsed": 0.044, "bytes_sent": 61, "bytes_received": 2418},
+            "calls": [{"method": "GET", "url": "/1.0/networks?recursion=1", "status": 200, "phase": "read",
+                       "elapsed": 0.004, "bytes_sent": 0, "bytes_received": 2177}]}'
+logs:
+  description:
+    - The last I(log_max_entries) requests sent to the LXD server.
+    - Every entry has the C(method), C(url), response C(status) and
+      C(etag), C(bytes_sent), C(bytes_received), the duration in seconds
+      in C(elapsed), whether the kept-alive connection was C(reused) or
+      C(new), and the C(request) and C(response) bodies cut to
+      I(log_max_body) characters.
+  returned: when ansible-playbook is invoked with -vvvv.
+  type: list
+  sample: "(too long to be placed here)"
+retries:
+  description:
+    - Number of requests retried after transient errors as C(count), and
+      the seconds spent backing off before them as C(backoff).
+  returned: when a request was retried.
+  type: dict
+  sample: '{"count": 2, "backoff": 0.274}'
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.lxd_common import (
+    LXD_SCHEMA_ARGS, LXD_TIMINGS_ARGS, LXD_WORKER_ARGS, lxd_argument_spec
+)
+from ansible.module_utils.lxd_converge_engine import LXDConverge
+from ansible.module_utils.lxd_diff import UPDATE_MODES
+from ansible.module_utils.lxd_network_engine import NETWORK_OPTIONS
+from ansible.module_utils.lxd_profile_engine import PROFILE_OPTIONS, PROJECT_OPTIONS
+from ansible.module_utils.lxd_storage_engine import POOL_OPTIONS
+from ansible.module_utils.lxd_worker import run_in_worker
+
+
+def main():
+    """Ansible Main module."""
+
+    argument_spec = lxd_argument_spec(LXD_TIMINGS_ARGS, LXD_WORKER_ARGS, LXD_SCHEMA_ARGS)
+    argument_spec.update(
+        config=dict(
+            type='dict',
+        ),
+        max_parallel=dict(
+            type='int',
+            default=1
+        ),
+        merge_profile=dict(
+            type='bool',
+            default=False
+        ),
+        merge_project=dict(
+            type='bool',
+            default=False
+        ),
+        networks=dict(
+            type='list',
+            elements='dict',
+            options=NETWORK_OPTIONS,
+        ),
+        pools=dict(
+            type='list',
+            elements='dict',
+            options=POOL_OPTIONS,
+        ),
+        profiles=dict(
+            type='list',
+            elements='dict',
+            options=PROFILE_OPTIONS,
+        ),
+        projects=dict(
+            type='list',
+            elements='dict',
+            options=PROJECT_OPTIONS,
+        ),
+        rename=dict(
+            type='bool',
+            default=True
+        ),
+        state_cache=dict(
+            type='path',
+        ),
+        update_mode=dict(
+            choices=UPDATE_MODES,
+            default='patch'
+        ),
+        validate_config=dict(
+            type='bool',
+            default=True
+        ),
+        wait_timeout=dict(
+            type='int',
+        )
+    )
+
+    module = AnsibleModule(
+        argument_spec=argument_spec,
+        supports_check_mode=True,
+    )
+
+    if module.params['worker_socket'] is not None:
+        run_in_worker(module, 'converge')
+
+    lxd_manage = LXDConverge(module=module)
+    lxd_manage.run()
+
+
+if __name__ == '__main__':
+    main()
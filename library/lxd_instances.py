@@ -0,0 +1,649 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# (c) 2024, Mikhail Shurutov <shurutov@gmail.com> based on lxd_container by Hiroaki Nakamura <hnakamur@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+
+DOCUMENTATION = '''
+---
+module: lxd_instances
+short_description: Manage many LXD instances at once
+version_added: "2.15"
+description:
+  - Management of LXD containers and virtual machines in bulk.
+  - All instances are read once with
+    GET /1.0/instances?recursion=1
+    and up to I(max_parallel) instances are created, reconfigured and
+    started at the same time, every one over its own connection.
+author: "Mikhail Shurutov"
+options:
+    instances:
+        description:
+          - List of instances to manage.
+          - Every item accepts the I(name), I(architecture), I(config),
+            I(devices), I(ephemeral), I(force_stop), I(profiles),
+            I(project), I(source), I(state), I(target), I(timeout),
+            I(type), I(wait_for_container) and I(wait_for_ipv4_addresses)
+            keys with the same meaning as the options of
+            community.general.lxd_container.
+          - I(distro) is accepted and ignored, it is read by lxd_bootstrap
+            from the same items.
+          - Only the listed I(config) keys are compared. If
+            I(ignore_volatile_options) is set, the C(volatile.*) keys of
+            I(config) are only sent on creation and never compared or
+            updated afterwards, as LXD changes them itself.
+          - The I(client_cert), I(client_key), I(snap_url),
+            I(trust_password) and I(url) keys of
+            community.general.lxd_container are accepted and ignored with a
+            warning unless they match the module options, every instance
+            is managed through the connection of the module.
+          - I(state), I(timeout) and I(wait_for_ipv4_addresses) default to
+            the module options of the same name.
+          - Instance names must be unique across projects.
+        required: true
+        type: list
+        elements: dict
+    max_parallel:
+        description:
+          - Maximum number of instances reconciled at the same time.
+        required: false
+        type: int
+        default: 4
+    state:
+        choices:
+          - started
+          - stopped
+          - restarted
+          - frozen
+          - absent
+        description:
+          - Define the state of instances which do not set their own.
+        required: false
+        default: started
+    timeout:
+        description:
+          - Seconds to wait for a state change or for IPv4 addresses of an
+            instance which does not set its own.
+        required: false
+        type: int
+        default: 30
+    wait_events:
+        description:
+          - Whether the operations started by the module, such as creating
+            or starting instances, are waited for on one /1.0/events stream
+            instead of one request per operation.
+          - The stream is only opened if an instance changes its state. If
+            the server refuses it, the operations are waited for one by one.
+        required: false
+        type: bool
+        default: true
+    wait_for_ipv4_addresses:
+        description:
+          - Whether started instances which do not set their own are
+            waited for until all their interfaces got IPv4 addresses.
+          - The states of all waiting instances of a project are read with
+            one GET /1.0/instances?recursion=2 per second. With
+            I(wait_events) an instance which stops meanwhile fails at once.
+        required: false
+        type: bool
+        default: false
+extends_documentation_fragment:
+  - lxd_common
+notes:
+  - Instances are created from I(source) and then brought to I(state).
+    The creation itself is not limited by I(timeout) because it may
+    download an image.
+  - Config updates are sent with the If-Match header carrying the ETag of
+    the instance, so an instance is read again before its update.
+'''
+
+EXAMPLES = '''
+# An example for creating and starting many containers
+- hosts: localhost
+  connection: local
+  tasks:
+    - name: Create containers
+      lxd_instances:
+        max_parallel: 8
+        wait_for_ipv4_addresses: true
+        instances:
+          - name: web1
+            source:
+              type: image
+              mode: pull
+              server: https://images.linuxcontainers.org
+              protocol: simplestreams
+              alias: debian/12
+            profiles: ["default"]
+          - name: web2
+            source:
+              type: image
+              alias: debian/12
+            state: stopped
+          - name: old
+            state: absent
+'''
+
+RETURN = '''
+old_state:
+  description: The old states of the instances keyed by name.
+  returned: success
+  type: dict
+  sample: '{"web1": "absent", "web2": "stopped"}'
+actions:
+  description: Lists of actions performed for the instances keyed by name.
+  returned: success
+  type: dict
+  sample: '{"web1": ["create", "start"], "web2": []}'
+addresses:
+  description: IPv4 addresses of the instances which were waited for, skipped instances are not waited for.
+  returned: when wait_for_ipv4_addresses is true
+  type: dict
+  sample: '{"web1": {"eth0": ["10.155.92.191"]}}'
+timings:
+  description: Seconds spent to reconcile every instance keyed by name.
+  returned: success
+  type: dict
+  sample: '{"web1": 12.4, "web2": 0.003}'
+logs:
+  description:
+    - The last I(log_max_entries) requests sent to the LXD server.
+    - Every entry has the C(method), C(url), response C(status) and
+      C(etag), C(bytes_sent), C(bytes_received), the duration in seconds
+      in C(elapsed), whether the kept-alive connection was C(reused) or
+      C(new), and the C(request) and C(response) bodies cut to
+      I(log_max_body) characters.
+  returned: when ansible-playbook is invoked with -vvvv.
+  type: list
+  sample: "(too long to be placed here)"
+retries:
+  description:
+    - Number of requests retried after transient errors as C(count), and
+      the seconds spent backing off before them as C(backoff).
+  returned: when a request was retried.
+  type: dict
+  sample: '{"count": 2, "backoff": 0.274}'
+'''
+
+import threading
+import time
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.lxd_client import (
+    LXDClient, LXDClientException, request_limiter, request_log, run_concurrently
+)
+from ansible.module_utils.lxd_common import item_options, lxd_argument_spec, warn_item_connection
+from ansible.module_utils.lxd_diff import build_patch, diff_object, stringify
+from ansible.module_utils.lxd_events import INSTANCE_STOPPED_ACTIONS, listen_events
+from ansible.module_utils.lxd_timings import report_retries
+from ansible.module_utils.six.moves.urllib.parse import urlencode
+
+
+# INSTANCES_STATES is a list for states supported.
+INSTANCES_STATES = [
+    'started', 'stopped', 'restarted', 'frozen', 'absent'
+]
+
+# ANSIBLE_LXD_STATES maps LXD instance statuses to module states.
+ANSIBLE_LXD_STATES = {
+    'Running': 'started',
+    'Stopped': 'stopped',
+    'Frozen': 'frozen',
+}
+
+# INSTANCES_CREATE_PARAMS is a list of attribute names sent on creation.
+INSTANCES_CREATE_PARAMS = [
+    'architecture', 'config', 'devices', 'ephemeral', 'profiles', 'source', 'type'
+]
+
+# INSTANCES_UPDATE_PARAMS is a list of attribute names applied to existing instances.
+INSTANCES_UPDATE_PARAMS = [
+    'config', 'devices', 'profiles'
+]
+
+# ADDRESSES_POLL_INTERVAL is the number of seconds between two listings of
+# the instance states of a project while instances wait for addresses.
+ADDRESSES_POLL_INTERVAL = 1
+
+
+class LXDInstancesManagement(object):
+    def __init__(self, module):
+        """Management of many LXD instances via Ansible.
+
+        :param module: Processed Ansible Module.
+        :type module: ``object``
+        """
+        self.module = module
+        self.cert_file = self.module.params.get('client_cert', None)
+        self.key_file = self.module.params.get('client_key', None)
+        self.instances = self.module.params['instances']
+        self.max_parallel = self.module.params['max_parallel']
+        self.state = self.module.params['state']
+        self.timeout = self.module.params['timeout']
+        self.trust_password = self.module.params.get('trust_password', None)
+        self.url = self.module.params['url']
+        self.wait_for_ipv4_addresses = self.module.params['wait_for_ipv4_addresses']
+        self.debug = self.module._verbosity >= 4
+        try:
+            self.client = LXDClient(
+                self.url, key_file=self.key_file, cert_file=self.cert_file,
+                debug=self.debug, log=request_log(self.module.params, self.debug),
+                limiter=request_limiter(self.module.params),
+                retry_timeout=self.module.params.get('retry_timeout', None)
+            )
+        except LXDClientException as e:
+            self.module.fail_json(msg=e.msg)
+        self.actions = {}
+        self.old_state = {}
+        self.addresses = {}
+        self.timings = {}
+        # Instance states listed per project, shared by the address waits
+        self.states = {}
+        self.states_listed = {}
+        self.states_listing = set()
+        self.states_cond = threading.Condition()
+
+    @staticmethod
+    def _url(path, project=None, **query):
+        query['project'] = project
+        query = dict((k, v) for k, v in query.items() if v is not None)
+        if not query:
+            return path
+        return '{0}?{1}'.format(path, urlencode(sorted(query.items())))
+
+    def _get_instances_json(self):
+        projects = []
+        for instance in self.instances:
+            if instance['project'] not in projects:
+                projects.append(instance['project'])
+        instances = {}
+        for project in projects:
+            resp_json = self.client.do(
+                'GET', self._url('/1.0/instances', project, recursion=1)
+            )
+            for instance in resp_json['metadata'] or []:
+                instances[(project, instance['name'])] = instance
+        return instances
+
+    def _instance_state(self, instance):
+        old = self.old_instances.get((instance['project'], instance['name']), None)
+        if old is None:
+            return 'absent'
+        return ANSIBLE_LXD_STATES.get(old['status'], old['status'].lower())
+
+    def _do(self, client, method, url, body_json=None, wait_timeout=None, wait_for_container=None):
+        if self.module.check_mode:
+            return None
+        return client.do(
+            method, url, body_json, wait_timeout=wait_timeout,
+            wait_for_container=wait_for_container
+        )
+
+    def _change_state(self, client, instance, action, actions):
+        body_json = {
+            'action': action,
+            'timeout': instance['timeout'],
+            'force': action == 'stop' and bool(instance['force_stop'])
+        }
+        self._do(
+            client, 'PUT',
+            self._url('/1.0/instances/{0}/state'.format(instance['name']), instance['project']),
+            body_json, wait_timeout=instance['timeout'],
+            wait_for_container=instance['wait_for_container']
+        )
+        actions.append(action)
+
+    def _create_instance(self, client, instance, actions):
+        config = {'name': instance['name']}
+        for attr in INSTANCES_CREATE_PARAMS:
+            if instance.get(attr, None) is not None:
+                config[attr] = instance[attr]
+        for attr in ('config', 'devices'):
+            if attr in config:
+                config[attr] = stringify(config[attr])
+        self._do(
+            client, 'POST',
+            self._url('/1.0/instances', instance['project'], target=instance['target']),
+            config
+        )
+        actions.append('create')
+
+    def _apply_instance_configs(self, client, instance, old, actions):
+        desired = dict(
+            (attr, instance[attr])
+            for attr in INSTANCES_UPDATE_PARAMS
+            if instance.get(attr, None) is not None
+        )
+        if instance['ignore_volatile_options'] and 'config' in desired:
+            desired['config'] = dict(
+                (k, v) for k, v in desired['config'].items() if not k.startswith('volatile.')
+            )
+        diff = diff_object(old, desired, INSTANCES_UPDATE_PARAMS)
+        if not diff:
+            return
+        if not self.module.check_mode:
+            # The recursive listing carries no ETags, so the instance is read
+            # again to make the update conditional
+            url = self._url('/1.0/instances/{0}'.format(instance['name']), instance['project'])
+            old = client.do('GET', url)['metadata']
+            diff = diff_object(old, desired, INSTANCES_UPDATE_PARAMS)
+            if not diff:
+                return
+            client.do('PATCH', url, build_patch(diff), etag=client.etags.get(url, None))
+        actions.append('apply_instance_configs')
+
+    @staticmethod
+    def _ipv4_addresses(state_json):
+        addresses = {}
+        for name, network in (state_json.get('network', None) or {}).items():
+            if name == 'lo':
+                continue
+            addresses[name] = [
+                address['address'] for address in network.get('addresses', [])
+                if address['family'] == 'inet'
+            ]
+        return addresses
+
+    def _listed_states(self, client, project, after):
+        """Return the instance states of a project listed after a time.
+
+        One listing of the project is sent at a time, at most one per
+        ADDRESSES_POLL_INTERVAL, and serves every instance waiting for it.
+
+        :returns: The states per instance name and the time the listing
+            was sent.
+        :rtype: ``tuple``
+        """
+        with self.states_cond:
+            while True:
+                listed = self.states_listed.get(project, 0)
+                if listed >= after:
+                    return self.states[project], listed
+                due = max(after, listed + ADDRESSES_POLL_INTERVAL)
+                now = time.time()
+                if project not in self.states_listing and now >= due:
+                    self.states_listing.add(project)
+                    break
+                self.states_cond.wait(max(due - now, 0) or None)
+        states = None
+        started = time.time()
+        try:
+            resp_json = client.do('GET', self._url('/1.0/instances', project, recursion=2))
+            states = dict(
+                (listed_instance['name'], listed_instance.get('state', None) or {})
+                for listed_instance in resp_json['metadata'] or []
+            )
+        finally:
+            with self.states_cond:
+                self.states_listing.discard(project)
+                if states is not None:
+                    self.states[project] = states
+                    self.states_listed[project] = started
+                self.states_cond.notify_all()
+        return states, started
+
+    def _wait_for_ipv4_addresses(self, client, instance):
+        name = instance['name']
+        source = '/1.0/instances/{0}'.format(name)
+        deadline = time.time() + instance['timeout']
+        after = time.time()
+        while True:
+            states, listed = self._listed_states(client, instance['project'], after)
+            addresses = self._ipv4_addresses(states.get(name, {}))
+            if addresses and all(len(v) > 0 for v in addresses.values()):
+                self.addresses[name] = addresses
+                return
+            if time.time() >= deadline:
+                raise LXDClientException(
+                    'timed out waiting for IPv4 addresses of {0}'.format(name)
+                )
+            if client.events is not None and client.events.last_action(source) in INSTANCE_STOPPED_ACTIONS:
+                raise LXDClientException(
+                    '{0} stopped while waiting for IPv4 addresses'.format(name)
+                )
+            after = min(listed + ADDRESSES_POLL_INTERVAL, deadline)
+
+    def _update_instance(self, client, instance):
+        name = instance['name']
+        old = self.old_instances.get((instance['project'], name), None)
+        old_state = self.old_state[name]
+        actions = self.actions[name]
+        url = self._url('/1.0/instances/{0}'.format(name), instance['project'])
+
+        if instance['state'] == 'absent':
+            if old is not None:
+                if old_state != 'stopped':
+                    self._change_state(client, dict(instance, force_stop=True), 'stop', actions)
+                self._do(client, 'DELETE', url)
+                actions.append('delete')
+            return
+
+        if old is None:
+            self._create_instance(client, instance, actions)
+            old_state = 'stopped'
+        else:
+            self._apply_instance_configs(client, instance, old, actions)
+
+        if old_state == 'frozen' and instance['state'] != 'frozen':
+            self._change_state(client, instance, 'unfreeze', actions)
+            old_state = 'started'
+        if instance['state'] == 'started':
+            if old_state == 'stopped':
+                self._change_state(client, instance, 'start', actions)
+        elif instance['state'] == 'stopped':
+            if old_state == 'started':
+                self._change_state(client, instance, 'stop', actions)
+        elif instance['state'] == 'restarted':
+            if old_state == 'started':
+                self._change_state(client, instance, 'restart', actions)
+            else:
+                self._change_state(client, instance, 'start', actions)
+        elif instance['state'] == 'frozen':
+            if old_state == 'stopped':
+                self._change_state(client, instance, 'start', actions)
+                old_state = 'started'
+            if old_state == 'started':
+                self._change_state(client, instance, 'freeze', actions)
+
+        if (instance['wait_for_ipv4_addresses'] and not self.module.check_mode and
+                instance['state'] in ('started', 'restarted')):
+            self._wait_for_ipv4_addresses(client, instance)
+
+    def _reconcile_instance(self, client, instance):
+        started = time.time()
+        try:
+            self._update_instance(client, instance)
+        finally:
+            self.timings[instance['name']] = round(time.time() - started, 6)
+
+    def _build_instances(self):
+        for instance in self.instances:
+            for attr in ('state', 'timeout', 'wait_for_ipv4_addresses'):
+                if instance.get(attr, None) is None:
+                    instance[attr] = getattr(self, attr)
+
+    def _state_changed(self):
+        return any(len(actions) > 0 for actions in self.actions.values())
+
+    def _needs_operation(self, instance):
+        old_state = self.old_state[instance['name']]
+        if instance['state'] == 'restarted':
+            return True
+        return old_state != instance['state']
+
+    def run(self):
+        """Run the main method."""
+
+        warn_item_connection(self.module, 'instances', self.instances)
+        try:
+            if self.trust_password is not None:
+                self.client.authenticate(
+                    self.trust_password, self.module.params.get('auth_cache', None)
+                )
+
+            self._build_instances()
+            self.old_instances = self._get_instances_json()
+            for instance in self.instances:
+                self.old_state[instance['name']] = self._instance_state(instance)
+                self.actions[instance['name']] = []
+
+            calls = [
+                lambda client, instance=instance: self._reconcile_instance(client, instance)
+                for instance in self.instances
+            ]
+            if (self.module.params['wait_events'] and not self.module.check_mode and
+                    any(self._needs_operation(instance) for instance in self.instances)):
+                try:
+                    listen_events(self.client)
+                except LXDClientException as e:
+                    self.module.warn('{0}, operations are waited for one by one'.format(e.msg))
+            try:
+                results = run_concurrently(self.client, calls, self.max_parallel)
+            finally:
+                if self.client.events is not None:
+                    self.client.events.close()
+            errors = [
+                '{0}: {1}'.format(instance['name'], e.msg)
+                for instance, (dummy, e) in zip(self.instances, results)
+                if e is not None
+            ]
+
+            state_changed = self._state_changed()
+            result_json = {
+                'changed': state_changed,
+                'old_state': self.old_state,
+                'actions': self.actions,
+                'timings': self.timings
+            }
+            if self.addresses:
+                result_json['addresses'] = self.addresses
+            report_retries(self.client, result_json)
+            if self.client.debug:
+                result_json['logs'] = self.client.logs
+            if errors:
+                self.module.fail_json(msg='; '.join(errors), **result_json)
+            self.module.exit_json(**result_json)
+        except LXDClientException as e:
+            state_changed = self._state_changed()
+            fail_params = {
+                'msg': e.msg,
+                'changed': state_changed,
+                'actions': self.actions
+            }
+            report_retries(self.client, fail_params)
+            if self.client.debug:
+                fail_params['logs'] = e.kwargs.get('logs', self.client.logs)
+            self.module.fail_json(**fail_params)
+
+
+def main():
+    """Ansible Main module."""
+
+    argument_spec = lxd_argument_spec()
+    argument_spec.update(
+        instances=dict(
+            type='list',
+            elements='dict',
+            required=True,
+            options=item_options(dict(
+                architecture=dict(
+                    type='str',
+                ),
+                config=dict(
+                    type='dict',
+                ),
+                devices=dict(
+                    type='dict',
+                ),
+                distro=dict(
+                    type='str',
+                ),
+                ephemeral=dict(
+                    type='bool',
+                ),
+                force_stop=dict(
+                    type='bool',
+                    default=False
+                ),
+                ignore_volatile_options=dict(
+                    type='bool',
+                    default=False
+                ),
+                name=dict(
+                    type='str',
+                    required=True
+                ),
+                profiles=dict(
+                    type='list',
+                    elements='str',
+                ),
+                project=dict(
+                    type='str',
+                ),
+                source=dict(
+                    type='dict',
+                ),
+                state=dict(
+                    choices=INSTANCES_STATES,
+                ),
+                target=dict(
+                    type='str',
+                ),
+                timeout=dict(
+                    type='int',
+                ),
+                type=dict(
+                    choices=['container', 'virtual-machine'],
+                    default='container'
+                ),
+                wait_for_container=dict(
+                    type='bool',
+                    default=False
+                ),
+                wait_for_ipv4_addresses=dict(
+                    type='bool',
+                ),
+            )),
+        ),
+        max_parallel=dict(
+            type='int',
+            default=4
+        ),
+        state=dict(
+            choices=INSTANCES_STATES,
+            default='started'
+        ),
+        timeout=dict(
+            type='int',
+            default=30
+        ),
+        wait_events=dict(
+            type='bool',
+            default=True
+        ),
+        wait_for_ipv4_addresses=dict(
+            type='bool',
+            default=False
+        )
+    )
+
+    module = AnsibleModule(
+        argument_spec=argument_spec,
+        supports_check_mode=True,
+    )
+
+    lxd_manage = LXDInstancesManagement(module=module)
+    lxd_manage.run()
+
+
+if __name__ == '__main__':
+    main()
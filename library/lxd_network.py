@@ -22,18 +22,6 @@ description:
   - Management of LXD networks
 author: "Sofiane Medjkoune"
 options:
-    client_cert:
-        description:
-          - The client certificate file path.
-        required: false
-        default: '"{}/.config/lxc/client.crt" .format(os.environ["HOME"])'
-        aliases: [ cert_file ]
-    client_key:
-        description:
-          - The client certificate key file path.
-        required: false
-        default: '"{}/.config/lxc/client.key" .format(os.environ["HOME"])'
-        aliases: [ key_file ]
     config:
         description:
           - 'The config for the network (e.g. {"ipv4.address": "172.29.0.1"}).
@@ -54,13 +42,41 @@ options:
     name:
         description:
           - Name of a network.
-        required: true
+          - Mutually exclusive with I(networks).
+        required: false
+    networks:
+        description:
+          - List of networks to manage in one run.
+          - Every item accepts the I(name), I(new_name), I(type), I(config),
+            I(description) and I(state) keys with the same meaning as
+            the module options of the same name.
+          - The I(client_cert), I(client_key), I(snap_url),
+            I(trust_password) and I(url) keys of the community.general
+            modules are accepted and ignored with a warning unless they
+            match the module options, every network is managed through
+            the connection of the module.
+          - The current state of all networks is obtained once from
+            GET /1.0/networks?recursion=1
+            and only the needed POST, PUT and DELETE requests are sent.
+          - All renames are applied before any other change. An item whose
+            I(new_name) network already exists is treated as renamed.
+          - Mutually exclusive with I(name).
+        required: false
+        type: list
+        elements: dict
     new_name:
         description:
           - A new name of a network.
           - If this parameter is specified a network will be renamed to this name.
             See U(https://github.com/lxc/lxd/blob/master/doc/rest-api.md#post-12)
         required: false
+    rename:
+        description:
+          - Whether I(new_name) keys of I(networks) items are applied.
+          - If false, such items are managed by their I(name).
+        required: false
+        type: bool
+        default: true
     state:
         choices:
           - present
@@ -69,30 +85,75 @@ options:
           - Define the state of a network.
         required: false
         default: present
-    trust_password:
+    state_cache:
         description:
-          - The client trusted password.
-          - You need to set this password on the LXD server before
-            running this module using the following command.
-            lxc config set core.trust_password <some random password>
-            See U(https://www.stgraber.org/2016/04/18/lxd-api-direct-interaction/)
-          - If trust_password is set, this module send a request for
-            authentication before sending any requests.
+          - Path of a file caching the ETag of the network which matched
+            the desired state on the last run.
+          - If both the ETag and the desired state are unchanged, the
+            response is neither decoded nor compared.
+          - The file is kept on the host the module runs on. Delegate the
+            task to the controller with a https I(url) to keep it there.
+          - Not used with I(networks), the recursive listing carries no
+            ETags and is compared in full.
         required: false
     type:
         description:
           - The following network types are available: 'bridge','ovn','macvlan','sriov','physical'
         required: true
         default: 'bridge'
-    url:
+    update_mode:
+        choices:
+          - patch
+          - put
+        description:
+          - How the configuration of an existing network is updated.
+          - C(patch) sends only the changed I(config) keys and I(description) with
+            PATCH, keys which are not listed are kept as is.
+          - C(put) sends the whole network with PUT, as earlier versions of
+            this module did, so I(config) keys which are not listed are
+            removed, except the C(volatile.*) keys LXD sets itself.
+          - Values are compared as LXD reads them, e.g. C(yes) equals
+            C(true), addresses are compared compressed and an address
+            set to C(auto) equals the address LXD generated, so only
+            changed keys are sent.
+        required: false
+        default: patch
+    validate_config:
+        description:
+          - Check the config keys and value types of all networks against
+            the schema of the LXD server before any request changing them
+            is sent, and fail with every error found.
+          - Networks without a I(type) are checked as the type of the
+            existing network, or as bridges if they do not exist yet.
+          - Servers not serving /1.0/metadata/configuration and unknown network types
+            are not checked.
+        required: false
+        type: bool
+        default: true
+    wait_timeout:
         description:
-          - The unix domain socket path or the https URL for the LXD server.
+          - Seconds to wait for the background operations started by
+            creating or deleting networks.
+          - The module fails if they are not finished in time. By default
+            it waits until they are done.
         required: false
-        default: unix:/var/lib/lxd/unix.socket
+        type: int
+extends_documentation_fragment:
+  - lxd_common
+  - lxd_common.timings
+  - lxd_common.worker
+  - lxd_common.schema_cache
 notes:
   - Networks must have a unique name. If you attempt to create a network
     with a name that already existed in the users namespace the module will
     simply return as "unchanged".
+  - Updates are sent with the If-Match header carrying the ETag of the
+    network, so an update fails instead of overwriting a concurrent
+    change. With I(networks) a network is read again before its update to
+    get the ETag.
+  - In check mode nothing is written to LXD. Actions and I(diff) are
+    planned from the state read, so a check mode run with I(networks) is
+    a read-only drift report built from one recursive request.
 '''
 
 EXAMPLES = '''
@@ -138,6 +199,22 @@ EXAMPLES = '''
         name: lxdbr0
         state: absent
 
+# An example for managing many networks at once
+- hosts: localhost
+  connection: local
+  tasks:
+    - name: Reconcile networks
+      lxd_network:
+        networks:
+          - name: lxdbr0
+            new_name: lxdbr1
+            config:
+              ipv4.address: 10.0.3.1/24
+          - name: lxdbr2
+            type: bridge
+          - name: lxdbr3
+            state: absent
+
 # An example for renaming a network
 - hosts: localhost
   connection: local
@@ -151,235 +228,137 @@ EXAMPLES = '''
 
 RETURN = '''
 old_state:
-  description: The old state of the network
+  description:
+    - The old state of the network.
+    - When I(networks) is used, a dict of old states keyed by network name.
   returned: success
   type: string
   sample: "absent"
+timings:
+  description:
+    - Time spent by the module run. C(total) is the wall time in seconds
+      since the connection to the LXD server was set up.
+    - C(phases) holds the seconds spent to C(authenticate), C(read)
+      objects, compute the C(diff), C(write) changes and save the
+      C(cache). Time spent in a C(read) or C(write) during the C(diff) is
+      not counted in the C(diff).
+    - C(requests) sums the count, the latency in seconds and the bytes sent
+      and received of all requests, C(calls) lists every request with the
+      phase it was sent in.
+    - C(retries) counts the requests retried after transient errors and
+      the seconds spent backing off before them.
+  returned: when I(timings) is set.
+  type: dict
+  sample: '{"total": 0.052, "phases": {"read": 0.004, "diff": 0.001, "write": 0.041},
+            "requests": {"count": 3, "elapsed": 0.044, "bytes_sent": 61, "bytes_received": 2418},
+            "calls": [{"method": "GET", "url": "/1.0/networks?recursion=1", "status": 200, "phase": "read",
+                       "elapsed": 0.004, "bytes_sent": 0, "bytes_received": 2177}]}'
 logs:
-  description: The logs of requests and responses.
+  description:
+    - The last I(log_max_entries) requests sent to the LXD server.
+    - Every entry has the C(method), C(url), response C(status) and
+      C(etag), C(bytes_sent), C(bytes_received), the duration in seconds
+      in C(elapsed), whether the kept-alive connection was C(reused) or
+      C(new), and the C(request) and C(response) bodies cut to
+      I(log_max_body) characters.
   returned: when ansible-playbook is invoked with -vvvv.
   type: list
   sample: "(too long to be placed here)"
+diff:
+  description:
+    - Key-level changes applied to the network, or planned in check mode.
+    - A created network has all keys in C(after), a deleted one in
+      C(before), a renamed one has the C(name) key.
+    - When I(networks) is used, a list of changes with the network name in the headers.
+  returned: success
+  type: dict
+  sample: '{"before": {"config": {"ipv4.address": "10.0.3.1/24"}}, "after": {"config": {"ipv4.address": "10.0.4.1/24"}}}'
 actions:
-  description: List of actions performed for the network.
+  description:
+    - List of actions performed for the network.
+    - When I(networks) is used, a dict of action lists keyed by network name.
   returned: success
   type: list
   sample: '["create"]'
+retries:
+  description:
+    - Number of requests retried after transient errors as C(count), and
+      the seconds spent backing off before them as C(backoff).
+  returned: when a request was retried.
+  type: dict
+  sample: '{"count": 2, "backoff": 0.274}'
 '''
 
-import os
-
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.lxd import LXDClient, LXDClientException
-
-
-# NETWORKS_STATES is a list for states supported.
-NETWORKS_STATES = [
-    'present', 'absent'
-]
-
-# CONFIG_PARAMS is a list of config attribute names.
-CONFIG_PARAMS = [
-    'config',
-    'description'
-]
-
-# NETWORKS_CONFIG_DEFAULTS is the default config deployed.
-NETWORKS_CONFIG_DEFAULTS = {
-    'ipv4.address': 'none',
-    'ipv6.address': 'none'
-}
-
-
-class LXDNetworkManagement(object):
-    def __init__(self, module):
-        """Management of LXC containers via Ansible.
-
-        :param module: Processed Ansible Module.
-        :type module: ``object``
-        """
-        self.module = module
-        self.cert_file = self.module.params.get('client_cert', None)
-        self.key_file = self.module.params.get('client_key', None)
-        self._build_config()
-        self.name = self.module.params['name']
-        self.new_name = self.module.params.get('new_name', None)
-        self.state = self.module.params['state']
-        self.trust_password = self.module.params.get('trust_password', None)
-        self.type = self.module.params['type']
-        self.url = self.module.params['url']
-        self.debug = self.module._verbosity >= 4
-        try:
-            self.client = LXDClient(
-                self.url, key_file=self.key_file, cert_file=self.cert_file,
-                debug=self.debug
-            )
-        except LXDClientException as e:
-            self.module.fail_json(msg=e.msg)
-        self.actions = []
-
-    def _build_config(self):
-        self.config = {}
-        for attr in CONFIG_PARAMS:
-            param_val = self.module.params.get(attr, None)
-            if attr == 'config':
-                if param_val is None:
-                    param_val = {}
-                NETWORKS_CONFIG_DEFAULTS.update(param_val)
-                param_val = NETWORKS_CONFIG_DEFAULTS
-            if param_val is not None:
-                self.config[attr] = param_val
-
-    def _get_network_json(self):
-        return self.client.do(
-            'GET', '/1.0/networks/{0}'.format(self.name),
-            ok_error_codes=[404]
-        )
-
-    @staticmethod
-    def _network_json_to_module_state(resp_json):
-        if resp_json['type'] == 'error':
-            return 'absent'
-        return 'present'
-
-    def _update_network(self):
-        if self.state == 'present':
-            if self.old_state == 'absent':
-                if self.new_name is None:
-                    self._create_network()
-                else:
-                    self.module.fail_json(
-                        msg='new_name must not be set when the network does not exist and the specified state is present',
-                        changed=False)
-            else:
-                if self.new_name is not None and self.new_name != self.name:
-                    self._rename_network()
-                if self._needs_to_apply_network_configs():
-                    self._apply_network_configs()
-        elif self.state == 'absent':
-            if self.old_state == 'present':
-                if self.new_name is None:
-                    self._delete_network()
-                else:
-                    self.module.fail_json(
-                        msg='new_name must not be set when the network exists and the specified state is absent',
-                        changed=False)
-
-    def _create_network(self):
-        config = self.config.copy()
-        config['name'] = self.name
-        self.client.do('POST', '/1.0/networks', config)
-        self.actions.append('create')
-
-    def _rename_network(self):
-        config = {'name': self.new_name}
-        self.client.do('POST', '/1.0/networks/{}'.format(self.name), config)
-        self.actions.append('rename')
-        self.name = self.new_name
-
-    def _needs_to_change_network_config(self, key):
-        if key not in self.config:
-            return False
-        old_configs = self.old_network_json['metadata'].get(key, None)
-        return self.config[key] != old_configs
-
-    def _needs_to_apply_network_configs(self):
-        return (
-            self._needs_to_change_network_config('config') or
-            self._needs_to_change_network_config('description')
-        )
-
-    def _apply_network_configs(self):
-        config = self.old_network_json.copy()
-        for k, v in self.config.items():
-            config[k] = v
-        self.client.do('PUT', '/1.0/networks/{}'.format(self.name), config)
-        self.actions.append('apply_network_configs')
-
-    def _delete_network(self):
-        self.client.do('DELETE', '/1.0/networks/{}'.format(self.name))
-        self.actions.append('delete')
-
-    def run(self):
-        """Run the main method."""
-
-        try:
-            if self.trust_password is not None:
-                self.client.authenticate(self.trust_password)
-
-            self.old_network_json = self._get_network_json()
-
-            self.old_state = self._network_json_to_module_state(self.old_network_json)
-            self._update_network()
-
-            state_changed = len(self.actions) > 0
-            result_json = {
-                'changed': state_changed,
-                'old_state': self.old_state,
-                'actions': self.actions
-            }
-            if self.client.debug:
-                result_json['logs'] = self.client.logs
-            self.module.exit_json(**result_json)
-        except LXDClientException as e:
-            state_changed = len(self.actions) > 0
-            fail_params = {
-                'msg': e.msg,
-                'changed': state_changed,
-                'actions': self.actions
-            }
-            if self.client.debug:
-                fail_params['logs'] = e.kwargs['logs']
-            self.module.fail_json(**fail_params)
+from ansible.module_utils.lxd_common import (
+    LXD_SCHEMA_ARGS, LXD_TIMINGS_ARGS, LXD_WORKER_ARGS, lxd_argument_spec
+)
+from ansible.module_utils.lxd_diff import UPDATE_MODES
+from ansible.module_utils.lxd_network_engine import (
+    LXDNetworkManagement, NETWORKS_STATES, NETWORK_OPTIONS
+)
+from ansible.module_utils.lxd_worker import run_in_worker
 
 
 def main():
     """Ansible Main module."""
 
-    module = AnsibleModule(
-        argument_spec=dict(
-            client_cert=dict(
-                type='str',
-                default='{}/.config/lxc/client.crt'.format(os.environ['HOME']),
-                aliases=['cert_file']
-            ),
-            client_key=dict(
-                type='str',
-                default='{}/.config/lxc/client.key'.format(os.environ['HOME']),
-                aliases=['key_file']
-            ),
-            config=dict(
-                type='dict',
-            ),
-            description=dict(
-                type='str',
-            ),
-            name=dict(
-                type='str',
-                required=True
-            ),
-            new_name=dict(
-                type='str',
-            ),
-            state=dict(
-                choices=NETWORKS_STATES,
-                default='present'
-            ),
-            trust_password=dict(
-                type='str',
-                no_log=True
-            ),
-            type=dict(
-                type='str',
-            ),
-            url=dict(
-                type='str',
-                default='unix:/var/lib/lxd/unix.socket'
-            ),
+    argument_spec = lxd_argument_spec(LXD_TIMINGS_ARGS, LXD_WORKER_ARGS, LXD_SCHEMA_ARGS)
+    argument_spec.update(
+        config=dict(
+            type='dict',
         ),
+        description=dict(
+            type='str',
+        ),
+        name=dict(
+            type='str',
+        ),
+        networks=dict(
+            type='list',
+            elements='dict',
+            options=NETWORK_OPTIONS,
+        ),
+        new_name=dict(
+            type='str',
+        ),
+        rename=dict(
+            type='bool',
+            default=True
+        ),
+        state=dict(
+            choices=NETWORKS_STATES,
+            default='present'
+        ),
+        state_cache=dict(
+            type='path',
+        ),
+        type=dict(
+            type='str',
+        ),
+        update_mode=dict(
+            choices=UPDATE_MODES,
+            default='patch'
+        ),
+        validate_config=dict(
+            type='bool',
+            default=True
+        ),
+        wait_timeout=dict(
+            type='int',
+        )
+    )
+
+    module = AnsibleModule(
+        argument_spec=argument_spec,
+        mutually_exclusive=[('name', 'networks')],
+        required_one_of=[('name', 'networks')],
         supports_check_mode=True,
     )
 
+    if module.params['worker_socket'] is not None:
+        run_in_worker(module, 'networks')
+
     lxd_manage = LXDNetworkManagement(module=module)
     lxd_manage.run()
 
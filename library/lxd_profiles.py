@@ -0,0 +1,180 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# (c) 2024, Mikhail Shurutov <shurutov@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+
+DOCUMENTATION = '''
+---
+module: lxd_profiles
+short_description: Manage many LXD profiles at once
+version_added: "2.15"
+description:
+  - Management of LXD profiles in bulk.
+  - The profiles of every project used are read once with
+    GET /1.0/profiles?recursion=1
+    and all items are reconciled against it.
+author: "Mikhail Shurutov"
+options:
+    merge_profile:
+        description:
+          - Whether listed config keys and devices are merged into the
+            existing profile.
+          - When C(true), config keys which are not listed are kept and
+            every listed device is merged key by key into the existing
+            device of the same name.
+          - When C(false), config and devices of the profile are replaced
+            by the listed ones.
+        required: false
+        type: bool
+        default: false
+    profiles:
+        description:
+          - List of profiles to manage.
+          - Every item accepts the I(name), I(config), I(description),
+            I(devices), I(new_name), I(project) and I(state) keys with the
+            same meaning as the options of community.general.lxd_profile.
+          - The I(client_cert), I(client_key), I(snap_url),
+            I(trust_password) and I(url) keys of
+            community.general.lxd_profile are accepted and ignored with a warning
+            unless they match the module options, every profile is managed
+            through the connection of the module.
+        required: true
+        type: list
+        elements: dict
+extends_documentation_fragment:
+  - lxd_common
+  - lxd_common.timings
+  - lxd_common.worker
+notes:
+  - Renames are applied before any other change.
+  - Updates are sent with the If-Match header carrying the ETag of the
+    profile, so a profile is read again before its update.
+  - In check mode nothing is written to LXD.
+'''
+
+EXAMPLES = '''
+# An example for setting many profiles
+- hosts: localhost
+  connection: local
+  tasks:
+    - name: Set profiles
+      lxd_profiles:
+        merge_profile: true
+        profiles:
+          - name: default
+            devices:
+              root:
+                path: /
+                pool: default
+                type: disk
+          - name: web
+            project: tenant1
+            config:
+              limits.cpu: "2"
+'''
+
+RETURN = '''
+old_state:
+  description:
+    - The old states of the profiles keyed by name, or by project and name
+      for profiles with I(project).
+  returned: success
+  type: dict
+  sample: '{"default": "present", "tenant1/web": "absent"}'
+actions:
+  description: Lists of actions performed for the profiles keyed as I(old_state).
+  returned: success
+  type: dict
+  sample: '{"default": ["apply_profile_configs"], "tenant1/web": ["create"]}'
+diff:
+  description: Key-level changes of the profiles with their names in the headers.
+  returned: success
+  type: list
+  sample: '[{"before": {"devices": {"root": null}}, "after": {"devices": {"root": {"path": "/", "pool": "default", "type": "disk"}}},
+             "before_header": "default", "after_header": "default"}]'
+timings:
+  description:
+    - Time spent by the module run. C(total) is the wall time in seconds
+      since the connection to the LXD server was set up.
+    - C(phases) holds the seconds spent to C(authenticate), C(read)
+      objects, compute the C(diff), C(write) changes and save the
+      C(cache). Time spent in a C(read) or C(write) during the C(diff) is
+      not counted in the C(diff).
+    - C(requests) sums the count, the latency in seconds and the bytes sent
+      and received of all requests, C(calls) lists every request with the
+      phase it was sent in.
+    - C(retries) counts the requests retried after transient errors and
+      the seconds spent backing off before them.
+  returned: when I(timings) is set.
+  type: dict
+  sample: '{"total": 0.052, "phases": {"read": 0.004, "diff": 0.001, "write": 0.041},
+            "requests": {"count": 3, "elapsed": 0.044, "bytes_sent": 61, "bytes_received": 2418},
+            "calls": [{"method": "GET", "url": "/1.0/networks?recursion=1", "status": 200, "phase": "read",
+                       "elapsed": 0.004, "bytes_sent": 0, "bytes_received": 2177}]}'
+logs:
+  description:
+    - The last I(log_max_entries) requests sent to the LXD server.
+    - Every entry has the C(method), C(url), response C(status) and
+      C(etag), C(bytes_sent), C(bytes_received), the duration in seconds
+      in C(elapsed), whether the kept-alive connection was C(reused) or
+      C(new), and the C(request) and C(response) bodies cut to
+      I(log_max_body) characters.
+  returned: when ansible-playbook is invoked with -vvvv.
+  type: list
+  sample: "(too long to be placed here)"
+retries:
+  description:
+    - Number of requests retried after transient errors as C(count), and
+      the seconds spent backing off before them as C(backoff).
+  returned: when a request was retried.
+  type: dict
+  sample: '{"count": 2, "backoff": 0.274}'
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.lxd_common import LXD_TIMINGS_ARGS, LXD_WORKER_ARGS, lxd_argument_spec
+from ansible.module_utils.lxd_profile_engine import LXDProfileManagement, PROFILE_OPTIONS
+from ansible.module_utils.lxd_worker import run_in_worker
+
+
+def main():
+    """Ansible Main module."""
+
+    argument_spec = lxd_argument_spec(LXD_TIMINGS_ARGS, LXD_WORKER_ARGS)
+    argument_spec.update(
+        merge_profile=dict(
+            type='bool',
+            default=False
+        ),
+        profiles=dict(
+            type='list',
+            elements='dict',
+            options=PROFILE_OPTIONS,
+            required=True
+        )
+    )
+
+    module = AnsibleModule(
+        argument_spec=argument_spec,
+        supports_check_mode=True,
+    )
+
+    if module.params['worker_socket'] is not None:
+        run_in_worker(module, 'profiles')
+
+    lxd_manage = LXDProfileManagement(module=module)
+    lxd_manage.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,357 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# (c) 2024, Mikhail Shurutov <shurutov@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+
+DOCUMENTATION = '''
+---
+module: lxd_state
+short_description: Report drift of LXD server settings
+version_added: "2.15"
+description:
+  - Compares the server config, storage pools, networks, profiles and
+    projects of a LXD server with their desired state and reports the
+    differences. Nothing is changed on the server.
+  - The drift is the plan of lxd_converge run in check mode with the same
+    options, so the defaults it applies, like the default network config,
+    and the merge and rename options are taken into account.
+  - The server is read once with
+    GET /1.0,
+    GET /1.0/storage-pools?recursion=1,
+    GET /1.0/networks?recursion=1,
+    GET /1.0/projects?recursion=1
+    and GET /1.0/profiles?recursion=1 per project of I(profiles).
+    Kinds of objects which are not given are not read.
+author: "Mikhail Shurutov"
+options:
+    config:
+        description:
+          - The desired server config, as the I(config) option of
+            lxd_config.
+        required: false
+        type: dict
+    merge_profile:
+        description:
+          - Whether I(profiles) are compared as merged into existing
+            profiles, as the I(merge_profile) option of lxd_converge.
+        required: false
+        type: bool
+        default: false
+    merge_project:
+        description:
+          - Whether I(projects) are compared as merged into existing
+            projects, as the I(merge_project) option of lxd_converge.
+        required: false
+        type: bool
+        default: false
+    networks:
+        description:
+          - The desired networks, as the I(networks) option of
+            lxd_converge.
+        required: false
+        type: list
+        elements: dict
+    pools:
+        description:
+          - The desired storage pools, as the I(pools) option of
+            lxd_converge.
+        required: false
+        type: list
+        elements: dict
+    profiles:
+        description:
+          - The desired profiles, as the I(profiles) option of
+            lxd_converge.
+        required: false
+        type: list
+        elements: dict
+    projects:
+        description:
+          - The desired projects, as the I(projects) option of
+            lxd_converge.
+        required: false
+        type: list
+        elements: dict
+    rename:
+        description:
+          - Whether I(new_name) of I(networks) items is planned, as the
+            I(rename) option of lxd_converge.
+        required: false
+        type: bool
+        default: true
+    update_mode:
+        choices:
+          - patch
+          - put
+        description:
+          - The update mode the objects are converged with.
+          - With C(patch) only the listed config keys are compared, with
+            C(put) unlisted config keys are reported as drift too.
+        required: false
+        default: patch
+extends_documentation_fragment:
+  - lxd_common
+notes:
+  - Items are checked like the items of lxd_converge, so role variables
+    can be passed as is.
+  - Objects which exist on the server and are not listed are not
+    reported.
+'''
+
+EXAMPLES = '''
+# An example for auditing LXD settings of many hosts
+- hosts: lxd_hosts
+  tasks:
+    - name: Report drift of LXD settings
+      lxd_state:
+        config: "{{ lxd_config }}"
+        networks: "{{ lxd_networks }}"
+        pools: "{{ lxd_storage_pools }}"
+        profiles: "{{ lxd_profiles }}"
+        projects: "{{ lxd_projects }}"
+      register: lxd_state_report
+
+    - name: Show drifted hosts
+      ansible.builtin.debug:
+        var: lxd_state_report.drift
+      when: lxd_state_report.drifted
+'''
+
+RETURN = '''
+drifted:
+  description: Whether any object differs from its desired state.
+  returned: success
+  type: bool
+  sample: true
+drift:
+  description:
+    - Objects which differ from their desired state keyed by kind and
+      name. Every object has the C(actions) lxd_converge would take, as
+      in its C(converged) result, and its changed C(keys) in dotted form.
+    - The server config is reported under C(config) without a name.
+  returned: success
+  type: dict
+  sample: '{"config": {"actions": ["apply_config_configs"], "keys": ["config.core.https_address"]},
+            "networks": {"lxdbr0": {"actions": ["apply_network_configs"], "keys": ["config.ipv4.address"]}}}'
+diff:
+  description:
+    - Key-level differences of the drifted objects with the kind and the
+      name of every object in the headers.
+  returned: success
+  type: list
+  sample: '[{"before": {"config": {"ipv4.address": "10.0.3.1/24"}}, "after": {"config": {"ipv4.address": "10.0.4.1/24"}},
+             "before_header": "networks/lxdbr0", "after_header": "networks/lxdbr0"}]'
+logs:
+  description:
+    - The last I(log_max_entries) requests sent to the LXD server.
+    - Every entry has the C(method), C(url), response C(status) and
+      C(etag), C(bytes_sent), C(bytes_received), the duration in seconds
+      in C(elapsed), whether the kept-alive connection was C(reused) or
+      C(new), and the C(request) and C(response) bodies cut to
+      I(log_max_body) characters.
+  returned: when ansible-playbook is invoked with -vvvv.
+  type: list
+  sample: "(too long to be placed here)"
+retries:
+  description:
+    - Number of requests retried after transient errors as C(count), and
+      the seconds spent backing off before them as C(backoff).
+  returned: when a request was retried.
+  type: dict
+  sample: '{"count": 2, "backoff": 0.274}'
+'''
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.lxd_client import LXDClientException
+from ansible.module_utils.lxd_common import lxd_argument_spec, warn_item_connection
+from ansible.module_utils.lxd_converge_engine import CONVERGE_KINDS, LXDConverge
+from ansible.module_utils.lxd_diff import UPDATE_MODES, result_keys
+from ansible.module_utils.lxd_network_engine import NETWORK_OPTIONS
+from ansible.module_utils.lxd_profile_engine import PROFILE_OPTIONS, PROJECT_OPTIONS
+from ansible.module_utils.lxd_storage_engine import POOL_OPTIONS
+from ansible.module_utils.lxd_timings import report_retries
+
+
+# PLAN_PARAMS maps the options of lxd_converge lxd_state does not have to
+# the values the drift is planned with.
+PLAN_PARAMS = {
+    'max_parallel': 1,
+    'schema_cache': None,
+    'state_cache': None,
+    'validate_config': False,
+    'wait_timeout': None
+}
+
+
+class LXDPlanModule(object):
+    def __init__(self, module):
+        """Ansible module as seen by the converge planning the drift.
+
+        It is always in check mode, so nothing is written to the server.
+
+        :param module: Processed Ansible Module.
+        :type module: ``object``
+        """
+        self.module = module
+        self.params = dict(PLAN_PARAMS, **module.params)
+        self.check_mode = True
+        self._verbosity = module._verbosity
+
+    def fail_json(self, **kwargs):
+        self.module.fail_json(**kwargs)
+
+
+class LXDState(object):
+    def __init__(self, module):
+        """Drift report of LXD server settings via Ansible.
+
+        :param module: Processed Ansible Module.
+        :type module: ``object``
+        """
+        self.module = module
+        self.plan = LXDConverge(LXDPlanModule(self.module))
+        self.client = self.plan.client
+        self.drift = {}
+        self.diffs = []
+
+    @staticmethod
+    def _headers(name, item):
+        """Return the diff headers the changes of an item are reported with.
+
+        A renamed object is reported under its new name.
+        """
+        headers = [name]
+        if item.get('new_name', None) is not None:
+            headers.append('/'.join(name.split('/')[:-1] + [item['new_name']]))
+        return headers
+
+    def _report(self, kind, name, actions, diffs):
+        header = kind if name is None else '{0}/{1}'.format(kind, name)
+        keys = set()
+        for diff in diffs:
+            keys.update(result_keys(diff))
+        entry = {'actions': actions, 'keys': sorted(keys)}
+        if name is None:
+            self.drift[kind] = entry
+        else:
+            self.drift.setdefault(kind, {})[name] = entry
+        self.diffs.extend(dict(diff, before_header=header, after_header=header) for diff in diffs)
+
+    def _check_kind(self, kind):
+        actions = self.plan.converged[kind]['actions']
+        diffs = self.plan.kind_diffs[kind]
+        if kind == 'config':
+            if actions:
+                self._report(kind, None, actions, diffs)
+            return
+        items = {}
+        for item in self.module.params[kind]:
+            project = item.get('project', None) if kind == 'profiles' else None
+            items[item['name'] if project is None else '{0}/{1}'.format(project, item['name'])] = item
+        for name in sorted(actions):
+            if actions[name]:
+                headers = self._headers(name, items[name])
+                self._report(kind, name, actions[name], [
+                    diff for diff in diffs if diff.get('before_header', None) in headers
+                ])
+
+    def run(self):
+        """Run the main method."""
+
+        for kind, reconciler_class in CONVERGE_KINDS:
+            if kind != 'config':
+                warn_item_connection(self.module, kind, self.module.params[kind])
+        try:
+            self.plan.reconcile()
+            for kind, reconciler_class in CONVERGE_KINDS:
+                if kind in self.plan.converged:
+                    self._check_kind(kind)
+
+            result_json = {
+                'changed': False,
+                'drifted': len(self.drift) > 0,
+                'drift': self.drift,
+                'diff': self.diffs
+            }
+            report_retries(self.client, result_json)
+            if self.client.debug:
+                result_json['logs'] = self.client.logs
+            self.module.exit_json(**result_json)
+        except LXDClientException as e:
+            fail_params = {
+                'msg': self.plan.fail_params(e)['msg'],
+                'changed': False
+            }
+            report_retries(self.client, fail_params)
+            if self.client.debug:
+                fail_params['logs'] = e.kwargs.get('logs', self.client.logs)
+            self.module.fail_json(**fail_params)
+
+
+def main():
+    """Ansible Main module."""
+
+    argument_spec = lxd_argument_spec()
+    argument_spec.update(
+        config=dict(
+            type='dict',
+        ),
+        merge_profile=dict(
+            type='bool',
+            default=False
+        ),
+        merge_project=dict(
+            type='bool',
+            default=False
+        ),
+        networks=dict(
+            type='list',
+            elements='dict',
+            options=NETWORK_OPTIONS,
+        ),
+        pools=dict(
+            type='list',
+            elements='dict',
+            options=POOL_OPTIONS,
+        ),
+        profiles=dict(
+            type='list',
+            elements='dict',
+            options=PROFILE_OPTIONS,
+        ),
+        projects=dict(
+            type='list',
+            elements='dict',
+            options=PROJECT_OPTIONS,
+        ),
+        rename=dict(
+            type='bool',
+            default=True
+        ),
+        update_mode=dict(
+            choices=UPDATE_MODES,
+            default='patch'
+        )
+    )
+
+    module = AnsibleModule(
+        argument_spec=argument_spec,
+        supports_check_mode=True,
+    )
+
+    lxd_manage = LXDState(module=module)
+    lxd_manage.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -22,18 +22,6 @@ description:
   - Management of LXD storage pools
 author: "Michail Shurutov"
 options:
-    client_cert:
-        description:
-          - The client certificate file path.
-        required: false
-        default: '"{}/.config/lxc/client.crt" .format(os.environ["HOME"])'
-        aliases: [ cert_file ]
-    client_key:
-        description:
-          - The client certificate key file path.
-        required: false
-        default: '"{}/.config/lxc/client.key" .format(os.environ["HOME"])'
-        aliases: [ key_file ]
     config:
         description:
           - 'The config for the storage pool (e.g.
@@ -65,11 +53,41 @@ options:
             - 'Directory - dir'
             - 'LVM - lvm'
             - 'ZFS - zfs'
-        required: true
+          - Required when I(name) is set.
+        required: false
+    max_parallel:
+        description:
+          - Maximum number of storage pools of I(pools) created at once.
+          - Every creation above one uses its own connection to the LXD
+            server. Operations started by the creations are waited for
+            together, so creating several pools takes about as long as
+            the slowest of them.
+        required: false
+        type: int
+        default: 1
     name:
         description:
           - Name of storage pool.
-        required: true
+          - Mutually exclusive with I(pools).
+        required: false
+    pools:
+        description:
+          - List of storage pools to manage in one run.
+          - Every item accepts the I(name), I(driver), I(config),
+            I(description) and I(state) keys with the same meaning as
+            the module options of the same name.
+          - The I(client_cert), I(client_key), I(snap_url),
+            I(trust_password) and I(url) keys of the community.general
+            modules are accepted and ignored with a warning unless they
+            match the module options, every pool is managed through the
+            connection of the module.
+          - The current state of all pools is obtained once from
+            GET /1.0/storage-pools?recursion=1
+            and only the needed POST, PUT and DELETE requests are sent.
+          - Mutually exclusive with I(name).
+        required: false
+        type: list
+        elements: dict
     state:
         choices:
           - present
@@ -78,25 +96,70 @@ options:
           - Define the state of a storage pool.
         required: false
         default: present
-    trust_password:
+    state_cache:
+        description:
+          - Path of a file caching the ETag of the storage pool which
+            matched the desired state on the last run.
+          - If both the ETag and the desired state are unchanged, the
+            response is neither decoded nor compared.
+          - The file is kept on the host the module runs on. Delegate the
+            task to the controller with a https I(url) to keep it there.
+          - Not used with I(pools), the recursive listing carries no ETags
+            and is compared in full.
+        required: false
+    update_mode:
+        choices:
+          - patch
+          - put
+        description:
+          - How the configuration of an existing storage pool is updated.
+          - C(patch) sends only the changed I(config) keys and I(description) with
+            PATCH, keys which are not listed are kept as is.
+          - C(put) sends the whole storage pool with PUT, as earlier versions of
+            this module did, so I(config) keys which are not listed are
+            removed, except the C(volatile.*), C(source), C(size) and
+            volume group or pool name keys the storage driver generates.
+          - Values are compared as LXD reads them, e.g. C(yes) equals
+            C(true) and C(1GiB) equals C(1073741824), so only changed keys
+            are sent.
+        required: false
+        default: patch
+    validate_config:
         description:
-          - The client trusted password.
-          - You need to set this password on the LXD server before
-            running this module using the following command.
-            lxc config set core.trust_password <some random password>
-            See U(https://www.stgraber.org/2016/04/18/lxd-api-direct-interaction/)
-          - If trust_password is set, this module send a request for
-            authentication before sending any requests.
+          - Check the config keys and value types of all storage pools
+            against the schema of the LXD server before any request
+            changing them is sent, and fail with every error found.
+          - Pool keys are checked against the pool keys of the I(driver),
+            keys prefixed with C(volume.) against its volume keys.
+          - Servers not serving /1.0/metadata/configuration and pools without a I(driver)
+            are not checked.
         required: false
-    url:
+        type: bool
+        default: true
+    wait_timeout:
         description:
-          - The unix domain socket path or the https URL for the LXD server.
+          - Seconds to wait for the background operations started by
+            creating or deleting storage pools.
+          - The module fails if they are not finished in time. By default
+            it waits until they are done.
         required: false
-        default: unix:/var/lib/lxd/unix.socket
+        type: int
+extends_documentation_fragment:
+  - lxd_common
+  - lxd_common.timings
+  - lxd_common.worker
+  - lxd_common.schema_cache
 notes:
   - Storage pool must have a unique name. If you attempt to create a
     storage pool with a name that already existed in the users namespace
     the module will simply return as "unchanged".
+  - Updates are sent with the If-Match header carrying the ETag of the
+    storage pool, so an update fails instead of overwriting a concurrent
+    change. With I(pools) a pool is read again before its update to get
+    the ETag.
+  - In check mode nothing is written to LXD. Actions and I(diff) are
+    planned from the state read, so a check mode run with I(pools) is a
+    read-only drift report built from one recursive request.
 '''
 
 EXAMPLES = '''
@@ -116,6 +179,20 @@ EXAMPLES = '''
           source: vg
         description: LVM storage pool
 
+# An example for managing many storage pools at once
+- hosts: localhost
+  connection: local
+  tasks:
+    - name: Reconcile storage pools
+      lxd_storage:
+        pools:
+          - name: default
+            driver: dir
+            config:
+              source: /var/lib/lxd/storage-pools/default
+          - name: lxdbtrfs
+            state: absent
+
 # An example for creating a storage pool via https connection
 - hosts: localhost
   connection: local
@@ -146,210 +223,134 @@ EXAMPLES = '''
 
 RETURN = '''
 old_state:
-  description: The old state of the storage pool
+  description:
+    - The old state of the storage pool.
+    - When I(pools) is used, a dict of old states keyed by pool name.
   returned: success
   type: string
   sample: "absent"
+timings:
+  description:
+    - Time spent by the module run. C(total) is the wall time in seconds
+      since the connection to the LXD server was set up.
+    - C(phases) holds the seconds spent to C(authenticate), C(read)
+      objects, compute the C(diff), C(write) changes and save the
+      C(cache). Time spent in a C(read) or C(write) during the C(diff) is
+      not counted in the C(diff).
+    - C(requests) sums the count, the latency in seconds and the bytes sent
+      and received of all requests, C(calls) lists every request with the
+      phase it was sent in.
+    - C(retries) counts the requests retried after transient errors and
+      the seconds spent backing off before them.
+  returned: when I(timings) is set.
+  type: dict
+  sample: '{"total": 0.052, "phases": {"read": 0.004, "diff": 0.001, "write": 0.041},
+            "requests": {"count": 3, "elapsed": 0.044, "bytes_sent": 61, "bytes_received": 2418},
+            "calls": [{"method": "GET", "url": "/1.0/networks?recursion=1", "status": 200, "phase": "read",
+                       "elapsed": 0.004, "bytes_sent": 0, "bytes_received": 2177}]}'
 logs:
-  description: The logs of requests and responses.
+  description:
+    - The last I(log_max_entries) requests sent to the LXD server.
+    - Every entry has the C(method), C(url), response C(status) and
+      C(etag), C(bytes_sent), C(bytes_received), the duration in seconds
+      in C(elapsed), whether the kept-alive connection was C(reused) or
+      C(new), and the C(request) and C(response) bodies cut to
+      I(log_max_body) characters.
   returned: when ansible-playbook is invoked with -vvvv.
   type: list
   sample: "(too long to be placed here)"
+diff:
+  description:
+    - Key-level changes applied to the storage pool, or planned in check mode.
+    - A created pool has all keys in C(after), a deleted one in C(before).
+    - When I(pools) is used, a list of changes with the pool name in the headers.
+  returned: success
+  type: dict
+  sample: '{"before": {"config": {"rsync.bwlimit": "0"}}, "after": {"config": {"rsync.bwlimit": "100MiB"}}}'
 actions:
-  description: List of actions performed for the storage pool.
+  description:
+    - List of actions performed for the storage pool.
+    - When I(pools) is used, a dict of action lists keyed by pool name.
   returned: success
   type: list
   sample: '["create"]'
+retries:
+  description:
+    - Number of requests retried after transient errors as C(count), and
+      the seconds spent backing off before them as C(backoff).
+  returned: when a request was retried.
+  type: dict
+  sample: '{"count": 2, "backoff": 0.274}'
 '''
 
-import os
-
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.lxd import LXDClient, LXDClientException
-
-
-# STORAGES_STATES is a list for states supported.
-STORAGES_STATES = [
-    'present', 'absent'
-]
-
-# STORAGES_CONFIG_PARAMS is a list of config attribute names.
-STORAGES_CONFIG_PARAMS = [
-    'config', 'description', 'driver'
-]
-
-# STORAGES_CONFIG_DEFAULTS is the default config deployed.
-STORAGES_CONFIG_DEFAULTS = {}
-
-
-class LXDStorageManagement(object):
-    def __init__(self, module):
-        """Management of LXC containers via Ansible.
-
-        :param module: Processed Ansible Module.
-        :type module: ``object``
-        """
-        self.module = module
-        self.cert_file = self.module.params.get('client_cert', None)
-        self.key_file = self.module.params.get('client_key', None)
-        self._build_config()
-        self.driver = self.module.params['driver']
-        self.name = self.module.params['name']
-        self.state = self.module.params['state']
-        self.trust_password = self.module.params.get('trust_password', None)
-        self.url = self.module.params['url']
-        self.debug = self.module._verbosity >= 4
-        try:
-            self.client = LXDClient(
-                self.url, key_file=self.key_file, cert_file=self.cert_file,
-                debug=self.debug
-            )
-        except LXDClientException as e:
-            self.module.fail_json(msg=e.msg)
-        self.actions = []
-
-    def _build_config(self):
-        self.config = {}
-        for attr in STORAGES_CONFIG_PARAMS:
-            param_val = self.module.params.get(attr, None)
-            if attr == 'config':
-                if param_val is None:
-                    param_val = {}
-                STORAGES_CONFIG_DEFAULTS.update(param_val)
-                param_val = STORAGES_CONFIG_DEFAULTS
-            if param_val is not None:
-                self.config[attr] = param_val
-
-    def _get_storage_json(self):
-        return self.client.do(
-            'GET', '/1.0/storage-pools/{0}'.format(self.name),
-            ok_error_codes=[404]
-        )
-
-    @staticmethod
-    def _storage_json_to_module_state(resp_json):
-        if resp_json['type'] == 'error':
-            return 'absent'
-        return 'present'
-
-    def _update_storage(self):
-        if self.state == 'present':
-            if self.old_state == 'absent':
-                self._create_storage()
-            else:
-                if self._needs_to_apply_storage_configs():
-                    self._apply_storage_configs()
-        elif self.state == 'absent':
-            if self.old_state == 'present':
-                self._delete_storage()
-
-    def _create_storage(self):
-        config = self.config.copy()
-        config['name'] = self.name
-        self.client.do('POST', '/1.0/storage-pools', config)
-        self.actions.append('create')
-
-    def _needs_to_change_storage_config(self, key):
-        if key not in self.config:
-            return False
-        old_configs = self.old_storage_json['metadata'].get(key, None)
-        return self.config[key] != old_configs
-
-    def _needs_to_apply_storage_configs(self):
-        return (
-            self._needs_to_change_storage_config('config') or
-            self._needs_to_change_storage_config('description')
-        )
-
-    def _apply_storage_configs(self):
-        config = self.old_storage_json.copy()
-        for k, v in self.config.items():
-            config[k] = v
-        self.client.do('PUT', '/1.0/storage-pools/{}'.format(self.name), config)
-        self.actions.append('apply_storage_configs')
-
-    def _delete_storage(self):
-        self.client.do('DELETE', '/1.0/storage-pools/{}'.format(self.name))
-        self.actions.append('delete')
-
-    def run(self):
-        """Run the main method."""
-
-        try:
-            if self.trust_password is not None:
-                self.client.authenticate(self.trust_password)
-
-            self.old_storage_json = self._get_storage_json()
-
-            self.old_state = self._storage_json_to_module_state(self.old_storage_json)
-            self._update_storage()
-
-            state_changed = len(self.actions) > 0
-            result_json = {
-                'changed': state_changed,
-                'old_state': self.old_state,
-                'actions': self.actions
-            }
-            if self.client.debug:
-                result_json['logs'] = self.client.logs
-            self.module.exit_json(**result_json)
-        except LXDClientException as e:
-            state_changed = len(self.actions) > 0
-            fail_params = {
-                'msg': e.msg,
-                'changed': state_changed,
-                'actions': self.actions
-            }
-            if self.client.debug:
-                fail_params['logs'] = e.kwargs['logs']
-            self.module.fail_json(**fail_params)
+from ansible.module_utils.lxd_common import (
+    LXD_SCHEMA_ARGS, LXD_TIMINGS_ARGS, LXD_WORKER_ARGS, lxd_argument_spec
+)
+from ansible.module_utils.lxd_diff import UPDATE_MODES
+from ansible.module_utils.lxd_storage_engine import (
+    LXDStorageManagement, STORAGES_STATES, POOL_OPTIONS
+)
+from ansible.module_utils.lxd_worker import run_in_worker
 
 
 def main():
     """Ansible Main module."""
 
-    module = AnsibleModule(
-        argument_spec=dict(
-            client_cert=dict(
-                type='str',
-                default='{}/.config/lxc/client.crt'.format(os.environ['HOME']),
-                aliases=['cert_file']
-            ),
-            client_key=dict(
-                type='str',
-                default='{}/.config/lxc/client.key'.format(os.environ['HOME']),
-                aliases=['key_file']
-            ),
-            config=dict(
-                type='dict',
-            ),
-            description=dict(
-                type='str',
-            ),
-            driver=dict(
-                type='str',
-                required=True
-            ),
-            name=dict(
-                type='str',
-                required=True
-            ),
-            state=dict(
-                choices=STORAGES_STATES,
-                default='present'
-            ),
-            trust_password=dict(
-                type='str',
-                no_log=True
-            ),
-            url=dict(
-                type='str',
-                default='unix:/var/lib/lxd/unix.socket'
-            )
+    argument_spec = lxd_argument_spec(LXD_TIMINGS_ARGS, LXD_WORKER_ARGS, LXD_SCHEMA_ARGS)
+    argument_spec.update(
+        config=dict(
+            type='dict',
+        ),
+        description=dict(
+            type='str',
+        ),
+        driver=dict(
+            type='str',
+        ),
+        max_parallel=dict(
+            type='int',
+            default=1
+        ),
+        name=dict(
+            type='str',
+        ),
+        pools=dict(
+            type='list',
+            elements='dict',
+            options=POOL_OPTIONS,
+        ),
+        state=dict(
+            choices=STORAGES_STATES,
+            default='present'
+        ),
+        state_cache=dict(
+            type='path',
         ),
+        update_mode=dict(
+            choices=UPDATE_MODES,
+            default='patch'
+        ),
+        validate_config=dict(
+            type='bool',
+            default=True
+        ),
+        wait_timeout=dict(
+            type='int',
+        )
+    )
+
+    module = AnsibleModule(
+        argument_spec=argument_spec,
+        mutually_exclusive=[('name', 'pools')],
+        required_one_of=[('name', 'pools')],
+        required_by=dict(name=('driver',)),
         supports_check_mode=True,
     )
 
+    if module.params['worker_socket'] is not None:
+        run_in_worker(module, 'pools')
+
     lxd_manage = LXDStorageManagement(module=module)
     lxd_manage.run()
 
@@ -0,0 +1,602 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2024, Mikhail Shurutov <shurutov@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import hashlib
+import json
+import re
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape, quoteattr
+
+from ansible.module_utils.common.text.converters import to_bytes, to_text
+
+# SCALED_UNITS maps the units of libvirt scaled integers to bytes.
+SCALED_UNITS = {
+    'b': 1, 'bytes': 1,
+    'kb': 10 ** 3, 'k': 2 ** 10, 'kib': 2 ** 10,
+    'mb': 10 ** 6, 'm': 2 ** 20, 'mib': 2 ** 20,
+    'gb': 10 ** 9, 'g': 2 ** 30, 'gib': 2 ** 30,
+    'tb': 10 ** 12, 't': 2 ** 40, 'tib': 2 ** 40,
+    'pb': 10 ** 15, 'p': 2 ** 50, 'pib': 2 ** 50,
+    'eb': 10 ** 18, 'e': 2 ** 60, 'eib': 2 ** 60,
+}
+
+# DOMAIN_SECTIONS is a list of VM keys holding lists of domain elements,
+# in the order they are written after the os and sysinfo sections.
+DOMAIN_SECTIONS = [
+    'cpu', 'iothreads', 'memory', 'numa'
+]
+
+# TUNING_KEYS is a list of keys accepted in the tuning of a VM.
+TUNING_KEYS = [
+    'blk_queues', 'emulatorpin', 'hugepages', 'iothreadpin', 'iothreads',
+    'net_queues', 'numatune', 'vcpupin'
+]
+
+# TUNING_TAGS maps the tuning keys to the elements they are written to,
+# which cannot be given in the sections of the VM as well.
+TUNING_TAGS = {
+    'emulatorpin': 'cputune',
+    'hugepages': 'memoryBacking',
+    'iothreadpin': 'cputune',
+    'iothreads': 'iothreads',
+    'numatune': 'numatune',
+    'vcpupin': 'cputune'
+}
+
+# NUMATUNE_MODES is a list of memory modes of numatune.
+NUMATUNE_MODES = [
+    'interleave', 'preferred', 'restrictive', 'strict'
+]
+
+# CPUSET_RE matches the libvirt cpuset syntax, e.g. 0-3,^2,6
+CPUSET_RE = re.compile(r'^\^?\d+(-\d+)?(,\^?\d+(-\d+)?)*$')
+
+# CPUSET_ATTRS is a list of attributes holding cpusets or nodesets, which
+# libvirt reports as sorted ranges.
+CPUSET_ATTRS = [
+    'cpus', 'cpuset', 'nodeset'
+]
+
+# RUNTIME_ATTRS is a list of domain attributes libvirt only reports for
+# running domains.
+RUNTIME_ATTRS = [
+    'id'
+]
+
+# DEFAULT_DEVICE_TAGS is a list of device tags libvirt adds devices of next
+# to the listed ones, like the PCI root controller, the PS/2 inputs, the
+# console of a serial port and the video of a graphics device.
+DEFAULT_DEVICE_TAGS = [
+    'audio', 'console', 'controller', 'emulator', 'input', 'memballoon', 'video',
+    'watchdog'
+]
+
+
+class LibvirtDomainException(Exception):
+    def __init__(self, msg, **kwargs):
+        self.msg = msg
+        self.kwargs = kwargs
+
+
+def _attrs(item):
+    attrs = item.get('attrs', None) or []
+    if isinstance(attrs, dict):
+        return [(k, to_text(v)) for k, v in attrs.items()]
+    return [(attr['name'], to_text(attr['value'])) for attr in attrs]
+
+
+class DomainXMLWriter(object):
+    def __init__(self):
+        """Streaming writer of domain XML.
+
+        Elements of the VM schema are written as text chunks in order,
+        without building a tree.
+        """
+        self.chunks = []
+
+    def start(self, tag, attrs=(), empty=False):
+        self.chunks.append('<{0}{1}{2}>'.format(tag, ''.join(
+            ' {0}={1}'.format(k, quoteattr(v)) for k, v in attrs
+        ), '/' if empty else ''))
+
+    def end(self, tag):
+        self.chunks.append('</{0}>'.format(tag))
+
+    def raw(self, xml):
+        self.chunks.append(xml)
+
+    def element(self, item):
+        """Write an element of the VM schema.
+
+        An element is a dict with its tag in name, its attributes in attrs
+        as a list of name and value pairs or as a dict, its text in value
+        and its child elements in parameters.
+
+        :param item: The element of the VM schema.
+        :type item: ``dict``
+        """
+        if 'name' not in item:
+            raise LibvirtDomainException('every element must have a name: {0}'.format(item))
+        if item.get('value', None) is None and not item.get('parameters', None):
+            self.start(item['name'], _attrs(item), empty=True)
+            return
+        self.start(item['name'], _attrs(item))
+        if item.get('value', None) is not None:
+            self.chunks.append(escape(to_text(item['value'])))
+        for child in item.get('parameters', None) or []:
+            self.element(child)
+        self.end(item['name'])
+
+    def getvalue(self):
+        return ''.join(self.chunks)
+
+
+# _FRAGMENTS keeps the XML of sections written already, keyed by the hash
+# of their content, so sections shared by many VMs are written once.
+_FRAGMENTS = {}
+
+
+def _fragment(write, section):
+    key = hashlib.sha1(
+        to_bytes('{0}:{1}'.format(write.__name__, json.dumps(section, sort_keys=True, default=to_text)))
+    ).hexdigest()
+    if key not in _FRAGMENTS:
+        writer = DomainXMLWriter()
+        write(writer, section)
+        _FRAGMENTS[key] = writer.getvalue()
+    return _FRAGMENTS[key]
+
+
+def _write_general(writer, general):
+    for param in general:
+        if param['name'] != 'metadata':
+            writer.element(param)
+            continue
+        writer.start('metadata')
+        for fragment in param.get('value', None) or []:
+            try:
+                ET.fromstring(fragment)
+            except ET.ParseError as e:
+                raise LibvirtDomainException('cannot parse metadata {0}: {1}'.format(fragment, e))
+            writer.raw(fragment)
+        writer.end('metadata')
+
+
+def _write_os(writer, osboot):
+    head = osboot.get('head', None) or {'name': 'os'}
+    writer.start(head['name'], _attrs(head))
+    if osboot.get('type', None) is not None:
+        writer.element(dict(osboot['type'], parameters=None))
+    for param in osboot.get('parameters', None) or []:
+        writer.element(param)
+    writer.end(head['name'])
+
+
+def _write_sysinfo(writer, sysinfo):
+    head = sysinfo.get('head', None) or {'name': 'sysinfo'}
+    writer.start(head['name'], _attrs(head))
+    for block in sysinfo.get('parameters', None) or []:
+        writer.start(block['name'], _attrs(block))
+        for entry in block.get('parameters', None) or []:
+            writer.element({'name': 'entry', 'attrs': {'name': entry['name']}, 'value': entry['value']})
+        writer.end(block['name'])
+    writer.end(head['name'])
+
+
+def _write_elements(writer, items):
+    for item in items:
+        writer.element(item)
+
+
+def _write_device(writer, device):
+    writer.element(device)
+
+
+def vm_name(vm):
+    """Return the domain name of a VM.
+
+    :rtype: ``str``
+    """
+    for param in vm.get('general', None) or []:
+        if param.get('name', None) == 'name':
+            return to_text(param['value'])
+    raise LibvirtDomainException('every VM must have a name in general')
+
+
+def _vm_element(vm, tag):
+    for section in ['general'] + DOMAIN_SECTIONS:
+        for item in vm.get(section, None) or []:
+            if item.get('name', None) == tag:
+                return item
+    return None
+
+
+def vm_vcpus(vm):
+    """Return the number of vCPUs of a VM, 1 if it is not given.
+
+    :rtype: ``int``
+    """
+    vcpu = _vm_element(vm, 'vcpu')
+    if vcpu is None or vcpu.get('value', None) is None:
+        return 1
+    return _positive_int('vcpu', vcpu['value'])
+
+
+def vm_memory(vm):
+    """Return the memory of a VM in KiB, None if it is not given.
+
+    :rtype: ``int``
+    """
+    memory = _vm_element(vm, 'memory')
+    if memory is None or memory.get('value', None) is None:
+        return None
+    unit = dict(_attrs(memory)).get('unit', 'KiB')
+    factor = SCALED_UNITS.get(unit.strip().lower(), None)
+    if factor is None:
+        raise LibvirtDomainException('unknown memory unit {0}'.format(unit))
+    return _positive_int('memory', memory['value']) * factor // 1024
+
+
+def _positive_int(name, value):
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        number = 0
+    if isinstance(value, bool) or number < 1:
+        raise LibvirtDomainException('{0} must be a positive integer, got {1}'.format(name, value))
+    return number
+
+
+def _cpuset(name, value):
+    cpuset = to_text(value).replace(' ', '')
+    if not CPUSET_RE.match(cpuset):
+        raise LibvirtDomainException('{0} must be a cpuset like 0-3,^2,6, got {1}'.format(name, value))
+    return cpuset
+
+
+def _pins(name, pins, limit, first):
+    if not isinstance(pins, dict):
+        raise LibvirtDomainException('{0} must be a dict of cpusets'.format(name))
+    result = {}
+    for key, cpuset in pins.items():
+        try:
+            index = int(key)
+        except (TypeError, ValueError):
+            index = -1
+        if index < first or index >= limit + first:
+            raise LibvirtDomainException('{0} has no {1}, the range is {2}-{3}'.format(
+                name, key, first, limit + first - 1))
+        result[index] = _cpuset('{0}.{1}'.format(name, key), cpuset)
+    return result
+
+
+def validate_tuning(vm):
+    """Return the tuning of a VM checked and normalized.
+
+    :param vm: The VM.
+    :type vm: ``dict``
+    :rtype: ``dict``
+    """
+    tuning = vm.get('tuning', None) or {}
+    unknown = sorted(set(tuning) - set(TUNING_KEYS))
+    if unknown:
+        raise LibvirtDomainException('unknown tuning keys {0}, supported are {1}'.format(
+            ', '.join(unknown), ', '.join(TUNING_KEYS)))
+    tuning = dict((k, v) for k, v in tuning.items() if v is not None and v is not False)
+    result = {}
+    for key in ('iothreads', 'net_queues', 'blk_queues'):
+        if key in tuning:
+            result[key] = _positive_int('tuning.{0}'.format(key), tuning[key])
+    if 'iothreadpin' in tuning:
+        if 'iothreads' not in result:
+            raise LibvirtDomainException('tuning.iothreadpin requires tuning.iothreads')
+        result['iothreadpin'] = _pins('tuning.iothreadpin', tuning['iothreadpin'], result['iothreads'], 1)
+    if 'vcpupin' in tuning:
+        result['vcpupin'] = _pins('tuning.vcpupin', tuning['vcpupin'], vm_vcpus(vm), 0)
+    if 'emulatorpin' in tuning:
+        result['emulatorpin'] = _cpuset('tuning.emulatorpin', tuning['emulatorpin'])
+    if 'hugepages' in tuning:
+        hugepages = tuning['hugepages']
+        if hugepages is True:
+            hugepages = {}
+        if not isinstance(hugepages, dict):
+            raise LibvirtDomainException('tuning.hugepages must be true or a dict of size, unit and nodeset')
+        page = {}
+        if hugepages.get('size', None) is not None:
+            page['size'] = to_text(_positive_int('tuning.hugepages.size', hugepages['size']))
+            page['unit'] = to_text(hugepages.get('unit', None) or 'KiB')
+            if page['unit'].lower() not in SCALED_UNITS:
+                raise LibvirtDomainException('unknown tuning.hugepages.unit {0}'.format(page['unit']))
+        if hugepages.get('nodeset', None) is not None:
+            if 'size' not in page:
+                raise LibvirtDomainException('tuning.hugepages.nodeset requires tuning.hugepages.size')
+            page['nodeset'] = _cpuset('tuning.hugepages.nodeset', hugepages['nodeset'])
+        result['hugepages'] = page
+    if 'numatune' in tuning:
+        numatune = tuning['numatune']
+        if not isinstance(numatune, dict) or numatune.get('nodeset', None) is None:
+            raise LibvirtDomainException('tuning.numatune must be a dict of mode and nodeset')
+        mode = numatune.get('mode', None) or 'strict'
+        if mode not in NUMATUNE_MODES:
+            raise LibvirtDomainException('tuning.numatune.mode must be one of {0}, got {1}'.format(
+                ', '.join(NUMATUNE_MODES), mode))
+        result['numatune'] = {'mode': mode, 'nodeset': _cpuset('tuning.numatune.nodeset', numatune['nodeset'])}
+    for key in result:
+        tag = TUNING_TAGS.get(key, None)
+        if tag is not None and _vm_element(vm, tag) is not None:
+            raise LibvirtDomainException('{0} is given both by tuning.{1} and a section of the VM'.format(tag, key))
+    return result
+
+
+def tuning_elements(tuning):
+    """Return the domain elements of a validated tuning.
+
+    :rtype: ``list``
+    """
+    elements = []
+    if 'iothreads' in tuning:
+        elements.append({'name': 'iothreads', 'value': tuning['iothreads']})
+    pins = [
+        {'name': 'vcpupin', 'attrs': [{'name': 'vcpu', 'value': k}, {'name': 'cpuset', 'value': v}]}
+        for k, v in sorted(tuning.get('vcpupin', {}).items())
+    ]
+    if 'emulatorpin' in tuning:
+        pins.append({'name': 'emulatorpin', 'attrs': {'cpuset': tuning['emulatorpin']}})
+    pins.extend(
+        {'name': 'iothreadpin', 'attrs': [{'name': 'iothread', 'value': k}, {'name': 'cpuset', 'value': v}]}
+        for k, v in sorted(tuning.get('iothreadpin', {}).items())
+    )
+    if pins:
+        elements.append({'name': 'cputune', 'parameters': pins})
+    if 'hugepages' in tuning:
+        page = tuning['hugepages']
+        elements.append({'name': 'memoryBacking', 'parameters': [{
+            'name': 'hugepages',
+            'parameters': [{'name': 'page', 'attrs': [
+                {'name': k, 'value': page[k]} for k in ('size', 'unit', 'nodeset') if k in page
+            ]}] if page else None
+        }]})
+    if 'numatune' in tuning:
+        elements.append({'name': 'numatune', 'parameters': [{
+            'name': 'memory',
+            'attrs': [{'name': 'mode', 'value': tuning['numatune']['mode']},
+                      {'name': 'nodeset', 'value': tuning['numatune']['nodeset']}]
+        }]})
+    return elements
+
+
+def _child_attr(device, tag, attr):
+    for child in device.get('parameters', None) or []:
+        if child.get('name', None) == tag:
+            return dict(_attrs(child)).get(attr, None)
+    return None
+
+
+def with_queues(device, tuning):
+    """Return a device with the multiqueue of the tuning set.
+
+    Virtio interfaces get the vhost driver with net_queues queues and
+    virtio disks get blk_queues queues, unless the driver of the device
+    sets them already.
+
+    :rtype: ``dict``
+    """
+    if device.get('name', None) == 'interface' and 'net_queues' in tuning \
+            and _child_attr(device, 'model', 'type') == 'virtio':
+        driver = [('name', 'vhost'), ('queues', to_text(tuning['net_queues']))]
+    elif device.get('name', None) == 'disk' and 'blk_queues' in tuning \
+            and _child_attr(device, 'target', 'bus') == 'virtio':
+        driver = [('queues', to_text(tuning['blk_queues']))]
+    else:
+        return device
+    children = list(device.get('parameters', None) or [])
+    for i, child in enumerate(children):
+        if child.get('name', None) == 'driver':
+            attrs = _attrs(child)
+            attrs.extend((k, v) for k, v in driver if k not in dict(attrs))
+            children[i] = dict(child, attrs=[{'name': k, 'value': v} for k, v in attrs])
+            break
+    else:
+        children.insert(0, {'name': 'driver', 'attrs': [{'name': k, 'value': v} for k, v in driver]})
+    return dict(device, parameters=children)
+
+
+def domain_xml(vm):
+    """Return the domain XML of a VM of libvirt_libvirt_vms.
+
+    The sections are written in the order of the libvirt domain format:
+    general, os, sysinfo, cpu, iothreads, memory, numa, the elements of
+    the tuning and devices. The os, sysinfo, cpu, iothreads, memory, numa
+    and tuning sections and every device are written once per content and
+    reused for other VMs.
+
+    :param vm: The VM.
+    :type vm: ``dict``
+    :rtype: ``str``
+    """
+    tuning = validate_tuning(vm)
+    attrs = [('type', to_text(vm.get('type', None) or 'kvm'))]
+    if vm.get('vmid', None) is not None:
+        attrs.append(('id', to_text(vm['vmid'])))
+    writer = DomainXMLWriter()
+    writer.start('domain', attrs)
+    _write_general(writer, vm.get('general', None) or [])
+    if vm.get('osboot', None) is not None:
+        writer.raw(_fragment(_write_os, vm['osboot']))
+    if vm.get('sysinfo', None) is not None:
+        writer.raw(_fragment(_write_sysinfo, vm['sysinfo']))
+    for section in DOMAIN_SECTIONS:
+        if vm.get(section, None):
+            writer.raw(_fragment(_write_elements, vm[section]))
+    if tuning:
+        writer.raw(_fragment(_write_elements, tuning_elements(tuning)))
+    if vm.get('devices', None):
+        writer.start('devices')
+        for device in vm['devices']:
+            writer.raw(_fragment(_write_device, with_queues(device, tuning)))
+        writer.end('devices')
+    writer.end('domain')
+    return writer.getvalue()
+
+
+def build_domain(vm):
+    """Build the domain XML of a VM of libvirt_libvirt_vms as an element.
+
+    :param vm: The VM.
+    :type vm: ``dict``
+    :rtype: ``xml.etree.ElementTree.Element``
+    """
+    return ET.fromstring(domain_xml(vm))
+
+
+def _scaled_bytes(value, unit):
+    if unit is None or value is None:
+        return None
+    factor = SCALED_UNITS.get(unit.strip().lower(), None)
+    if factor is None or not re.match(r'^\s*\d+\s*$', value):
+        return None
+    return int(value) * factor
+
+
+def canonical_cpuset(cpuset):
+    """Return a cpuset as sorted and merged ranges.
+
+    Exclusions are applied, so 2,0,1 and 0-3,^3 both give 0-2.
+
+    :returns: The cpuset, or None if it is not one.
+    :rtype: ``str``
+    """
+    cpuset = to_text(cpuset).replace(' ', '')
+    if not CPUSET_RE.match(cpuset):
+        return None
+    included = set()
+    excluded = set()
+    for part in cpuset.split(','):
+        first, dummy, last = part.lstrip('^').partition('-')
+        cpus = excluded if part.startswith('^') else included
+        cpus.update(range(int(first), int(last or first) + 1))
+    ranges = []
+    for cpu in sorted(included - excluded):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(
+        to_text(first) if first == last else '{0}-{1}'.format(first, last) for first, last in ranges
+    )
+
+
+def canonicalize(elem):
+    """Bring an element to the canonical form in place.
+
+    Whitespace around texts is dropped, scaled integers and hugepage sizes
+    are converted to KiB, the unit libvirt reports them in, and cpusets
+    are written as sorted ranges.
+
+    :rtype: ``xml.etree.ElementTree.Element``
+    """
+    elem.text = elem.text.strip() if elem.text is not None else None
+    elem.text = elem.text or None
+    elem.tail = None
+    size = _scaled_bytes(elem.text, elem.get('unit', None))
+    if size is not None and size % 1024 == 0:
+        elem.set('unit', 'KiB')
+        elem.text = to_text(size // 1024)
+    if elem.tag == 'page':
+        # The page size is an attribute in KiB by default
+        size = _scaled_bytes(elem.get('size', None), elem.get('unit', 'KiB'))
+        if size is not None and size % 1024 == 0:
+            elem.set('unit', 'KiB')
+            elem.set('size', to_text(size // 1024))
+    for attr in CPUSET_ATTRS:
+        cpuset = canonical_cpuset(elem.get(attr)) if attr in elem.attrib else None
+        if cpuset is not None:
+            elem.set(attr, cpuset)
+    for child in elem:
+        canonicalize(child)
+    return elem
+
+
+def canonical_xml(elem):
+    """Return an element in canonical form as a string.
+
+    Attributes are sorted, so equal elements give equal strings.
+
+    :param elem: The element or its XML.
+    :type elem: ``xml.etree.ElementTree.Element`` or ``str``
+    :rtype: ``str``
+    """
+    if not isinstance(elem, ET.Element):
+        elem = ET.fromstring(elem)
+    elem = canonicalize(elem)
+
+    def write(e, depth):
+        attrs = ''.join(
+            ' {0}="{1}"'.format(k, _escape(v)) for k, v in sorted(e.attrib.items())
+        )
+        indent = '  ' * depth
+        if len(e) == 0:
+            if e.text is None:
+                return '{0}<{1}{2}/>\n'.format(indent, e.tag, attrs)
+            return '{0}<{1}{2}>{3}</{1}>\n'.format(indent, e.tag, attrs, _escape(e.text))
+        inner = ''.join(write(child, depth + 1) for child in e)
+        return '{0}<{1}{2}>\n{3}{0}</{1}>\n'.format(indent, e.tag, attrs, inner)
+
+    return write(elem, 0)
+
+
+def _escape(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
+
+
+def _element_differs(desired, actual, ignored_attrs=(), exact=False):
+    if desired.tag != actual.tag or desired.text != actual.text:
+        return True
+    for k, v in desired.attrib.items():
+        if k not in ignored_attrs and actual.get(k, None) != v:
+            return True
+    seen = {}
+    for child in desired:
+        index = seen.get(child.tag, 0)
+        seen[child.tag] = index + 1
+        candidates = [c for c in actual if c.tag == child.tag]
+        if index >= len(candidates) or _element_differs(
+                child, candidates[index], exact=exact or child.tag in TUNING_TAGS.values()):
+            return True
+    # Children removed from the VM are still defined
+    counted = set(child.tag for child in actual)
+    if desired.tag == 'devices':
+        counted.difference_update(DEFAULT_DEVICE_TAGS)
+    elif desired.tag == 'domain':
+        counted.intersection_update(TUNING_TAGS.values())
+    elif not exact:
+        counted = set()
+    for tag in counted:
+        if len(actual.findall(tag)) != seen.get(tag, 0):
+            return True
+    return False
+
+
+def domain_differs(desired, actual):
+    """Return whether a defined domain differs from the desired one.
+
+    Only what is desired is compared: libvirt fills in defaults such as
+    the UUID, device addresses and controllers, which are not listed by
+    the VM and are ignored, as well as the runtime id of the domain.
+    Desired children are matched with the actual children of the same tag
+    in order. Devices must be as many as listed, except those of
+    DEFAULT_DEVICE_TAGS, and the elements of TUNING_TAGS must be exactly
+    the listed ones, so removed devices and tuning are detected too.
+
+    :param desired: The desired domain, in canonical form.
+    :type desired: ``xml.etree.ElementTree.Element``
+    :param actual: The defined domain, in canonical form.
+    :type actual: ``xml.etree.ElementTree.Element``
+    :rtype: ``bool``
+    """
+    return _element_differs(desired, actual, RUNTIME_ATTRS)
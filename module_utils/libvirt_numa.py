@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2024, Mikhail Shurutov <shurutov@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import re
+
+from ansible.module_utils.libvirt_domain import vm_memory, vm_name, vm_vcpus
+
+# NODE_ROOT is the sysfs directory of the NUMA nodes of the host.
+NODE_ROOT = '/sys/devices/system/node'
+
+
+def parse_cpulist(cpulist):
+    """Return the CPUs of a sysfs cpulist such as 0-3,8-11.
+
+    :rtype: ``list``
+    """
+    cpus = []
+    for part in cpulist.strip().split(','):
+        if not part:
+            continue
+        first, dummy, last = part.partition('-')
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def format_cpulist(cpus):
+    """Return CPUs in the cpuset syntax, ranges joined.
+
+    :rtype: ``str``
+    """
+    parts = []
+    for cpu in sorted(set(cpus)):
+        if parts and parts[-1][1] == cpu - 1:
+            parts[-1][1] = cpu
+        else:
+            parts.append([cpu, cpu])
+    return ','.join(
+        str(first) if first == last else '{0}-{1}'.format(first, last)
+        for first, last in parts
+    )
+
+
+def numa_topology(root=NODE_ROOT):
+    """Read the NUMA topology of the host.
+
+    :param root: The sysfs directory of the NUMA nodes.
+    :type root: ``str``
+    :returns: The CPUs and the memory in KiB per node id, empty if the
+              host has no NUMA information.
+    :rtype: ``dict``
+    """
+    topology = {}
+    if not os.path.isdir(root):
+        return topology
+    for entry in os.listdir(root):
+        m = re.match(r'^node(\d+)$', entry)
+        if not m:
+            continue
+        with open(os.path.join(root, entry, 'cpulist')) as f:
+            cpus = parse_cpulist(f.read())
+        memory = 0
+        meminfo = os.path.join(root, entry, 'meminfo')
+        if os.path.exists(meminfo):
+            with open(meminfo) as f:
+                for line in f:
+                    # Node 0 MemTotal:       16318412 kB
+                    mm = re.match(r'^Node\s+\d+\s+MemTotal:\s+(\d+)\s+kB', line)
+                    if mm:
+                        memory = int(mm.group(1))
+        if cpus:
+            topology[int(m.group(1))] = {'cpus': cpus, 'memory': memory}
+    return topology
+
+
+def propose_pinning(topology, vms):
+    """Propose NUMA-local pinning of VMs.
+
+    Every VM is placed on the node with the most CPUs left, among the
+    nodes with enough memory left if any. Its vCPUs are pinned to CPUs of
+    the node, not shared with other VMs while the node has free CPUs, and
+    its emulator and memory are bound to the node.
+
+    :param topology: The NUMA topology as returned by numa_topology.
+    :type topology: ``dict``
+    :param vms: The VMs of libvirt_libvirt_vms.
+    :type vms: ``list``
+    :returns: The tuning keys proposed per VM name.
+    :rtype: ``dict``
+    """
+    free_cpus = dict((node, list(info['cpus'])) for node, info in topology.items())
+    free_memory = dict((node, info['memory']) for node, info in topology.items())
+    used = dict((node, 0) for node in topology)
+    proposals = {}
+    for vm in vms:
+        vcpus = vm_vcpus(vm)
+        memory = vm_memory(vm) or 0
+        candidates = [node for node in topology if free_memory[node] >= memory] or list(topology)
+        node = max(sorted(candidates), key=lambda n: (len(free_cpus[n]), free_memory[n]))
+        pins = {}
+        for vcpu in range(vcpus):
+            if free_cpus[node]:
+                pins[vcpu] = free_cpus[node].pop(0)
+            else:
+                # The node is oversubscribed, CPUs are shared round robin
+                cpus = topology[node]['cpus']
+                pins[vcpu] = cpus[used[node] % len(cpus)]
+                used[node] += 1
+        free_memory[node] -= memory
+        proposals[vm_name(vm)] = {
+            'vcpupin': dict((vcpu, str(cpu)) for vcpu, cpu in pins.items()),
+            'emulatorpin': format_cpulist(topology[node]['cpus']),
+            'numatune': {'mode': 'strict', 'nodeset': str(node)}
+        }
+    return proposals
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2024, Mikhail Shurutov <shurutov@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import hashlib
+import json
+import os
+import tempfile
+
+
+def state_digest(*objs):
+    """Return a stable digest of JSON serializable objects.
+
+    :rtype: ``str``
+    """
+    data = json.dumps(objs, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class LXDStateCache(object):
+    def __init__(self, path):
+        """Cache of the ETags of LXD objects which matched the desired state.
+
+        An entry is keyed by the URL of the object and holds the ETag seen
+        when the object was last found converged, and the digest of the
+        desired state it was compared with.
+
+        :param path: The cache file path.
+        :type path: ``str``
+        """
+        self.path = path
+        self.changed = False
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (IOError, OSError, ValueError):
+            self.entries = {}
+        if not isinstance(self.entries, dict):
+            self.entries = {}
+
+    def etag(self, key, digest):
+        """Return the ETag stored for key if it was stored for digest."""
+        entry = self.entries.get(key, None)
+        if entry is None or entry.get('digest', None) != digest:
+            return None
+        return entry.get('etag', None)
+
+    def store(self, key, etag, digest):
+        entry = {'etag': etag, 'digest': digest}
+        if self.entries.get(key, None) != entry:
+            self.entries[key] = entry
+            self.changed = True
+
+    def forget(self, key):
+        if self.entries.pop(key, None) is not None:
+            self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.lxd_state_cache')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.entries, f, sort_keys=True)
+        os.rename(tmp_path, self.path)
+        self.changed = False
+
+
+class LXDAuthCache(LXDStateCache):
+    def __init__(self, path):
+        """Cache of the LXD servers which trust a client certificate.
+
+        An entry is keyed by the URL of the server and holds the
+        fingerprint of the client certificate it was found to trust.
+
+        :param path: The cache file path.
+        :type path: ``str``
+        """
+        super(LXDAuthCache, self).__init__(path)
+
+    def trusted(self, url, fingerprint):
+        """Return whether the server at url was found to trust fingerprint."""
+        entry = self.entries.get(url, None)
+        return isinstance(entry, dict) and entry.get('fingerprint', None) == fingerprint
+
+    def trust(self, url, fingerprint):
+        entry = {'fingerprint': fingerprint}
+        if self.entries.get(url, None) != entry:
+            self.entries[url] = entry
+            self.changed = True
+
+
+class LXDSchemaCache(LXDStateCache):
+    def __init__(self, path):
+        """Cache of the config key schemas of LXD servers.
+
+        Schemas are kept per LXD version and servers are mapped by URL to
+        the version they were found running.
+
+        :param path: The cache file path.
+        :type path: ``str``
+        """
+        super(LXDSchemaCache, self).__init__(path)
+        self.entries.setdefault('servers', {})
+        self.entries.setdefault('schemas', {})
+
+    def version(self, url):
+        """Return the LXD version the server at url was found running."""
+        return self.entries['servers'].get(url, None)
+
+    def has_schema(self, version):
+        return version in self.entries['schemas']
+
+    def schema(self, version):
+        """Return the configs of /1.0/metadata/configuration of a version."""
+        return self.entries['schemas'].get(version, None)
+
+    def store_schema(self, url, version, configs):
+        if self.entries['servers'].get(url, None) != version:
+            self.entries['servers'][url] = version
+            self.changed = True
+        if not self.has_schema(version) or self.entries['schemas'][version] != configs:
+            self.entries['schemas'][version] = configs
+            self.changed = True
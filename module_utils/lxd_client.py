@@ -0,0 +1,778 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2024, Mikhail Shurutov <shurutov@gmail.com> based on ansible.module_utils.lxd by Hiroaki Nakamura <hnakamur@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import collections
+import errno
+import hashlib
+import json
+import random
+import re
+import socket
+import ssl
+import threading
+import time
+
+from ansible.module_utils.common.text.converters import to_text
+from ansible.module_utils.lxd_cache import LXDAuthCache
+from ansible.module_utils.lxd_timings import LXDTimings
+from ansible.module_utils.six.moves.http_client import (
+    HTTPConnection, HTTPSConnection, HTTPException
+)
+from ansible.module_utils.six.moves.urllib.parse import urlparse
+
+# IDEMPOTENT_METHODS may be resent after a kept-alive connection was
+# closed by the server.
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'PATCH', 'DELETE')
+
+# NOT_MODIFIED is returned instead of a response body when the ETag of
+# the requested object matches the known one.
+NOT_MODIFIED = {
+    'type': 'sync',
+    'status': 'Not Modified',
+    'status_code': 304,
+    'metadata': None
+}
+
+# LOG_MAX_ENTRIES is the default number of log entries kept in memory.
+LOG_MAX_ENTRIES = 100
+
+# LOG_MAX_BODY is the default number of body characters kept per entry.
+LOG_MAX_BODY = 4096
+
+# MAX_REQUESTS is the default number of requests sent at the same time to
+# one LXD server.
+MAX_REQUESTS = 8
+
+# RETRY_TIMEOUT is the default number of seconds transient errors of a
+# request are retried for.
+RETRY_TIMEOUT = 30
+
+# RETRY_BASE_DELAY and RETRY_MAX_DELAY bound the exponential backoff in
+# seconds, the delay is drawn at random below the bound.
+RETRY_BASE_DELAY = 0.1
+RETRY_MAX_DELAY = 5
+
+# TRANSIENT_STATUS_CODES are HTTP statuses of requests which may succeed
+# when they are sent again.
+TRANSIENT_STATUS_CODES = (429, 502, 503, 504)
+
+# TRANSIENT_ERRORS matches the errors of a busy LXD daemon or database.
+TRANSIENT_ERRORS = re.compile(
+    r'database is (locked|busy)|failed to begin transaction|no available dqlite leader'
+    r'|operation (is )?in progress|is busy running|try again later',
+    re.IGNORECASE
+)
+
+# TRANSIENT_ERRNOS are connection errors of requests which were not sent.
+TRANSIENT_ERRNOS = (errno.ECONNREFUSED, errno.ENOENT, errno.EAGAIN)
+
+
+class LXDClientException(Exception):
+    def __init__(self, msg, **kwargs):
+        self.msg = msg
+        self.kwargs = kwargs
+
+
+class LXDTransientException(LXDClientException):
+    """Error of a request which may succeed when it is sent again."""
+
+
+class LXDUntrustedException(LXDClientException):
+    """Error of a request the server refused with HTTP 403."""
+
+
+class UnixHTTPConnection(HTTPConnection):
+    def __init__(self, path, timeout=None):
+        HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            sock.settimeout(self.timeout)
+        sock.connect(self.path)
+        self.sock = sock
+
+
+class TLSSessionHTTPSConnection(HTTPSConnection):
+    def __init__(self, host, context, timeout=None):
+        """HTTPS connection which resumes the previous TLS session on reconnect.
+
+        :param host: Host and port of the LXD server.
+        :type host: ``str``
+        :param context: SSL context with the client certificate loaded.
+        :type context: ``ssl.SSLContext``
+        """
+        HTTPSConnection.__init__(self, host, timeout=timeout, context=context)
+        self.ssl_context = context
+        self.tls_session = None
+
+    def connect(self):
+        HTTPConnection.connect(self)
+        self.sock = self.ssl_context.wrap_socket(
+            self.sock, server_hostname=self.host, session=self.tls_session
+        )
+
+    def remember_session(self):
+        # TLS 1.3 tickets arrive after the handshake, so the session is
+        # taken once a response has been read.
+        if self.sock is not None and self.sock.session is not None:
+            self.tls_session = self.sock.session
+
+
+class LXDRequestLog(object):
+    def __init__(self, max_entries=LOG_MAX_ENTRIES, max_body=LOG_MAX_BODY, path=None):
+        """Bounded log of requests sent to the LXD server.
+
+        Only the last max_entries entries are kept in memory. With path
+        every entry is also appended to the file as a JSON line as soon as
+        the response is read.
+
+        :param max_entries: Maximum number of entries kept in memory.
+        :type max_entries: ``int``
+        :param max_body: Maximum number of characters kept of a body.
+        :type max_body: ``int``
+        :param path: Path of the JSON lines file.
+        :type path: ``str``
+        """
+        self.max_body = max_body
+        self.path = path
+        self.entries = collections.deque(maxlen=max(max_entries, 0))
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.stream = None
+
+    def body(self, data):
+        """Return a body as text cut to max_body characters."""
+        if data is None:
+            return None
+        text = to_text(data, errors='surrogate_or_replace')
+        if len(text) <= self.max_body:
+            return text
+        return '{0}...({1} characters truncated)'.format(
+            text[:self.max_body], len(text) - self.max_body)
+
+    def record(self, entry):
+        with self.lock:
+            if len(self.entries) == self.entries.maxlen:
+                self.dropped += 1
+            self.entries.append(entry)
+            if self.path is not None:
+                if self.stream is None:
+                    self.stream = open(self.path, 'a')
+                self.stream.write(json.dumps(entry, sort_keys=True) + '\n')
+                self.stream.flush()
+
+    def close(self):
+        with self.lock:
+            if self.stream is not None:
+                self.stream.close()
+                self.stream = None
+
+
+def request_log(params, debug):
+    """Return the request log configured by module params.
+
+    :param params: Module params with the optional log_max_body,
+        log_max_entries and log_path options.
+    :type params: ``dict``
+    :param debug: Whether logs are returned by the module.
+    :type debug: ``bool``
+    :returns: The request log, or None if requests are not logged.
+    :rtype: ``LXDRequestLog``
+    """
+    path = params.get('log_path', None)
+    if not debug and path is None:
+        return None
+    max_entries = params.get('log_max_entries', None)
+    max_body = params.get('log_max_body', None)
+    return LXDRequestLog(
+        max_entries=LOG_MAX_ENTRIES if max_entries is None else max_entries,
+        max_body=LOG_MAX_BODY if max_body is None else max_body,
+        path=path
+    )
+
+
+class LXDRequestLimiter(object):
+    def __init__(self, max_requests=MAX_REQUESTS):
+        """Cap of the requests sent at the same time to one LXD server.
+
+        Clients of the same server share it, so bulk and parallel module
+        runs do not overload the daemon. Waits for operations are not
+        counted.
+
+        :param max_requests: Maximum number of requests sent at the same time.
+        :type max_requests: ``int``
+        """
+        self.max_requests = max(max_requests, 1)
+        self.semaphore = threading.BoundedSemaphore(self.max_requests)
+
+
+def request_limiter(params):
+    """Return the request limiter configured by module params.
+
+    :param params: Module params with the optional max_requests option.
+    :type params: ``dict``
+    :rtype: ``LXDRequestLimiter``
+    """
+    max_requests = params.get('max_requests', None)
+    return LXDRequestLimiter(MAX_REQUESTS if max_requests is None else max_requests)
+
+
+class LXDClient(object):
+    def __init__(self, url, key_file=None, cert_file=None, debug=False, timeout=None, log=None,
+                 limiter=None, retry_timeout=None):
+        """LXD REST API client keeping one connection per module run.
+
+        :param url: The unix domain socket path or the https URL for the LXD server.
+        :type url: ``str``
+        :param key_file: The client certificate key file path.
+        :type key_file: ``str``
+        :param cert_file: The client certificate file path.
+        :type cert_file: ``str``
+        :param debug: Whether requests and responses are logged.
+        :type debug: ``bool``
+        :param log: Log the requests are recorded to, a default one is used
+            if it is not given and debug is set. Clones share it.
+        :type log: ``LXDRequestLog``
+        :param limiter: Cap of the requests sent at the same time, a default
+            one is used if it is not given. Clones share it.
+        :type limiter: ``LXDRequestLimiter``
+        :param retry_timeout: Seconds transient errors of a request are
+            retried for, 0 to never retry.
+        :type retry_timeout: ``int``
+        """
+        self.url = url
+        self.debug = debug
+        self.key_file = key_file
+        self.cert_file = cert_file
+        self.timeout = timeout
+        self.log = log
+        if self.log is None and debug:
+            self.log = LXDRequestLog()
+        self.limiter = limiter
+        if self.limiter is None:
+            self.limiter = LXDRequestLimiter()
+        self.retry_timeout = RETRY_TIMEOUT if retry_timeout is None else retry_timeout
+        self.timings = LXDTimings()
+        self.requests_count = 0
+        self.connections_count = 0
+        self.etags = {}
+        # Event listener resolving the waits for operations, see lxd_events
+        self.events = None
+        # Server metadata kept as long as the client, like the trust of
+        # the certificate and the config schema
+        self.server_cache = {}
+        # Password and cache path of authenticate, a request refused as
+        # untrusted makes the client authenticate again with them
+        self.trust = None
+        # Last GET /1.0 response of the run, the schema and the server
+        # config are taken from it instead of reading the server again
+        self.server_json = None
+        if url.startswith('https:'):
+            parts = urlparse(self.url)
+            ctx = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
+            try:
+                ctx.load_cert_chain(cert_file, keyfile=key_file)
+            except (IOError, OSError, ssl.SSLError) as e:
+                raise LXDClientException('cannot load the client certificate', err=e)
+            self.connection = TLSSessionHTTPSConnection(parts.netloc, ctx, timeout=timeout)
+        elif url.startswith('unix:'):
+            unix_socket_path = url[len('unix:'):]
+            self.connection = UnixHTTPConnection(unix_socket_path, timeout=timeout)
+        else:
+            raise LXDClientException('URL scheme must be unix: or https:')
+
+    def do(self, method, url, body_json=None, ok_error_codes=None, timeout=None, wait_for_container=None,
+           etag=None, known_etag=None, wait=True, wait_timeout=None):
+        """Send a request and wait for the operation it started.
+
+        :param etag: ETag sent in the If-Match header of PUT and PATCH requests.
+        :type etag: ``str``
+        :param known_etag: If the ETag of a GET response matches it, the body
+            is not decoded and NOT_MODIFIED is returned.
+        :type known_etag: ``str``
+        :param wait: If false, the response of an async request is returned
+            without waiting, see wait_operations.
+        :type wait: ``bool``
+        :param wait_timeout: Seconds to wait for the operation, None to wait
+            until it is done.
+        :type wait_timeout: ``int``
+        """
+        resp_json = self._send_request(
+            method, url, body_json=body_json, ok_error_codes=ok_error_codes, timeout=timeout,
+            etag=etag, known_etag=known_etag
+        )
+        if resp_json['type'] == 'async' and self.events is not None:
+            # The event is kept from now on, the wait may start later
+            self.events.expect(self._operation_id(resp_json))
+        if resp_json['type'] == 'async' and wait:
+            resp_json = self.wait_operation(
+                resp_json, timeout=wait_timeout, wait_for_container=wait_for_container
+            )
+        return resp_json
+
+    def wait_operation(self, resp_json, timeout=None, wait_for_container=None):
+        """Wait for the background operation of an async response.
+
+        :param resp_json: The async response.
+        :type resp_json: ``dict``
+        :param timeout: Seconds to wait, None to wait until it is done.
+        :type timeout: ``int``
+        :returns: The response with the finished operation.
+        :rtype: ``dict``
+        """
+        url = '{0}/wait'.format(resp_json['operation'])
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        operation = None
+        if self.events is not None:
+            # The server is only asked if the event stream ended or the
+            # deadline passed before the operation finished
+            operation = self.events.wait_operation(self._operation_id(resp_json), deadline)
+        if operation is not None:
+            resp_json = dict(resp_json, metadata=operation)
+        while operation is None:
+            wait_url = url
+            if deadline is not None:
+                wait_url = '{0}?timeout={1}'.format(url, max(int(deadline - time.time()), 0))
+            resp_json = self._send_request('GET', wait_url, limited=False)
+            if resp_json['metadata']['status'] != 'Running' or not wait_for_container:
+                break
+            if deadline is not None and time.time() >= deadline:
+                break
+        if resp_json['metadata']['status'] == 'Running':
+            self._raise_err('timed out waiting for operation {0}'.format(
+                resp_json['metadata'].get('id', url)))
+        if resp_json['metadata']['status'] != 'Success':
+            self._raise_err_from_json(resp_json)
+        return resp_json
+
+    def wait_operations(self, resp_jsons, timeout=None):
+        """Wait together for the operations of several async responses.
+
+        The operations run in parallel on the server, so the wait takes
+        as long as the slowest of them. Responses which are not async are
+        returned as is.
+
+        :param resp_jsons: Responses returned by do with wait=False.
+        :type resp_jsons: ``list``
+        :param timeout: Seconds to wait for all of them, None to wait until
+            they are done.
+        :type timeout: ``int``
+        :rtype: ``list``
+        """
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        results = []
+        for resp_json in resp_jsons:
+            if resp_json['type'] == 'async':
+                remaining = None
+                if deadline is not None:
+                    remaining = max(deadline - time.time(), 0)
+                resp_json = self.wait_operation(resp_json, timeout=remaining)
+            results.append(resp_json)
+        return results
+
+    def authenticate(self, trust_password, cache_path=None):
+        """Make the LXD server trust the client certificate.
+
+        The trust is read from the auth field of GET /1.0 first, so the
+        password is only sent for an untrusted certificate. With cache_path
+        servers trusting the certificate are remembered per URL and
+        certificate fingerprint, and nothing is sent to them again. If such
+        a server refuses a request later, its entry is dropped and the
+        certificate authenticated again, see _send_request.
+
+        :param trust_password: The client trusted password.
+        :type trust_password: ``str``
+        :param cache_path: The trust cache file path.
+        :type cache_path: ``str``
+        :returns: The last response, or None if the trust was cached.
+        :rtype: ``dict``
+        """
+        self.trust = (trust_password, cache_path)
+        if self.server_cache.get('trusted', False):
+            return None
+        cache = None
+        fingerprint = self._cert_fingerprint()
+        if cache_path and fingerprint is not None:
+            cache = LXDAuthCache(cache_path)
+            if cache.trusted(self.url, fingerprint):
+                self.server_cache['trusted'] = True
+                return None
+        resp_json = self._send_retried('GET', '/1.0')
+        if (resp_json.get('metadata', None) or {}).get('auth', None) != 'trusted':
+            body_json = {'type': 'client', 'password': trust_password}
+            resp_json = self._send_retried('POST', '/1.0/certificates', body_json=body_json)
+        self.server_cache['trusted'] = True
+        if cache is not None:
+            cache.trust(self.url, fingerprint)
+            try:
+                cache.save()
+            except (IOError, OSError):
+                # The trust is checked again by the next run
+                pass
+        return resp_json
+
+    def _authenticate_again(self):
+        """Forget the trust of the certificate and authenticate it again.
+
+        The certificate may have been removed from the trust store of the
+        server after it was found trusted.
+        """
+        trust_password, cache_path = self.trust
+        self.server_cache.pop('trusted', None)
+        if cache_path:
+            cache = LXDAuthCache(cache_path)
+            cache.forget(self.url)
+            try:
+                cache.save()
+            except (IOError, OSError):
+                # authenticate stores the entry again
+                pass
+        self.authenticate(trust_password, cache_path)
+
+    def _untrusted(self, method, url, resp_json):
+        """Return whether GET /1.0 reports a trusted client as untrusted."""
+        return (
+            self.trust is not None and self.server_cache.get('trusted', False) and
+            method == 'GET' and url == '/1.0' and
+            (resp_json.get('metadata', None) or {}).get('auth', None) == 'untrusted'
+        )
+
+    def _cert_fingerprint(self):
+        """Return the SHA-256 fingerprint of the client certificate.
+
+        Unix socket clients are identified by the socket only, so their
+        fingerprint is empty. None is returned if the certificate cannot
+        be read.
+        """
+        if not self.url.startswith('https:'):
+            return ''
+        try:
+            with open(self.cert_file) as f:
+                der = ssl.PEM_cert_to_DER_cert(f.read())
+        except (IOError, OSError, ValueError):
+            return None
+        return hashlib.sha256(der).hexdigest()
+
+    @property
+    def logs(self):
+        """Entries of the request log kept in memory."""
+        if self.log is None:
+            return []
+        return list(self.log.entries)
+
+    def close(self):
+        self.connection.close()
+
+    def reset(self, debug=False, log=None, retry_timeout=None):
+        """Start a new module run on the kept-alive connection.
+
+        Timings, counters, ETags, the trust password and the request log
+        belong to one run, the connection, the TLS session, the limiter and
+        server_cache are kept.
+
+        :param debug: Whether requests and responses are logged.
+        :type debug: ``bool``
+        :param log: Log the requests of the run are recorded to.
+        :type log: ``LXDRequestLog``
+        :param retry_timeout: Seconds transient errors are retried for.
+        :type retry_timeout: ``int``
+        """
+        self.debug = debug
+        self.log = log
+        self.retry_timeout = RETRY_TIMEOUT if retry_timeout is None else retry_timeout
+        if self.log is None and debug:
+            self.log = LXDRequestLog()
+        self.timings = LXDTimings()
+        self.requests_count = 0
+        self.connections_count = 0
+        self.etags = {}
+        self.events = None
+        self.trust = None
+        self.server_json = None
+
+    def clone(self):
+        """Return a client with its own connection to the same server.
+
+        The TLS session of this client is resumed by the new connection.
+        """
+        client = LXDClient(
+            self.url, key_file=self.key_file, cert_file=self.cert_file,
+            debug=self.debug, timeout=self.timeout, log=self.log,
+            limiter=self.limiter, retry_timeout=self.retry_timeout
+        )
+        if isinstance(self.connection, TLSSessionHTTPSConnection):
+            client.connection.tls_session = self.connection.tls_session
+        client.timings = self.timings
+        client.server_cache = self.server_cache
+        client.events = self.events
+        client.trust = self.trust
+        return client
+
+    def merge(self, other):
+        """Take over the counters of a cloned client."""
+        self.requests_count += other.requests_count
+        self.connections_count += other.connections_count
+        self.etags.update(other.etags)
+
+    @staticmethod
+    def _operation_id(resp_json):
+        return (resp_json.get('metadata', None) or {}).get(
+            'id', resp_json['operation'].partition('?')[0].rsplit('/', 1)[-1])
+
+    @staticmethod
+    def not_modified(resp_json):
+        return resp_json.get('status_code', None) == NOT_MODIFIED['status_code']
+
+    def _request(self, method, url, body, headers):
+        """Send one request over the kept-alive connection.
+
+        :returns: Response, raw body and whether the connection was reused.
+        :rtype: ``tuple``
+        """
+        reused = self.connection.sock is not None
+        try:
+            self.connection.request(method, url, body=body, headers=headers)
+            if not reused:
+                self.connections_count += 1
+            resp = self.connection.getresponse()
+            data = resp.read()
+        except (HTTPException, socket.error):
+            self.connection.close()
+            if not reused or method not in IDEMPOTENT_METHODS:
+                raise
+            # The server closed the idle connection, open a new one
+            self.connection.request(method, url, body=body, headers=headers)
+            self.connections_count += 1
+            resp = self.connection.getresponse()
+            data = resp.read()
+            reused = False
+        if isinstance(self.connection, TLSSessionHTTPSConnection):
+            self.connection.remember_session()
+        return resp, data, reused
+
+    def _send_request(self, method, url, body_json=None, ok_error_codes=None, timeout=None,
+                      etag=None, known_etag=None, limited=True):
+        """Send a request, authenticating again if the server refused it.
+
+        After authenticate, a request refused with HTTP 403, or GET /1.0
+        reporting the client as untrusted, is sent once more after the
+        certificate was authenticated again.
+
+        :param limited: Whether the request counts against the limiter.
+            Waits for operations do not, as they only hold a connection.
+        :type limited: ``bool``
+        """
+        kwargs = dict(
+            body_json=body_json, ok_error_codes=ok_error_codes,
+            etag=etag, known_etag=known_etag, limited=limited
+        )
+        try:
+            resp_json = self._send_retried(method, url, **kwargs)
+            if not self._untrusted(method, url, resp_json):
+                return resp_json
+        except LXDUntrustedException:
+            if self.trust is None:
+                raise
+        self._authenticate_again()
+        return self._send_retried(method, url, **kwargs)
+
+    def _send_retried(self, method, url, body_json=None, ok_error_codes=None,
+                      etag=None, known_etag=None, limited=True):
+        """Send a request, retrying it while the server is busy.
+
+        Transient errors are retried with exponential backoff and random
+        jitter until retry_timeout has passed since the first attempt.
+        """
+        deadline = time.time() + self.retry_timeout
+        attempt = 0
+        while True:
+            try:
+                return self._send_once(
+                    method, url, body_json=body_json, ok_error_codes=ok_error_codes,
+                    etag=etag, known_etag=known_etag, limited=limited
+                )
+            except LXDTransientException as e:
+                delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+                if time.time() + delay > deadline:
+                    if attempt > 0:
+                        e.msg = '{0} (retried {1} times)'.format(e.msg, attempt)
+                    raise
+                self.timings.record_retry(delay)
+                time.sleep(delay)
+                attempt += 1
+
+    def _send_once(self, method, url, body_json=None, ok_error_codes=None,
+                   etag=None, known_etag=None, limited=True):
+        headers = {'Connection': 'keep-alive'}
+        body = None
+        if body_json is not None:
+            body = json.dumps(body_json)
+            headers['Content-Type'] = 'application/json'
+        if etag is not None and method in ('PUT', 'PATCH'):
+            headers['If-Match'] = etag
+        try:
+            if limited:
+                self.limiter.semaphore.acquire()
+            try:
+                started = time.time()
+                resp, resp_data, reused = self._request(method, url, body, headers)
+                elapsed = time.time() - started
+            finally:
+                if limited:
+                    self.limiter.semaphore.release()
+            self.requests_count += 1
+            self.timings.record(
+                method, url, resp.status, elapsed, len(body or ''), len(resp_data)
+            )
+            resp_etag = resp.getheader('ETag', None)
+            if method == 'GET' and resp_etag is not None:
+                self.etags[url] = resp_etag
+            if url == '/1.0' and method != 'GET':
+                self.server_json = None
+            if known_etag is not None and resp_etag == known_etag:
+                resp_json = NOT_MODIFIED.copy()
+            else:
+                try:
+                    resp_json = json.loads(to_text(resp_data, errors='surrogate_or_strict'))
+                except ValueError:
+                    if resp.status in TRANSIENT_STATUS_CODES:
+                        # A proxy in front of the server answered
+                        self._raise_err('the LXD server is unavailable: HTTP {0}'.format(resp.status),
+                                        transient=True)
+                    raise
+            if self.log is not None:
+                logged_body = body
+                if body_json is not None and 'password' in body_json:
+                    # The log file is not masked by Ansible like module results
+                    logged_body = json.dumps(dict(body_json, password='********'))
+                self.log.record({
+                    'method': method,
+                    'url': url,
+                    'status': resp.status,
+                    'etag': resp_etag,
+                    'bytes_sent': len(body or ''),
+                    'bytes_received': len(resp_data),
+                    'connection': 'reused' if reused else 'new',
+                    'elapsed': round(elapsed, 6),
+                    'request': self.log.body(logged_body),
+                    'response': self.log.body(resp_data)
+                })
+            resp_type = resp_json.get('type', None)
+            if resp_type == 'error':
+                if ok_error_codes is not None and resp_json['error_code'] in ok_error_codes:
+                    return resp_json
+                if resp_json['error'] == 'Certificate already in trust store':
+                    return resp_json
+                if resp_json.get('error_code', None) == 412:
+                    resp_json = dict(resp_json, error='{0} is changed concurrently: {1}'.format(
+                        url, resp_json['error']))
+                if resp_json.get('error_code', None) == 403:
+                    self._raise_err_from_json(resp_json, untrusted=True)
+                self._raise_err_from_json(resp_json, transient=self.is_transient(resp_json))
+            if method == 'GET' and url == '/1.0' and not self.not_modified(resp_json) and \
+                    (resp_json.get('metadata', None) or {}).get('auth', None) == 'trusted':
+                # An untrusted client is only told part of the server
+                self.server_json = resp_json
+            return resp_json
+        except (HTTPException, socket.error) as e:
+            # A request which may have reached the server is only sent
+            # again if sending it twice does no harm
+            if method in IDEMPOTENT_METHODS or getattr(e, 'errno', None) in TRANSIENT_ERRNOS:
+                raise LXDTransientException('cannot connect to the LXD server', err=e)
+            raise LXDClientException('cannot connect to the LXD server', err=e)
+        except ValueError as e:
+            raise LXDClientException('cannot decode the LXD server response', err=e)
+
+    @staticmethod
+    def is_transient(resp_json):
+        """Return whether an error response may not be returned again.
+
+        The server refuses a request with such errors before changing
+        anything, so any request may be sent again.
+
+        :param resp_json: The error response.
+        :type resp_json: ``dict``
+        :rtype: ``bool``
+        """
+        if resp_json.get('error_code', None) in TRANSIENT_STATUS_CODES:
+            return True
+        return TRANSIENT_ERRORS.search(resp_json.get('error', None) or '') is not None
+
+    def _raise_err_from_json(self, resp_json, transient=False, untrusted=False):
+        self._raise_err(self._get_err_from_resp_json(resp_json), transient=transient, untrusted=untrusted)
+
+    def _raise_err(self, msg, transient=False, untrusted=False):
+        err_params = {}
+        if self.debug:
+            err_params['logs'] = self.logs
+        if transient:
+            raise LXDTransientException(msg, **err_params)
+        if untrusted:
+            raise LXDUntrustedException(msg, **err_params)
+        raise LXDClientException(msg, **err_params)
+
+    @staticmethod
+    def _get_err_from_resp_json(resp_json):
+        err = None
+        metadata = resp_json.get('metadata', None)
+        if metadata is not None:
+            err = metadata.get('err', None)
+        if err is None:
+            err = resp_json.get('error', None)
+        return err
+
+
+def run_concurrently(client, calls, max_parallel):
+    """Run calls over up to max_parallel connections to the LXD server.
+
+    The first call runs on client, the other connections are its clones.
+    Logs and counters of the clones are merged back into client.
+
+    :param client: Connected client.
+    :type client: ``LXDClient``
+    :param calls: Callables which take a client.
+    :type calls: ``list``
+    :param max_parallel: Maximum number of concurrent requests.
+    :type max_parallel: ``int``
+    :returns: A (result, LXDClientException or None) pair per call, in order.
+    :rtype: ``list``
+    """
+    results = [None] * len(calls)
+    pending = list(enumerate(calls))
+    lock = threading.Lock()
+    clients = [client]
+    for dummy in range(min(max_parallel, len(calls)) - 1):
+        clients.append(client.clone())
+
+    def worker(worker_client):
+        while True:
+            with lock:
+                if not pending:
+                    return
+                index, call = pending.pop(0)
+            try:
+                results[index] = (call(worker_client), None)
+            except LXDClientException as e:
+                results[index] = (None, e)
+
+    threads = [threading.Thread(target=worker, args=(c,)) for c in clients[1:]]
+    for thread in threads:
+        thread.start()
+    worker(client)
+    for thread in threads:
+        thread.join()
+    for worker_client in clients[1:]:
+        client.merge(worker_client)
+        worker_client.close()
+    return results
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2024, Mikhail Shurutov <shurutov@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+
+from ansible.module_utils.lxd_timings import TIMINGS_FORMATS
+
+# LXD_COMMON_ARGS is the argument spec of the connection, logging and
+# retry options every LXD module of the role has, documented by the
+# lxd_common doc fragment.
+LXD_COMMON_ARGS = dict(
+    auth_cache=dict(
+        type='path',
+        default='{}/.config/lxc/auth_cache.json'.format(os.environ['HOME'])
+    ),
+    client_cert=dict(
+        type='str',
+        default='{}/.config/lxc/client.crt'.format(os.environ['HOME']),
+        aliases=['cert_file']
+    ),
+    client_key=dict(
+        type='str',
+        default='{}/.config/lxc/client.key'.format(os.environ['HOME']),
+        aliases=['key_file']
+    ),
+    log_max_body=dict(
+        type='int',
+        default=4096
+    ),
+    log_max_entries=dict(
+        type='int',
+        default=100
+    ),
+    log_path=dict(
+        type='path',
+    ),
+    max_requests=dict(
+        type='int',
+        default=8
+    ),
+    retry_timeout=dict(
+        type='int',
+        default=30
+    ),
+    trust_password=dict(
+        type='str',
+        no_log=True
+    ),
+    url=dict(
+        type='str',
+        default='unix:/var/lib/lxd/unix.socket'
+    )
+)
+
+# LXD_TIMINGS_ARGS is the argument spec of the timing options of the
+# modules reporting timings, documented by lxd_common.timings.
+LXD_TIMINGS_ARGS = dict(
+    timings=dict(
+        type='bool',
+        default=False
+    ),
+    timings_format=dict(
+        choices=TIMINGS_FORMATS,
+        default='json'
+    ),
+    timings_path=dict(
+        type='path',
+    )
+)
+
+# LXD_WORKER_ARGS is the argument spec of the options of the modules
+# which may run in a worker, documented by lxd_common.worker.
+LXD_WORKER_ARGS = dict(
+    worker_idle_timeout=dict(
+        type='int',
+        default=600
+    ),
+    worker_socket=dict(
+        type='path',
+    )
+)
+
+# LXD_SCHEMA_ARGS is the argument spec of the options of the modules
+# validating config keys, documented by lxd_common.schema_cache.
+LXD_SCHEMA_ARGS = dict(
+    schema_cache=dict(
+        type='path',
+        default='{}/.config/lxc/schema_cache.json'.format(os.environ['HOME'])
+    )
+)
+
+# ITEM_CONNECTION_OPTIONS is the argument spec of the per-item connection
+# keys the role passed to the community.general modules it looped over.
+# Items still accept them, but every item of a module run is managed
+# through the connection of the module.
+ITEM_CONNECTION_OPTIONS = dict(
+    client_cert=dict(
+        type='str',
+    ),
+    client_key=dict(
+        type='str',
+    ),
+    snap_url=dict(
+        type='str',
+    ),
+    trust_password=dict(
+        type='str',
+        no_log=True
+    ),
+    url=dict(
+        type='str',
+    ),
+)
+
+
+def lxd_argument_spec(*groups):
+    """Return the argument spec of the options shared by LXD modules.
+
+    :param groups: Option groups the module has besides LXD_COMMON_ARGS,
+        like LXD_TIMINGS_ARGS.
+    :type groups: ``dict``
+    :rtype: ``dict``
+    """
+    argument_spec = dict(LXD_COMMON_ARGS)
+    for group in groups:
+        argument_spec.update(group)
+    return argument_spec
+
+
+def item_options(options):
+    """Return the argument spec of an item accepting the connection keys.
+
+    :param options: Argument spec of the keys the item is converged by.
+    :type options: ``dict``
+    :rtype: ``dict``
+    """
+    return dict(ITEM_CONNECTION_OPTIONS, **options)
+
+
+def warn_item_connection(module, kind, items):
+    """Warn about the per-item connection keys which are ignored.
+
+    Keys equal to the module option of the same name change nothing, so
+    only the other ones are reported, once per key.
+
+    :param module: Processed Ansible Module.
+    :type module: ``object``
+    :param kind: The module option listing the items.
+    :type kind: ``str``
+    :param items: The items.
+    :type items: ``list``
+    """
+    for key in sorted(ITEM_CONNECTION_OPTIONS):
+        ignored = [
+            item['name'] for item in items or []
+            if item.get(key, None) is not None and item[key] != module.params.get(key, None)
+        ]
+        if ignored:
+            module.warn('{0}[].{1} of {2} is ignored, every item is managed through the {3} option'.format(
+                kind, key, ', '.join(ignored), 'url' if key == 'snap_url' else key))
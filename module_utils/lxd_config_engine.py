@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2024, Mikhail Shurutov <shurutov@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+from ansible.module_utils.lxd_cache import LXDStateCache, state_digest
+from ansible.module_utils.lxd_client import (
+    NOT_MODIFIED, LXDClient, LXDClientException, request_limiter, request_log
+)
+from ansible.module_utils.lxd_diff import (
+    build_patch, build_put, diff_object, diff_to_result
+)
+from ansible.module_utils.lxd_schema import check_configs
+from ansible.module_utils.lxd_timings import report_timings
+
+# CONFIG_PARAMS is a list of config attribute names.
+CONFIG_PARAMS = [
+    'config'
+]
+
+# CONFIG_DEFAULTS is the default config deployed.
+CONFIG_DEFAULTS = {}
+
+
+class LXDConfig(object):
+    def __init__(self, module, client=None):
+        """Management of LXC containers via Ansible.
+
+        :param module: Processed Ansible Module.
+        :type module: ``object``
+        :param client: LXD client shared with other reconcilers, a new one
+            is connected if it is not given.
+        :type client: ``LXDClient``
+        """
+        self.module = module
+        self.cert_file = self.module.params.get('client_cert', None)
+        self.key_file = self.module.params.get('client_key', None)
+        self._build_config()
+        self.trust_password = self.module.params.get('trust_password', None)
+        self.update_mode = self.module.params['update_mode']
+        self.url = self.module.params['url']
+        self.debug = self.module._verbosity >= 4
+        self.client = client
+        if self.client is None:
+            try:
+                self.client = LXDClient(
+                    self.url, key_file=self.key_file, cert_file=self.cert_file,
+                    debug=self.debug, log=request_log(self.module.params, self.debug),
+                    limiter=request_limiter(self.module.params),
+                    retry_timeout=self.module.params.get('retry_timeout', None)
+                )
+            except LXDClientException as e:
+                self.module.fail_json(msg=e.msg)
+        self.cache = None
+        if self.module.params.get('state_cache', None) is not None:
+            self.cache = LXDStateCache(self.module.params['state_cache'])
+        self.actions = []
+        self.diff = {}
+
+    def _build_config(self):
+        self.config = {}
+        for attr in CONFIG_PARAMS:
+            param_val = self.module.params.get(attr, None)
+            if attr == 'config':
+                param_val = dict(CONFIG_DEFAULTS, **(param_val or {}))
+            if param_val is not None:
+                self.config[attr] = param_val
+
+    def _config_digest(self):
+        return state_digest(self.config, self.update_mode)
+
+    def _get_config_json(self):
+        known_etag = None
+        if self.cache is not None:
+            known_etag = self.cache.etag(self.url + '/1.0', self._config_digest())
+        if self.client.server_json is not None:
+            # Authenticating or loading the schema read the server already
+            if known_etag is not None and self.client.etags.get('/1.0', None) == known_etag:
+                return NOT_MODIFIED.copy()
+            return self.client.server_json
+        return self.client.do(
+            'GET', '/1.0'.format(self),
+            ok_error_codes=[404], known_etag=known_etag
+        )
+
+    def _update_config(self):
+        if self._needs_to_apply_config_configs():
+            self._apply_config_configs()
+
+    def _needs_to_apply_config_configs(self):
+        if self.client.not_modified(self.old_config_json):
+            self.diff = {}
+            return False
+        self.diff = diff_object(
+            self.old_config_json['metadata'], self.config,
+            CONFIG_PARAMS, self.update_mode
+        )
+        return len(self.diff) > 0
+
+    def _apply_config_configs(self):
+        if self.update_mode == 'patch':
+            config = build_patch(self.diff)
+        else:
+            config = build_put(
+                self.old_config_json['metadata'], self.config, CONFIG_PARAMS
+            )
+        if not self.module.check_mode:
+            with self.client.timings.phase('write'):
+                self.client.do(
+                    self.update_mode.upper(), '/1.0', config,
+                    etag=self.client.etags.get('/1.0', None)
+                )
+        self.actions.append('apply_config_configs')
+
+    def _update_cache(self):
+        etag = self.client.etags.get('/1.0', None)
+        if not self.actions and etag is not None:
+            self.cache.store(self.url + '/1.0', etag, self._config_digest())
+        else:
+            self.cache.forget(self.url + '/1.0')
+        self.cache.save()
+
+    def schema_items(self):
+        """Return the configs checked against the schema of the server.
+
+        :returns: List of (label, entity, config) tuples.
+        :rtype: ``list``
+        """
+        return [('config', 'server', self.config.get('config', {}))]
+
+    def reconcile(self):
+        """Reconcile the server config.
+
+        :returns: The module result without logs.
+        :rtype: ``dict``
+        """
+        timings = self.client.timings
+        if self.trust_password is not None:
+            with timings.phase('authenticate'):
+                self.client.authenticate(
+                    self.trust_password, self.module.params.get('auth_cache', None)
+                )
+        if self.module.params.get('validate_config', False):
+            check_configs(self.client, self.module.params, self.schema_items())
+
+        with timings.phase('read'):
+            self.old_config_json = self._get_config_json()
+
+        with timings.phase('diff'):
+            self._update_config()
+        if self.cache is not None and not self.module.check_mode:
+            with timings.phase('cache'):
+                self._update_cache()
+
+        return {
+            'changed': len(self.actions) > 0,
+            'actions': self.actions,
+            'diff': diff_to_result(self.diff)
+        }
+
+    def fail_params(self, e):
+        """Return the module failure result of an exception without logs."""
+        return {
+            'msg': e.msg,
+            'changed': len(self.actions) > 0,
+            'actions': self.actions
+        }
+
+    def run(self):
+        """Run the main method."""
+
+        try:
+            result_json = self.reconcile()
+            report_timings(self.module, self.client, result_json)
+            if self.client.debug:
+                result_json['logs'] = self.client.logs
+            self.module.exit_json(**result_json)
+        except LXDClientException as e:
+            fail_params = self.fail_params(e)
+            report_timings(self.module, self.client, fail_params)
+            if self.client.debug:
+                fail_params['logs'] = e.kwargs['logs']
+            self.module.fail_json(**fail_params)
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2024, Mikhail Shurutov <shurutov@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+from ansible.module_utils.lxd_client import LXDClient, LXDClientException, request_limiter, request_log
+from ansible.module_utils.lxd_common import warn_item_connection
+from ansible.module_utils.lxd_config_engine import LXDConfig
+from ansible.module_utils.lxd_network_engine import LXDNetworkManagement
+from ansible.module_utils.lxd_profile_engine import LXDProfileManagement, LXDProjectManagement
+from ansible.module_utils.lxd_storage_engine import LXDStorageManagement
+from ansible.module_utils.lxd_schema import check_configs
+from ansible.module_utils.lxd_timings import report_timings
+
+# CONVERGE_KINDS is a list of (kind, reconciler class) pairs in the order
+# they are converged.
+CONVERGE_KINDS = [
+    ('config', LXDConfig),
+    ('pools', LXDStorageManagement),
+    ('networks', LXDNetworkManagement),
+    ('projects', LXDProjectManagement),
+    ('profiles', LXDProfileManagement)
+]
+
+
+class LXDKindModule(object):
+    def __init__(self, module, params):
+        """Ansible module as seen by the reconciler of one kind of objects.
+
+        :param module: Processed Ansible Module.
+        :type module: ``object``
+        :param params: Parameters of the module converging the kind.
+        :type params: ``dict``
+        """
+        self.module = module
+        self.params = params
+        self.check_mode = module.check_mode
+        self._verbosity = module._verbosity
+
+    def fail_json(self, **kwargs):
+        self.module.fail_json(**kwargs)
+
+
+class LXDConverge(object):
+    def __init__(self, module, client=None):
+        """Convergence of a LXD server via Ansible.
+
+        :param module: Processed Ansible Module.
+        :type module: ``object``
+        :param client: LXD client kept by the worker, a new one is
+            connected if it is not given.
+        :type client: ``LXDClient``
+        """
+        self.module = module
+        self.cert_file = self.module.params.get('client_cert', None)
+        self.key_file = self.module.params.get('client_key', None)
+        self.trust_password = self.module.params.get('trust_password', None)
+        self.url = self.module.params['url']
+        self.debug = self.module._verbosity >= 4
+        self.client = client
+        if self.client is None:
+            try:
+                self.client = LXDClient(
+                    self.url, key_file=self.key_file, cert_file=self.cert_file,
+                    debug=self.debug, log=request_log(self.module.params, self.debug),
+                    limiter=request_limiter(self.module.params),
+                    retry_timeout=self.module.params.get('retry_timeout', None)
+                )
+            except LXDClientException as e:
+                self.module.fail_json(msg=e.msg)
+        self.converged = {}
+        self.diffs = []
+        self.kind_diffs = {}
+        # Kind being reconciled, failures are prefixed with it
+        self.kind = None
+
+    def _kind_params(self, kind):
+        params = self.module.params
+        kind_params = {
+            'client_cert': self.cert_file,
+            'client_key': self.key_file,
+            'config': None,
+            'description': None,
+            'schema_cache': params['schema_cache'],
+            'state': 'present',
+            'state_cache': params['state_cache'],
+            'trust_password': None,
+            'update_mode': params['update_mode'],
+            'url': self.url,
+            # All kinds are validated at once by the converge
+            'validate_config': False
+        }
+        if kind == 'config':
+            kind_params['config'] = params['config']
+        elif kind == 'pools':
+            kind_params.update(
+                driver=None, max_parallel=params['max_parallel'], name=None,
+                pools=params['pools'], wait_timeout=params['wait_timeout']
+            )
+        elif kind == 'networks':
+            kind_params.update(
+                name=None, networks=params['networks'], new_name=None,
+                rename=params['rename'], type=None,
+                wait_timeout=params['wait_timeout']
+            )
+        elif kind == 'projects':
+            kind_params.update(
+                merge_project=params['merge_project'], projects=params['projects']
+            )
+        else:
+            kind_params.update(
+                merge_profile=params['merge_profile'], profiles=params['profiles']
+            )
+        return kind_params
+
+    def _state_changed(self):
+        return any(result['changed'] for result in self.converged.values())
+
+    def reconcile(self):
+        """Converge the given kinds of objects, one after the other.
+
+        In check mode nothing is written, so the result is the plan of a
+        converge, lxd_state reports it as drift.
+
+        :returns: The module result without logs.
+        :rtype: ``dict``
+        """
+        if self.trust_password is not None:
+            with self.client.timings.phase('authenticate'):
+                self.client.authenticate(
+                    self.trust_password, self.module.params.get('auth_cache', None)
+                )
+
+        reconcilers = [
+            (kind, reconciler_class(
+                LXDKindModule(self.module, self._kind_params(kind)),
+                client=self.client
+            ))
+            for kind, reconciler_class in CONVERGE_KINDS
+            if self.module.params[kind] is not None
+        ]
+        if self.module.params['validate_config']:
+            items = []
+            for kind, reconciler in reconcilers:
+                items.extend(reconciler.schema_items())
+            check_configs(self.client, self.module.params, items)
+
+        for kind, reconciler in reconcilers:
+            self.kind = kind
+            try:
+                result = reconciler.reconcile()
+            except LXDClientException as e:
+                self.converged[kind] = reconciler.fail_params(e)
+                raise
+            diff = result.pop('diff')
+            if kind == 'config':
+                # The server config has one diff without a header
+                diff = [dict(diff, before_header=kind, after_header=kind)]
+            self.kind_diffs[kind] = [d for d in diff if d['before'] or d['after']]
+            self.diffs.extend(self.kind_diffs[kind])
+            self.converged[kind] = result
+        self.kind = None
+
+        return {
+            'changed': self._state_changed(),
+            'converged': self.converged,
+            'diff': self.diffs
+        }
+
+    def fail_params(self, e):
+        """Return the module failure result of an exception without logs."""
+        msg = e.msg
+        if self.kind is not None:
+            msg = '{0}: {1}'.format(self.kind, e.msg)
+        return {
+            'msg': msg,
+            'changed': self._state_changed(),
+            'converged': self.converged
+        }
+
+    def run(self):
+        """Run the main method."""
+
+        for kind, reconciler_class in CONVERGE_KINDS:
+            if kind != 'config':
+                warn_item_connection(self.module, kind, self.module.params[kind])
+        try:
+            result_json = self.reconcile()
+            report_timings(self.module, self.client, result_json)
+            if self.client.debug:
+                result_json['logs'] = self.client.logs
+            self.module.exit_json(**result_json)
+        except LXDClientException as e:
+            fail_params = self.fail_params(e)
+            report_timings(self.module, self.client, fail_params)
+            if self.client.debug:
+                fail_params['logs'] = e.kwargs.get('logs', self.client.logs)
+            self.module.fail_json(**fail_params)
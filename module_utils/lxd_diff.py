@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2024, Mikhail Shurutov <shurutov@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import fnmatch
+import ipaddress
+import re
+
+from ansible.module_utils.common.text.converters import to_text
+from ansible.module_utils.six import string_types
+
+# UPDATE_MODES is a list of supported ways to update an existing object.
+# patch sends only the changed keys, put sends the whole writable object
+# and so removes config keys which are not listed.
+UPDATE_MODES = [
+    'patch', 'put'
+]
+
+# SERVER_MANAGED_KEYS is a list of patterns of config keys LXD sets
+# itself. They are not compared unless listed and put keeps them.
+SERVER_MANAGED_KEYS = [
+    'volatile.*'
+]
+
+# POOL_SERVER_KEYS is a list of patterns of storage pool config keys the
+# storage driver generates when they are not given.
+POOL_SERVER_KEYS = SERVER_MANAGED_KEYS + [
+    'lvm.thinpool_name', 'lvm.vg_name', 'size', 'source', 'zfs.pool_name'
+]
+
+# BOOLEAN_VALUES maps the spellings of booleans LXD accepts to the
+# canonical ones.
+BOOLEAN_VALUES = {
+    'true': 'true', 'yes': 'true', 'on': 'true',
+    'false': 'false', 'no': 'false', 'off': 'false'
+}
+
+# SIZE_UNITS maps the units of LXD sizes to bytes.
+SIZE_UNITS = {
+    'B': 1,
+    'kB': 10 ** 3, 'KB': 10 ** 3, 'MB': 10 ** 6, 'GB': 10 ** 9,
+    'TB': 10 ** 12, 'PB': 10 ** 15, 'EB': 10 ** 18,
+    'KiB': 2 ** 10, 'MiB': 2 ** 20, 'GiB': 2 ** 30,
+    'TiB': 2 ** 40, 'PiB': 2 ** 50, 'EiB': 2 ** 60
+}
+
+# SIZE_RE matches a size with a unit, like 10GiB or 1.5 GB
+SIZE_RE = re.compile(r'^(\d+(?:\.\d+)?)\s*([kKMGTPE]i?B|B)$')
+
+
+def stringify(value):
+    """Return a desired value as LXD stores it.
+
+    LXD keeps config values as strings, so booleans and numbers given in
+    YAML are converted, in dicts such as devices too.
+
+    :rtype: ``str`` or ``dict``
+    """
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float)):
+        return to_text(value)
+    if isinstance(value, dict):
+        return dict((k, stringify(v)) for k, v in value.items())
+    return value
+
+
+def _canonical_scalar(text):
+    text = text.strip()
+    if text.lower() in BOOLEAN_VALUES:
+        return BOOLEAN_VALUES[text.lower()]
+    m = SIZE_RE.match(text)
+    if m and m.group(2) in SIZE_UNITS:
+        return to_text(int(float(m.group(1)) * SIZE_UNITS[m.group(2)]))
+    try:
+        if '/' in text:
+            return to_text(ipaddress.ip_interface(text))
+        return to_text(ipaddress.ip_address(text))
+    except ValueError:
+        return text
+
+
+def canonical_value(value):
+    """Return the canonical form of a value for comparison.
+
+    Booleans are spelled true or false, sizes are given in bytes and IP
+    addresses and networks are compressed, items of comma separated lists
+    too.
+
+    :rtype: ``str``, ``dict`` or ``list``
+    """
+    value = stringify(value)
+    if isinstance(value, dict):
+        return dict((k, canonical_value(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return [canonical_value(v) for v in value]
+    if not isinstance(value, string_types):
+        return value
+    return ','.join(_canonical_scalar(part) for part in value.split(','))
+
+
+def values_equal(key, before, after):
+    """Return whether a stored value equals a desired one.
+
+    An address set to auto is generated by LXD, so any address of the key
+    equals it.
+
+    :param key: The config key, a device name or a field.
+    :type key: ``str``
+    :rtype: ``bool``
+    """
+    if after == 'auto' and key.endswith('.address') and before not in (None, '', 'none'):
+        return True
+    return canonical_value(before) == canonical_value(after)
+
+
+def server_managed(key, server_keys):
+    """Return whether a config key is set by LXD itself.
+
+    :rtype: ``bool``
+    """
+    return any(fnmatch.fnmatchcase(key, pattern) for pattern in server_keys)
+
+
+def diff_object(old, desired, keys, mode='patch', server_keys=None):
+    """Compute key-level differences between an LXD object and its desired state.
+
+    Values are compared in canonical form, so only the keys listed in the
+    desired state and changed for LXD are reported.
+
+    :param old: Metadata of the object as returned by LXD.
+    :type old: ``dict``
+    :param desired: Desired values keyed by object field.
+    :type desired: ``dict``
+    :param keys: Fields of the object which are compared.
+    :type keys: ``list``
+    :param mode: One of UPDATE_MODES.
+    :type mode: ``str``
+    :param server_keys: Patterns of keys set by LXD, SERVER_MANAGED_KEYS
+        by default. They are not removed by put.
+    :type server_keys: ``list``
+    :returns: Changes keyed by field. Plain fields map to their before and
+        after values, dict fields are compared per key and map to
+        ``{'changes': {key: {'before': ..., 'after': ...}}}``.
+    :rtype: ``dict``
+    """
+    if server_keys is None:
+        server_keys = SERVER_MANAGED_KEYS
+    diff = {}
+    for key in keys:
+        if key not in desired:
+            continue
+        before = old.get(key, None)
+        after = stringify(desired[key])
+        if isinstance(after, dict):
+            before = before or {}
+            changes = {}
+            for k, v in after.items():
+                if not values_equal(k, before.get(k, None), v):
+                    changes[k] = {'before': before.get(k, None), 'after': v}
+            if mode == 'put':
+                for k, v in before.items():
+                    if k not in after and not server_managed(k, server_keys):
+                        changes[k] = {'before': v, 'after': None}
+            if changes:
+                diff[key] = {'changes': changes}
+        elif not values_equal(key, before, after):
+            diff[key] = {'before': before, 'after': after}
+    return diff
+
+
+def diff_absent(old, keys):
+    """Compute the changes of deleting an LXD object.
+
+    :param old: Metadata of the object as returned by LXD.
+    :type old: ``dict``
+    :param keys: Fields of the object which are compared.
+    :type keys: ``list``
+    :returns: Changes in the form returned by diff_object.
+    :rtype: ``dict``
+    """
+    diff = {}
+    for key in keys:
+        before = old.get(key, None)
+        if isinstance(before, dict):
+            if before:
+                diff[key] = {'changes': dict(
+                    (k, {'before': v, 'after': None}) for k, v in before.items()
+                )}
+        elif before is not None:
+            diff[key] = {'before': before, 'after': None}
+    return diff
+
+
+def build_patch(diff):
+    """Build a PATCH request body carrying only the changed keys.
+
+    :param diff: Changes returned by diff_object.
+    :type diff: ``dict``
+    :rtype: ``dict``
+    """
+    body = {}
+    for key, change in diff.items():
+        if 'changes' in change:
+            body[key] = dict((k, c['after']) for k, c in change['changes'].items())
+        else:
+            body[key] = change['after']
+    return body
+
+
+def build_put(old, desired, keys, server_keys=None):
+    """Build a PUT request body from the writable fields of an object.
+
+    Keys set by LXD itself are carried over from the object.
+
+    :param old: Metadata of the object as returned by LXD.
+    :type old: ``dict``
+    :param desired: Desired values keyed by object field.
+    :type desired: ``dict``
+    :param keys: Writable fields of the object.
+    :type keys: ``list``
+    :param server_keys: Patterns of keys set by LXD, SERVER_MANAGED_KEYS
+        by default.
+    :type server_keys: ``list``
+    :rtype: ``dict``
+    """
+    if server_keys is None:
+        server_keys = SERVER_MANAGED_KEYS
+    body = {}
+    for key in keys:
+        if key in desired:
+            body[key] = stringify(desired[key])
+            if isinstance(body[key], dict) and isinstance(old.get(key, None), dict):
+                kept = dict(
+                    (k, v) for k, v in old[key].items()
+                    if k not in body[key] and server_managed(k, server_keys)
+                )
+                body[key] = dict(kept, **body[key])
+        elif key in old:
+            body[key] = old[key]
+    return body
+
+
+def changed_keys(diff):
+    """List the changed keys in dotted form, like ``config.ipv4.address``.
+
+    :param diff: Changes returned by diff_object.
+    :type diff: ``dict``
+    :rtype: ``list``
+    """
+    keys = []
+    for key, change in diff.items():
+        if 'changes' in change:
+            keys.extend('{0}.{1}'.format(key, k) for k in change['changes'])
+        else:
+            keys.append(key)
+    return sorted(keys)
+
+
+def result_keys(result):
+    """List the changed keys of a result in dotted form.
+
+    :param result: Result returned by diff_to_result.
+    :type result: ``dict``
+    :rtype: ``list``
+    """
+    keys = set()
+    for side in ('before', 'after'):
+        for key, value in result[side].items():
+            if isinstance(value, dict):
+                keys.update('{0}.{1}'.format(key, k) for k in value)
+            else:
+                keys.add(key)
+    return sorted(keys)
+
+
+def merge_results(results):
+    """Merge before/after results of one object into a single result.
+
+    :param results: Results returned by diff_to_result.
+    :type results: ``list``
+    :rtype: ``dict``
+    """
+    merged = diff_to_result({})
+    for result in results:
+        merged['before'].update(result['before'])
+        merged['after'].update(result['after'])
+    return merged
+
+
+def diff_to_result(diff, header=None):
+    """Convert changes to the before/after form used by ``--diff``.
+
+    :param diff: Changes returned by diff_object.
+    :type diff: ``dict``
+    :param header: Name of the object shown in the diff headers.
+    :type header: ``str``
+    :rtype: ``dict``
+    """
+    result = {'before': {}, 'after': {}}
+    for key, change in diff.items():
+        if 'changes' in change:
+            result['before'][key] = dict((k, c['before']) for k, c in change['changes'].items())
+            result['after'][key] = dict((k, c['after']) for k, c in change['changes'].items())
+        else:
+            result['before'][key] = change['before']
+            result['after'][key] = change['after']
+    if header is not None:
+        result['before_header'] = header
+        result['after_header'] = header
+    return result
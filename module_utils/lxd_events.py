@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2024, Mikhail Shurutov <shurutov@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import base64
+import collections
+import hashlib
+import json
+import os
+import socket
+import struct
+import threading
+import time
+
+from ansible.module_utils.common.text.converters import to_bytes, to_text
+from ansible.module_utils.lxd_client import LXDClientException
+from ansible.module_utils.six.moves.urllib.parse import urlencode
+
+# EVENT_TYPES is a list of the event types the listener subscribes to.
+EVENT_TYPES = [
+    'operation', 'lifecycle'
+]
+
+# INSTANCE_STOPPED_ACTIONS is a list of lifecycle actions after which an
+# instance does not get addresses any more.
+INSTANCE_STOPPED_ACTIONS = [
+    'instance-deleted', 'instance-shutdown', 'instance-stopped'
+]
+
+# OPERATION_DONE_CODE is the lowest status code of a finished operation.
+OPERATION_DONE_CODE = 200
+
+# OPERATION_KEEP_TIMEOUT is the number of seconds a finished operation no
+# wait expects is kept. Its event may arrive before the response which
+# started it, operations kept longer belong to other clients.
+OPERATION_KEEP_TIMEOUT = 30
+
+# WEBSOCKET_GUID is hashed with the handshake key by the server, see
+# RFC 6455.
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+# WEBSOCKET_* are the opcodes of websocket frames.
+WEBSOCKET_CONTINUATION = 0x0
+WEBSOCKET_TEXT = 0x1
+WEBSOCKET_CLOSE = 0x8
+WEBSOCKET_PING = 0x9
+WEBSOCKET_PONG = 0xA
+
+
+class LXDEventListener(object):
+    def __init__(self, client):
+        """One subscription to /1.0/events shared by all waits of a module run.
+
+        The stream is read in the background. Finished operations which
+        are expected, see expect, and the last lifecycle action of every
+        object are kept until they are asked for, so a wait never misses
+        an event which arrived before it started. Other operations are
+        only kept for OPERATION_KEEP_TIMEOUT.
+
+        :param client: Connected client, the stream uses a connection of
+            its own to the same server.
+        :type client: ``LXDClient``
+        """
+        self.client = client
+        self.events_client = client.clone()
+        self.sock = None
+        self.stream = None
+        self.connected = False
+        self.cond = threading.Condition()
+        self.send_lock = threading.Lock()
+        self.expected = set()
+        self.operations = {}
+        # Finished operations not expected yet, with the time they finished
+        self.unexpected = collections.OrderedDict()
+        self.lifecycle = {}
+        self.thread = None
+
+    def start(self):
+        """Open the event stream.
+
+        Operations started before are not seen, so the listener must be
+        started before the requests waited for are sent.
+
+        :raises LXDClientException: If the server does not stream events.
+        """
+        url = '/1.0/events?{0}'.format(urlencode([
+            ('type', ','.join(EVENT_TYPES)), ('all-projects', 'true')
+        ]))
+        key = to_text(base64.b64encode(os.urandom(16)))
+        connection = self.events_client.connection
+        started = time.time()
+        try:
+            connection.connect()
+            self.sock = connection.sock
+            self.sock.sendall(to_bytes(
+                'GET {0} HTTP/1.1\r\n'
+                'Host: {1}\r\n'
+                'Upgrade: websocket\r\n'
+                'Connection: Upgrade\r\n'
+                'Sec-WebSocket-Key: {2}\r\n'
+                'Sec-WebSocket-Version: 13\r\n\r\n'.format(url, connection.host, key)
+            ))
+            self.stream = self.sock.makefile('rb')
+            status_line = self.stream.readline()
+            headers = {}
+            while True:
+                line = self.stream.readline()
+                if line.strip() == b'':
+                    break
+                name, dummy, value = to_text(line).partition(':')
+                headers[name.strip().lower()] = value.strip()
+        except (IOError, OSError, socket.error) as e:
+            self.close()
+            raise LXDClientException('cannot open the LXD event stream', err=e)
+        accept = to_text(base64.b64encode(hashlib.sha1(to_bytes(key + WEBSOCKET_GUID)).digest()))
+        parts = status_line.split(None, 2)
+        if len(parts) < 2 or parts[1] != b'101' or headers.get('sec-websocket-accept', None) != accept:
+            self.close()
+            raise LXDClientException('the LXD server refused the event stream: {0}'.format(
+                to_text(status_line, errors='surrogate_or_replace').strip()))
+        self.client.timings.record('GET', url, 101, time.time() - started, 0, 0)
+        self.connected = True
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def _read_exactly(self, size):
+        data = self.stream.read(size)
+        if len(data) < size:
+            raise IOError('the LXD event stream was closed')
+        return data
+
+    def _read_frame(self):
+        header = bytearray(self._read_exactly(2))
+        length = header[1] & 0x7f
+        if length == 126:
+            length = struct.unpack('!H', self._read_exactly(2))[0]
+        elif length == 127:
+            length = struct.unpack('!Q', self._read_exactly(8))[0]
+        mask = None
+        if header[1] & 0x80:
+            mask = bytearray(self._read_exactly(4))
+        payload = self._read_exactly(length)
+        if mask is not None:
+            payload = bytes(bytearray(b ^ mask[i % 4] for i, b in enumerate(bytearray(payload))))
+        return bool(header[0] & 0x80), header[0] & 0x0f, payload
+
+    def _send_frame(self, opcode, payload):
+        # Frames sent by a client are masked, control frames are short
+        mask = bytearray(os.urandom(4))
+        frame = bytearray([0x80 | opcode, 0x80 | len(payload)]) + mask
+        frame += bytearray(b ^ mask[i % 4] for i, b in enumerate(bytearray(payload)))
+        with self.send_lock:
+            self.sock.sendall(bytes(frame))
+
+    def _dispatch(self, event):
+        metadata = event.get('metadata', None) or {}
+        with self.cond:
+            if event.get('type', None) == 'operation':
+                if metadata.get('status_code', 0) >= OPERATION_DONE_CODE:
+                    operation_id = metadata.get('id', None)
+                    if operation_id in self.expected:
+                        self.operations[operation_id] = metadata
+                        self.cond.notify_all()
+                    else:
+                        self.unexpected[operation_id] = (time.time(), metadata)
+                    self._forget_unexpected()
+            elif event.get('type', None) == 'lifecycle':
+                source = metadata.get('source', '').partition('?')[0]
+                self.lifecycle[source] = metadata.get('action', None)
+                self.cond.notify_all()
+
+    def _run(self):
+        message = b''
+        try:
+            while True:
+                fin, opcode, payload = self._read_frame()
+                if opcode == WEBSOCKET_CLOSE:
+                    break
+                if opcode == WEBSOCKET_PING:
+                    self._send_frame(WEBSOCKET_PONG, payload)
+                    continue
+                if opcode not in (WEBSOCKET_CONTINUATION, WEBSOCKET_TEXT):
+                    continue
+                message += payload
+                if fin:
+                    self._dispatch(json.loads(to_text(message, errors='surrogate_or_strict')))
+                    message = b''
+        except (IOError, OSError, socket.error, ValueError):
+            # Waits fall back to asking the server
+            pass
+        finally:
+            with self.cond:
+                self.connected = False
+                self.cond.notify_all()
+
+    def _forget_unexpected(self):
+        expired = time.time() - OPERATION_KEEP_TIMEOUT
+        while self.unexpected and next(iter(self.unexpected.values()))[0] < expired:
+            self.unexpected.popitem(last=False)
+
+    def expect(self, operation_id):
+        """Keep the event of an operation until it is waited for.
+
+        :param operation_id: The id of an operation started by the client
+            or its clones.
+        :type operation_id: ``str``
+        """
+        with self.cond:
+            self.expected.add(operation_id)
+            if operation_id in self.unexpected:
+                self.operations[operation_id] = self.unexpected.pop(operation_id)[1]
+
+    def wait_operation(self, operation_id, deadline=None):
+        """Wait for the event of a finished operation.
+
+        :param operation_id: The id of the operation.
+        :type operation_id: ``str``
+        :param deadline: Time to wait until, None to wait until it is done.
+        :type deadline: ``float``
+        :returns: The operation, or None if the stream ended or the
+            deadline passed before it finished.
+        :rtype: ``dict``
+        """
+        self.expect(operation_id)
+        with self.cond:
+            while operation_id not in self.operations:
+                if not self.connected:
+                    self.expected.discard(operation_id)
+                    return None
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self.expected.discard(operation_id)
+                        return None
+                self.cond.wait(remaining)
+            self.expected.discard(operation_id)
+            return self.operations.pop(operation_id)
+
+    def last_action(self, source):
+        """Return the last lifecycle action of an object, like instance-started.
+
+        :param source: The URL of the object without query.
+        :type source: ``str``
+        """
+        with self.cond:
+            return self.lifecycle.get(source, None)
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                if self.connected:
+                    self._send_frame(WEBSOCKET_CLOSE, b'')
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except (IOError, OSError, socket.error):
+                pass
+        if self.thread is not None:
+            self.thread.join()
+        if self.stream is not None:
+            self.stream.close()
+        self.events_client.close()
+
+
+def listen_events(client):
+    """Resolve the waits of a client and its clones from one event stream.
+
+    :param client: Connected client.
+    :type client: ``LXDClient``
+    :returns: The started listener, close it when the waits are done.
+    :rtype: ``LXDEventListener``
+    :raises LXDClientException: If the server does not stream events.
+    """
+    client.events = LXDEventListener(client).start()
+    return client.events
@@ -0,0 +1,473 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2024, Mikhail Shurutov <shurutov@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+from ansible.module_utils.lxd_cache import LXDStateCache, state_digest
+from ansible.module_utils.lxd_client import LXDClient, LXDClientException, request_limiter, request_log
+from ansible.module_utils.lxd_common import item_options, warn_item_connection
+from ansible.module_utils.lxd_diff import (
+    build_patch, build_put, diff_absent, diff_object,
+    diff_to_result, merge_results, stringify
+)
+from ansible.module_utils.lxd_schema import check_configs
+from ansible.module_utils.lxd_timings import report_timings
+
+
+# NETWORKS_STATES is a list for states supported.
+NETWORKS_STATES = [
+    'present', 'absent'
+]
+
+# CONFIG_PARAMS is a list of config attribute names.
+CONFIG_PARAMS = [
+    'config',
+    'description'
+]
+
+# UPDATE_PARAMS is a list of attribute names writable on update.
+UPDATE_PARAMS = [
+    'config',
+    'description'
+]
+
+# NETWORKS_CONFIG_DEFAULTS is the default config deployed.
+NETWORKS_CONFIG_DEFAULTS = {
+    'ipv4.address': 'none',
+    'ipv6.address': 'none'
+}
+
+# NETWORK_OPTIONS is the argument spec of an item of networks.
+NETWORK_OPTIONS = item_options(dict(
+    config=dict(
+        type='dict',
+    ),
+    description=dict(
+        type='str',
+    ),
+    name=dict(
+        type='str',
+        required=True
+    ),
+    new_name=dict(
+        type='str',
+    ),
+    state=dict(
+        choices=NETWORKS_STATES,
+        default='present'
+    ),
+    type=dict(
+        type='str',
+    ),
+))
+
+
+class LXDNetworkManagement(object):
+    def __init__(self, module, client=None):
+        """Management of LXC containers via Ansible.
+
+        :param module: Processed Ansible Module.
+        :type module: ``object``
+        :param client: LXD client shared with other reconcilers, a new one
+            is connected if it is not given.
+        :type client: ``LXDClient``
+        """
+        self.module = module
+        self.cert_file = self.module.params.get('client_cert', None)
+        self.key_file = self.module.params.get('client_key', None)
+        self.networks = self.module.params.get('networks', None)
+        if self.networks is None:
+            self._build_config()
+        self.name = self.module.params['name']
+        self.new_name = self.module.params.get('new_name', None)
+        self.rename = self.module.params['rename']
+        self.state = self.module.params['state']
+        self.trust_password = self.module.params.get('trust_password', None)
+        self.type = self.module.params['type']
+        self.update_mode = self.module.params['update_mode']
+        self.url = self.module.params['url']
+        self.wait_timeout = self.module.params.get('wait_timeout', None)
+        self.debug = self.module._verbosity >= 4
+        self.client = client
+        if self.client is None:
+            try:
+                self.client = LXDClient(
+                    self.url, key_file=self.key_file, cert_file=self.cert_file,
+                    debug=self.debug, log=request_log(self.module.params, self.debug),
+                    limiter=request_limiter(self.module.params),
+                    retry_timeout=self.module.params.get('retry_timeout', None)
+                )
+            except LXDClientException as e:
+                self.module.fail_json(msg=e.msg)
+        self.cache = None
+        # The recursive listing of networks carries no ETags, it is always read
+        if self.networks is None and self.module.params.get('state_cache', None) is not None:
+            self.cache = LXDStateCache(self.module.params['state_cache'])
+        self.actions = []
+        self.networks_actions = {}
+        self.networks_old_state = {}
+        self.diffs = []
+        # Read once, by schema_items or reconcile
+        self.old_network_json = None
+        self.old_networks_json = None
+
+    def _build_config(self):
+        self.config = {}
+        for attr in CONFIG_PARAMS:
+            param_val = self.module.params.get(attr, None)
+            if attr == 'config':
+                param_val = dict(NETWORKS_CONFIG_DEFAULTS, **(param_val or {}))
+            if param_val is not None:
+                self.config[attr] = stringify(param_val)
+
+    @staticmethod
+    def _build_network_config(network):
+        config = {}
+        for attr in CONFIG_PARAMS:
+            param_val = network.get(attr, None)
+            if attr == 'config':
+                param_val = dict(NETWORKS_CONFIG_DEFAULTS, **(param_val or {}))
+            if param_val is not None:
+                config[attr] = stringify(param_val)
+        return config
+
+    def _network_digest(self):
+        return state_digest(self.config, self.state, self.update_mode, self.new_name, self.type)
+
+    def _get_network_json(self):
+        url = '/1.0/networks/{0}'.format(self.name)
+        known_etag = None
+        if self.cache is not None:
+            known_etag = self.cache.etag(self.url + url, self._network_digest())
+        return self.client.do(
+            'GET', url,
+            ok_error_codes=[404], known_etag=known_etag
+        )
+
+    def _get_networks_json(self):
+        return self.client.do('GET', '/1.0/networks?recursion=1')
+
+    def _read_networks(self):
+        if self.networks is None:
+            if self.old_network_json is None:
+                with self.client.timings.phase('read'):
+                    self.old_network_json = self._get_network_json()
+        elif self.old_networks_json is None:
+            with self.client.timings.phase('read'):
+                self.old_networks_json = self._get_networks_json()
+
+    def _existing_types(self):
+        """Return the types of the existing networks keyed by item name.
+
+        The type of a network the state cache finds unchanged is None.
+
+        :rtype: ``dict``
+        """
+        self._read_networks()
+        if self.networks is None:
+            if self.old_network_json['type'] == 'error':
+                return {}
+            if self.client.not_modified(self.old_network_json):
+                return {self.name: None}
+            return {self.name: self.old_network_json['metadata'].get('type', None) or 'bridge'}
+        networks = dict(
+            (network['name'], network)
+            for network in self.old_networks_json['metadata'] or []
+        )
+        return dict(
+            (network['name'], networks[current_name].get('type', None) or 'bridge')
+            for network, current_name, target_name in self._plan_networks(networks)
+            if current_name in networks
+        )
+
+    @staticmethod
+    def _network_json_to_module_state(resp_json):
+        if resp_json['type'] == 'error':
+            return 'absent'
+        return 'present'
+
+    def _update_network(self):
+        if self.state == 'present':
+            if self.old_state == 'absent':
+                if self.new_name is None:
+                    self._create_network()
+                else:
+                    self.module.fail_json(
+                        msg='new_name must not be set when the network does not exist and the specified state is present',
+                        changed=False)
+            else:
+                if self.new_name is not None and self.new_name != self.name:
+                    self._rename_network()
+                if self._needs_to_apply_network_configs():
+                    self._apply_network_configs()
+        elif self.state == 'absent':
+            if self.old_state == 'present':
+                if self.new_name is None:
+                    self._delete_network()
+                else:
+                    self.module.fail_json(
+                        msg='new_name must not be set when the network exists and the specified state is absent',
+                        changed=False)
+
+    def _diff_header(self, name):
+        return name if self.networks is not None else None
+
+    def _create_network(self):
+        config = self.config.copy()
+        config['name'] = self.name
+        if self.type is not None:
+            config['type'] = self.type
+        self.diffs.append(diff_to_result(
+            diff_object({}, config, CONFIG_PARAMS + ['type']),
+            header=self._diff_header(self.name)
+        ))
+        if not self.module.check_mode:
+            with self.client.timings.phase('write'):
+                self.client.do(
+                    'POST', '/1.0/networks', config,
+                    wait_timeout=self.wait_timeout
+                )
+        self.actions.append('create')
+
+    def _rename_network(self):
+        config = {'name': self.new_name}
+        self.diffs.append(diff_to_result(
+            {'name': {'before': self.name, 'after': self.new_name}},
+            header=self._diff_header(self.new_name)
+        ))
+        if not self.module.check_mode:
+            with self.client.timings.phase('write'):
+                self.client.do('POST', '/1.0/networks/{}'.format(self.name), config)
+        self.actions.append('rename')
+        self.name = self.new_name
+
+    def _needs_to_apply_network_configs(self):
+        if self.client.not_modified(self.old_network_json):
+            self.diff = {}
+            return False
+        self.diff = diff_object(
+            self.old_network_json['metadata'], self.config,
+            UPDATE_PARAMS, self.update_mode
+        )
+        return len(self.diff) > 0
+
+    def _apply_network_configs(self):
+        url = '/1.0/networks/{}'.format(self.name)
+        if not self.module.check_mode:
+            if self.networks is not None or url not in self.client.etags:
+                # The recursive listing carries no ETags and a renamed network
+                # was read by its old name, so the network is read again to
+                # make the update conditional
+                with self.client.timings.phase('read'):
+                    self.old_network_json = self.client.do('GET', url)
+                if not self._needs_to_apply_network_configs():
+                    return
+            if self.update_mode == 'patch':
+                config = build_patch(self.diff)
+            else:
+                config = build_put(
+                    self.old_network_json['metadata'], self.config, UPDATE_PARAMS
+                )
+            with self.client.timings.phase('write'):
+                self.client.do(
+                    self.update_mode.upper(), url, config,
+                    etag=self.client.etags.get(url, None)
+                )
+        self.actions.append('apply_network_configs')
+        self.diffs.append(diff_to_result(self.diff, header=self._diff_header(self.name)))
+
+    def _delete_network(self):
+        self.diffs.append(diff_to_result(
+            diff_absent(self.old_network_json['metadata'], CONFIG_PARAMS + ['type']),
+            header=self._diff_header(self.name)
+        ))
+        if not self.module.check_mode:
+            with self.client.timings.phase('write'):
+                self.client.do(
+                    'DELETE', '/1.0/networks/{}'.format(self.name),
+                    wait_timeout=self.wait_timeout
+                )
+        self.actions.append('delete')
+
+    def _plan_networks(self, networks):
+        """Resolve every item of networks to the name it is managed by.
+
+        :param networks: Existing networks keyed by name.
+        :type networks: ``dict``
+        :returns: List of (item, current name, target name) tuples.
+        :rtype: ``list``
+        """
+        plan = []
+        for network in self.networks:
+            name = network['name']
+            new_name = network.get('new_name', None) if self.rename else None
+            if new_name is None or new_name == name:
+                plan.append((network, name, name))
+            elif network['state'] == 'absent':
+                if name in networks:
+                    self.module.fail_json(
+                        msg='new_name must not be set when the network exists and the specified state is absent',
+                        changed=False)
+                plan.append((network, name, name))
+            elif name in networks:
+                plan.append((network, name, new_name))
+            elif new_name in networks:
+                plan.append((network, new_name, new_name))
+            else:
+                self.module.fail_json(
+                    msg='new_name must not be set when the network does not exist and the specified state is present',
+                    changed=False)
+        return plan
+
+    def _update_networks(self):
+        networks = dict(
+            (network['name'], network)
+            for network in self.old_networks_json['metadata'] or []
+        )
+        plan = self._plan_networks(networks)
+
+        for network, current_name, target_name in plan:
+            self.networks_old_state[network['name']] = (
+                'present' if current_name in networks else 'absent'
+            )
+            self.networks_actions.setdefault(network['name'], [])
+
+        # Renames go first, so config changes are applied to renamed networks
+        for network, current_name, target_name in plan:
+            if current_name == target_name:
+                continue
+            self.name = current_name
+            self.new_name = target_name
+            self.actions = self.networks_actions[network['name']]
+            self._rename_network()
+            networks[target_name] = networks.pop(current_name)
+
+        for network, current_name, target_name in plan:
+            self.name = target_name
+            self.new_name = None
+            self.state = network['state']
+            self.type = network.get('type', None)
+            self.config = self._build_network_config(network)
+            if target_name in networks:
+                self.old_network_json = {'type': 'sync', 'metadata': networks[target_name]}
+            else:
+                self.old_network_json = {'type': 'error'}
+            self.old_state = self._network_json_to_module_state(self.old_network_json)
+            self.actions = self.networks_actions[network['name']]
+            self._update_network()
+
+    def _update_cache(self):
+        url = '/1.0/networks/{0}'.format(self.name)
+        etag = self.client.etags.get(url, None)
+        if self.old_state == 'present' and not self.actions and etag is not None:
+            self.cache.store(self.url + url, etag, self._network_digest())
+        else:
+            self.cache.forget(self.url + url)
+        self.cache.save()
+
+    def _diff_result(self):
+        if self.networks is not None:
+            return self.diffs
+        return merge_results(self.diffs)
+
+    def _state_changed(self):
+        if self.networks is None:
+            return len(self.actions) > 0
+        return any(len(actions) > 0 for actions in self.networks_actions.values())
+
+    def schema_items(self):
+        """Return the configs checked against the schema of the server.
+
+        Networks without a type are checked as the type of the existing
+        network, so they may read it, and as bridges if they do not exist.
+
+        :returns: List of (label, entity, config) tuples.
+        :rtype: ``list``
+        """
+        if self.networks is None:
+            networks = [(self.name, self.type, self.state, self.config)]
+        else:
+            networks = [
+                (network['name'], network.get('type', None), network['state'],
+                 self._build_network_config(network))
+                for network in self.networks
+            ]
+        items = []
+        types = None
+        for name, network_type, state, config in networks:
+            if state != 'present':
+                continue
+            if network_type is None:
+                if types is None:
+                    types = self._existing_types()
+                network_type = types.get(name, 'bridge')
+            if network_type is None:
+                # The network is as it was converged with this config
+                continue
+            items.append((name, 'network-{0}'.format(network_type), config.get('config', {})))
+        return items
+
+    def reconcile(self):
+        """Reconcile the networks.
+
+        :returns: The module result without logs.
+        :rtype: ``dict``
+        """
+        timings = self.client.timings
+        if self.trust_password is not None:
+            with timings.phase('authenticate'):
+                self.client.authenticate(
+                    self.trust_password, self.module.params.get('auth_cache', None)
+                )
+        if self.module.params.get('validate_config', False):
+            check_configs(self.client, self.module.params, self.schema_items())
+
+        self._read_networks()
+        if self.networks is None:
+            self.old_state = self._network_json_to_module_state(self.old_network_json)
+            with timings.phase('diff'):
+                self._update_network()
+            if self.cache is not None and not self.module.check_mode:
+                with timings.phase('cache'):
+                    self._update_cache()
+        else:
+            with timings.phase('diff'):
+                self._update_networks()
+            self.old_state = self.networks_old_state
+            self.actions = self.networks_actions
+
+        return {
+            'changed': self._state_changed(),
+            'old_state': self.old_state,
+            'actions': self.actions,
+            'diff': self._diff_result()
+        }
+
+    def fail_params(self, e):
+        """Return the module failure result of an exception without logs."""
+        return {
+            'msg': e.msg,
+            'changed': self._state_changed(),
+            'actions': self.actions if self.networks is None else self.networks_actions
+        }
+
+    def run(self):
+        """Run the main method."""
+
+        if self.networks is not None:
+            warn_item_connection(self.module, 'networks', self.networks)
+        try:
+            result_json = self.reconcile()
+            report_timings(self.module, self.client, result_json)
+            if self.client.debug:
+                result_json['logs'] = self.client.logs
+            self.module.exit_json(**result_json)
+        except LXDClientException as e:
+            fail_params = self.fail_params(e)
+            report_timings(self.module, self.client, fail_params)
+            if self.client.debug:
+                fail_params['logs'] = e.kwargs['logs']
+            self.module.fail_json(**fail_params)
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2024, Mikhail Shurutov <shurutov@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+from ansible.module_utils.lxd_client import LXDClient, LXDClientException, request_limiter, request_log
+from ansible.module_utils.lxd_common import item_options, warn_item_connection
+from ansible.module_utils.lxd_diff import (
+    build_patch, build_put, diff_absent, diff_object, diff_to_result, stringify
+)
+from ansible.module_utils.lxd_timings import report_timings
+from ansible.module_utils.six.moves.urllib.parse import quote, urlencode
+
+
+# PROFILES_STATES is a list for states supported.
+PROFILES_STATES = [
+    'present', 'absent'
+]
+
+# PROFILE_OPTIONS is the argument spec of an item of profiles.
+PROFILE_OPTIONS = item_options(dict(
+    config=dict(
+        type='dict',
+    ),
+    description=dict(
+        type='str',
+    ),
+    devices=dict(
+        type='dict',
+    ),
+    name=dict(
+        type='str',
+        required=True
+    ),
+    new_name=dict(
+        type='str',
+    ),
+    project=dict(
+        type='str',
+    ),
+    state=dict(
+        choices=PROFILES_STATES,
+        default='present'
+    ),
+))
+
+# PROJECT_OPTIONS is the argument spec of an item of projects.
+# merge_profile is the key the role passed per project before, it
+# overrides the merge_project option for the item.
+PROJECT_OPTIONS = item_options(dict(
+    config=dict(
+        type='dict',
+    ),
+    description=dict(
+        type='str',
+    ),
+    merge_profile=dict(
+        type='bool',
+    ),
+    name=dict(
+        type='str',
+        required=True
+    ),
+    new_name=dict(
+        type='str',
+    ),
+    state=dict(
+        choices=PROFILES_STATES,
+        default='present'
+    ),
+))
+
+
+class LXDProfileManagement(object):
+    # KIND is the module option listing the items.
+    KIND = 'profiles'
+    # COLLECTION_URL is the URL the objects are listed and created at.
+    COLLECTION_URL = '/1.0/profiles'
+    # UPDATE_PARAMS is a list of attribute names writable on update.
+    UPDATE_PARAMS = ['config', 'description', 'devices']
+    # MERGE_PARAM is the module option choosing merge or replace updates.
+    MERGE_PARAM = 'merge_profile'
+    # ITEM_MERGE_KEY is the item key overriding MERGE_PARAM for the item.
+    ITEM_MERGE_KEY = None
+    # PROJECT_SCOPED is whether the objects belong to a project.
+    PROJECT_SCOPED = True
+
+    def __init__(self, module, client=None):
+        """Management of LXD profiles in bulk via Ansible.
+
+        All objects of a project are read with one recursive request and
+        every item is reconciled against it in memory.
+
+        :param module: Processed Ansible Module.
+        :type module: ``object``
+        :param client: LXD client shared with other reconcilers, a new one
+            is connected if it is not given.
+        :type client: ``LXDClient``
+        """
+        self.module = module
+        self.cert_file = self.module.params.get('client_cert', None)
+        self.key_file = self.module.params.get('client_key', None)
+        self.items = self.module.params[self.KIND]
+        self.merge = self.module.params[self.MERGE_PARAM]
+        self.trust_password = self.module.params.get('trust_password', None)
+        self.url = self.module.params['url']
+        self.debug = self.module._verbosity >= 4
+        self.client = client
+        if self.client is None:
+            try:
+                self.client = LXDClient(
+                    self.url, key_file=self.key_file, cert_file=self.cert_file,
+                    debug=self.debug, log=request_log(self.module.params, self.debug),
+                    limiter=request_limiter(self.module.params),
+                    retry_timeout=self.module.params.get('retry_timeout', None)
+                )
+            except LXDClientException as e:
+                self.module.fail_json(msg=e.msg)
+        self.actions = {}
+        self.old_state = {}
+        self.diffs = []
+
+    def _url(self, name=None, project=None, **query):
+        url = self.COLLECTION_URL
+        if name is not None:
+            url = '{0}/{1}'.format(url, quote(name, safe=''))
+        query['project'] = project
+        query = dict((k, v) for k, v in query.items() if v is not None)
+        if not query:
+            return url
+        return '{0}?{1}'.format(url, urlencode(sorted(query.items())))
+
+    def _key(self, item):
+        """Return the name the results of an item are keyed by."""
+        project = item.get('project', None) if self.PROJECT_SCOPED else None
+        if project is None:
+            return item['name']
+        return '{0}/{1}'.format(project, item['name'])
+
+    def _get_objects_json(self, project):
+        resp_json = self.client.do('GET', self._url(project=project, recursion=1))
+        return dict((obj['name'], obj) for obj in resp_json['metadata'] or [])
+
+    def _merge(self, item):
+        """Return whether an item is merged into its object."""
+        if self.ITEM_MERGE_KEY is not None and item.get(self.ITEM_MERGE_KEY, None) is not None:
+            return item[self.ITEM_MERGE_KEY]
+        return self.merge
+
+    def _build_desired(self, item, old):
+        """Build the desired fields of an object.
+
+        When merging, config keys which are not listed are kept by the
+        update and every listed device is merged key by key into the
+        existing device of the same name.
+        """
+        desired = dict(
+            (attr, stringify(item[attr])) for attr in self.UPDATE_PARAMS
+            if item.get(attr, None) is not None
+        )
+        if self._merge(item) and 'devices' in desired:
+            old_devices = old.get('devices', None) or {}
+            desired['devices'] = dict(
+                (name, dict(old_devices.get(name, {}), **device))
+                for name, device in desired['devices'].items()
+            )
+        return desired
+
+    def _plan(self, objects):
+        """Resolve every item to the name it is managed by.
+
+        :param objects: Existing objects keyed by project and name.
+        :type objects: ``dict``
+        :returns: List of (item, project, current name, target name) tuples.
+        :rtype: ``list``
+        """
+        plan = []
+        for item in self.items:
+            project = item.get('project', None) if self.PROJECT_SCOPED else None
+            existing = objects[project]
+            name = item['name']
+            new_name = item.get('new_name', None)
+            if new_name is None or new_name == name:
+                plan.append((item, project, name, name))
+            elif item['state'] == 'absent':
+                if name in existing:
+                    self.module.fail_json(
+                        msg='new_name must not be set when {0} exists and the specified state is absent'.format(name),
+                        changed=False)
+                plan.append((item, project, name, name))
+            elif name in existing:
+                plan.append((item, project, name, new_name))
+            elif new_name in existing:
+                plan.append((item, project, new_name, new_name))
+            else:
+                self.module.fail_json(
+                    msg='new_name must not be set when {0} does not exist and the specified state is present'.format(name),
+                    changed=False)
+        return plan
+
+    def _diff_header(self, item, name):
+        if self.PROJECT_SCOPED and item.get('project', None) is not None:
+            return '{0}/{1}'.format(item['project'], name)
+        return name
+
+    def _create(self, item, project, name, actions):
+        desired = self._build_desired(item, {})
+        body_json = dict(desired, name=name)
+        self.diffs.append(diff_to_result(
+            diff_object({}, desired, self.UPDATE_PARAMS),
+            header=self._diff_header(item, name)
+        ))
+        if not self.module.check_mode:
+            with self.client.timings.phase('write'):
+                self.client.do('POST', self._url(project=project), body_json)
+        actions.append('create')
+
+    def _rename(self, item, project, name, new_name, actions):
+        self.diffs.append(diff_to_result(
+            {'name': {'before': name, 'after': new_name}},
+            header=self._diff_header(item, new_name)
+        ))
+        if not self.module.check_mode:
+            with self.client.timings.phase('write'):
+                self.client.do('POST', self._url(name, project), {'name': new_name})
+        actions.append('rename')
+
+    def _apply(self, item, project, name, old, actions):
+        mode = 'patch' if self._merge(item) else 'put'
+        desired = self._build_desired(item, old)
+        diff = diff_object(old, desired, self.UPDATE_PARAMS, mode)
+        if not diff:
+            return
+        if not self.module.check_mode:
+            # The recursive listing carries no ETags, so the object is read
+            # again to make the update conditional
+            url = self._url(name, project)
+            with self.client.timings.phase('read'):
+                old = self.client.do('GET', url)['metadata']
+            desired = self._build_desired(item, old)
+            diff = diff_object(old, desired, self.UPDATE_PARAMS, mode)
+            if not diff:
+                return
+            if mode == 'patch':
+                body_json = build_patch(diff)
+            else:
+                body_json = build_put(old, desired, self.UPDATE_PARAMS)
+            with self.client.timings.phase('write'):
+                self.client.do(
+                    mode.upper(), url, body_json,
+                    etag=self.client.etags.get(url, None)
+                )
+        actions.append('apply_{0}_configs'.format(self.KIND[:-1]))
+        self.diffs.append(diff_to_result(diff, header=self._diff_header(item, name)))
+
+    def _delete(self, item, project, name, old, actions):
+        self.diffs.append(diff_to_result(
+            diff_absent(old, self.UPDATE_PARAMS),
+            header=self._diff_header(item, name)
+        ))
+        if not self.module.check_mode:
+            with self.client.timings.phase('write'):
+                self.client.do('DELETE', self._url(name, project))
+        actions.append('delete')
+
+    def _state_changed(self):
+        return any(len(actions) > 0 for actions in self.actions.values())
+
+    def schema_items(self):
+        """Return the configs checked against the schema of the server.
+
+        Profiles and projects are not checked.
+
+        :rtype: ``list``
+        """
+        return []
+
+    def reconcile(self):
+        """Reconcile the items.
+
+        :returns: The module result without logs.
+        :rtype: ``dict``
+        """
+        timings = self.client.timings
+        if self.trust_password is not None:
+            with timings.phase('authenticate'):
+                self.client.authenticate(
+                    self.trust_password, self.module.params.get('auth_cache', None)
+                )
+
+        objects = {}
+        with timings.phase('read'):
+            for item in self.items:
+                project = item.get('project', None) if self.PROJECT_SCOPED else None
+                if project not in objects:
+                    objects[project] = self._get_objects_json(project)
+        plan = self._plan(objects)
+
+        for item, project, current_name, target_name in plan:
+            key = self._key(item)
+            self.old_state[key] = 'present' if current_name in objects[project] else 'absent'
+            self.actions.setdefault(key, [])
+
+        # Renames go first, so config changes are applied to renamed objects
+        for item, project, current_name, target_name in plan:
+            if current_name == target_name:
+                continue
+            self._rename(item, project, current_name, target_name, self.actions[self._key(item)])
+            objects[project][target_name] = objects[project].pop(current_name)
+
+        with timings.phase('diff'):
+            for item, project, current_name, target_name in plan:
+                actions = self.actions[self._key(item)]
+                old = objects[project].get(target_name, None)
+                if item['state'] == 'present':
+                    if old is None:
+                        self._create(item, project, target_name, actions)
+                    else:
+                        self._apply(item, project, target_name, old, actions)
+                elif old is not None:
+                    self._delete(item, project, target_name, old, actions)
+
+        return {
+            'changed': self._state_changed(),
+            'old_state': self.old_state,
+            'actions': self.actions,
+            'diff': self.diffs
+        }
+
+    def fail_params(self, e):
+        """Return the module failure result of an exception without logs."""
+        return {
+            'msg': e.msg,
+            'changed': self._state_changed(),
+            'actions': self.actions
+        }
+
+    def run(self):
+        """Run the main method."""
+
+        warn_item_connection(self.module, self.KIND, self.items)
+        try:
+            result_json = self.reconcile()
+            report_timings(self.module, self.client, result_json)
+            if self.client.debug:
+                result_json['logs'] = self.client.logs
+            self.module.exit_json(**result_json)
+        except LXDClientException as e:
+            fail_params = self.fail_params(e)
+            report_timings(self.module, self.client, fail_params)
+            if self.client.debug:
+                fail_params['logs'] = e.kwargs['logs']
+            self.module.fail_json(**fail_params)
+
+
+class LXDProjectManagement(LXDProfileManagement):
+    """Management of LXD projects in bulk via Ansible."""
+
+    KIND = 'projects'
+    COLLECTION_URL = '/1.0/projects'
+    UPDATE_PARAMS = ['config', 'description']
+    MERGE_PARAM = 'merge_project'
+    ITEM_MERGE_KEY = 'merge_profile'
+    PROJECT_SCOPED = False
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2024, Mikhail Shurutov <shurutov@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import fnmatch
+import re
+
+from ansible.module_utils.lxd_cache import LXDSchemaCache
+from ansible.module_utils.lxd_client import LXDClientException
+from ansible.module_utils.lxd_diff import canonical_value
+
+# SCHEMA_FREE_KEYS is a list of patterns of config keys valid for every
+# entity, which the schema does not list.
+SCHEMA_FREE_KEYS = [
+    'user.*', 'volatile.*'
+]
+
+# PLACEHOLDER_RE matches the placeholders of keys in the schema, like
+# <name> in volatile.<name>.hwaddr
+PLACEHOLDER_RE = re.compile(r'<[^>]*>|\[[^\]]*\]|\{[^}]*\}')
+
+# INTEGER_RE matches the values of integer keys.
+INTEGER_RE = re.compile(r'^-?\d+$')
+
+# POOL_GROUP is the group of the pool keys of a storage-<driver> entity.
+# The other groups of the entity list volume and bucket keys, the groups
+# of the other entities are sections of one config.
+POOL_GROUP = 'pool-conf'
+
+# VOLUME_GROUP is the group of the volume keys of a storage-<driver>
+# entity, pool keys prefixed with volume. are their defaults.
+VOLUME_GROUP = 'volume-conf'
+
+
+class LXDConfigSchema(object):
+    def __init__(self, configs):
+        """Config keys of the entities of a LXD server.
+
+        :param configs: The configs field of GET /1.0/metadata/configuration,
+            keys grouped per entity such as server, storage-zfs or
+            network-bridge. None if the server does not serve it.
+        :type configs: ``dict``
+        """
+        self.entities = {}
+        for entity, groups in (configs or {}).items():
+            self.entities[entity] = {}
+            for name, group in (groups or {}).items():
+                keys = {}
+                patterns = {}
+                for key_def in (group or {}).get('keys', None) or []:
+                    for key, props in key_def.items():
+                        if PLACEHOLDER_RE.search(key):
+                            patterns[PLACEHOLDER_RE.sub('*', key)] = props
+                        else:
+                            keys[key] = props
+                self.entities[entity][name] = (keys, patterns)
+
+    def knows(self, entity):
+        return entity in self.entities
+
+    def _lookup(self, entity, key, group=None):
+        groups = self.entities[entity]
+        if group in groups:
+            groups = {group: groups[group]}
+        for keys, patterns in groups.values():
+            if key in keys:
+                return keys[key]
+            for pattern, props in patterns.items():
+                if fnmatch.fnmatchcase(key, pattern):
+                    return props
+        return None
+
+    def validate(self, entity, config, label):
+        """Check config keys and value types of an entity.
+
+        Unknown entities are not checked. Storage pools are checked against
+        the pool keys of their driver, keys prefixed with volume. against
+        its volume keys. Servers missing the group are checked against all
+        keys of the entity.
+
+        :param entity: The entity, like server or storage-dir.
+        :type entity: ``str``
+        :param config: The config to check.
+        :type config: ``dict``
+        :param label: The name of the object in the error messages.
+        :type label: ``str``
+        :returns: List of errors.
+        :rtype: ``list``
+        """
+        if not self.knows(entity):
+            return []
+        group = POOL_GROUP if entity.startswith('storage-') else None
+        errors = []
+        for key, value in sorted((config or {}).items()):
+            if any(fnmatch.fnmatchcase(key, pattern) for pattern in SCHEMA_FREE_KEYS):
+                continue
+            props = self._lookup(entity, key, group)
+            if props is None and group is not None and key.startswith('volume.'):
+                props = self._lookup(entity, key[len('volume.'):], VOLUME_GROUP)
+            if props is None:
+                errors.append('{0}: unknown key {1} for {2}'.format(label, key, entity))
+                continue
+            value = canonical_value(value)
+            if value in (None, ''):
+                continue
+            key_type = props.get('type', None)
+            if key_type == 'bool' and value not in ('true', 'false'):
+                errors.append('{0}: {1} must be a boolean, got {2}'.format(label, key, value))
+            elif key_type == 'integer' and not INTEGER_RE.match(value):
+                errors.append('{0}: {1} must be an integer, got {2}'.format(label, key, value))
+        return errors
+
+
+def load_schema(client, cache_path=None, refresh=False):
+    """Return the config key schema of the LXD server of a client.
+
+    The schema is read from the server_cache of the client or the cache
+    file for the version the server was last found running, unless
+    refresh is set. Otherwise the version is taken from the GET /1.0
+    response of the run, which is read if the client has none, and the
+    schema from /1.0/metadata/configuration unless it is cached for the
+    version.
+
+    :param client: The LXD client.
+    :type client: ``LXDClient``
+    :param cache_path: The schema cache file path, no cache if empty.
+    :type cache_path: ``str``
+    :param refresh: Whether to check the version of the server.
+    :type refresh: ``bool``
+    :returns: Tuple of the schema and whether it was read from the cache
+        without checking the server.
+    :rtype: ``tuple``
+    """
+    if not refresh and 'schema' in client.server_cache:
+        return client.server_cache['schema'], True
+    cache = LXDSchemaCache(cache_path) if cache_path else None
+    if cache is not None and not refresh:
+        version = cache.version(client.url)
+        if version is not None and cache.has_schema(version):
+            client.server_cache['schema'] = LXDConfigSchema(cache.schema(version))
+            return client.server_cache['schema'], True
+    with client.timings.phase('read'):
+        server_json = client.server_json
+        if server_json is None:
+            server_json = client.do('GET', '/1.0')
+        server_json = server_json['metadata'] or {}
+        version = (server_json.get('environment', None) or {}).get('server_version', None)
+        if cache is not None and cache.has_schema(version):
+            configs = cache.schema(version)
+        else:
+            resp_json = client.do('GET', '/1.0/metadata/configuration', ok_error_codes=[404])
+            configs = None
+            if resp_json['type'] != 'error':
+                configs = (resp_json['metadata'] or {}).get('configs', None)
+    if cache is not None:
+        cache.store_schema(client.url, version, configs)
+        try:
+            cache.save()
+        except (IOError, OSError):
+            # The schema is read again by the next run
+            pass
+    client.server_cache['schema'] = LXDConfigSchema(configs)
+    return client.server_cache['schema'], False
+
+
+def check_configs(client, params, items):
+    """Validate desired configs before anything is sent to the server.
+
+    When a cached schema finds errors, the server may have been upgraded
+    since, so they are checked again against the schema of the version it
+    runs.
+
+    :param client: The LXD client.
+    :type client: ``LXDClient``
+    :param params: The module parameters, schema_cache is the cache path.
+    :type params: ``dict``
+    :param items: List of (label, entity, config) tuples.
+    :type items: ``list``
+    :raises LXDClientException: Listing all errors found.
+    """
+    if not items:
+        return
+    cache_path = params.get('schema_cache', None)
+    schema, cached = load_schema(client, cache_path)
+    errors = []
+    for label, entity, config in items:
+        errors.extend(schema.validate(entity, config, label))
+    if errors and cached:
+        schema, cached = load_schema(client, cache_path, refresh=True)
+        errors = []
+        for label, entity, config in items:
+            errors.extend(schema.validate(entity, config, label))
+    if errors:
+        raise LXDClientException('invalid config: {0}'.format('; '.join(errors)))
@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2024, Mikhail Shurutov <shurutov@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+from ansible.module_utils.lxd_cache import LXDStateCache, state_digest
+from ansible.module_utils.lxd_client import (
+    LXDClient, LXDClientException, request_limiter, request_log, run_concurrently
+)
+from ansible.module_utils.lxd_common import item_options, warn_item_connection
+from ansible.module_utils.lxd_diff import (
+    POOL_SERVER_KEYS, build_patch, build_put, diff_absent, diff_object,
+    diff_to_result, merge_results, stringify
+)
+from ansible.module_utils.lxd_schema import check_configs
+from ansible.module_utils.lxd_timings import report_timings
+
+
+# STORAGES_STATES is a list for states supported.
+STORAGES_STATES = [
+    'present', 'absent'
+]
+
+# STORAGES_CONFIG_PARAMS is a list of config attribute names.
+STORAGES_CONFIG_PARAMS = [
+    'config', 'description', 'driver'
+]
+
+# STORAGES_UPDATE_PARAMS is a list of attribute names writable on update.
+STORAGES_UPDATE_PARAMS = [
+    'config', 'description'
+]
+
+# STORAGES_CONFIG_DEFAULTS is the default config deployed.
+STORAGES_CONFIG_DEFAULTS = {}
+
+# POOL_OPTIONS is the argument spec of an item of pools.
+POOL_OPTIONS = item_options(dict(
+    config=dict(
+        type='dict',
+    ),
+    description=dict(
+        type='str',
+    ),
+    driver=dict(
+        type='str',
+    ),
+    name=dict(
+        type='str',
+        required=True
+    ),
+    state=dict(
+        choices=STORAGES_STATES,
+        default='present'
+    ),
+))
+
+
+class LXDStorageManagement(object):
+    def __init__(self, module, client=None):
+        """Management of LXC containers via Ansible.
+
+        :param module: Processed Ansible Module.
+        :type module: ``object``
+        :param client: LXD client shared with other reconcilers, a new one
+            is connected if it is not given.
+        :type client: ``LXDClient``
+        """
+        self.module = module
+        self.cert_file = self.module.params.get('client_cert', None)
+        self.key_file = self.module.params.get('client_key', None)
+        self.pools = self.module.params.get('pools', None)
+        if self.pools is None:
+            self._build_config()
+        self.driver = self.module.params['driver']
+        self.name = self.module.params['name']
+        self.state = self.module.params['state']
+        self.trust_password = self.module.params.get('trust_password', None)
+        self.update_mode = self.module.params['update_mode']
+        self.url = self.module.params['url']
+        self.max_parallel = self.module.params['max_parallel']
+        self.wait_timeout = self.module.params.get('wait_timeout', None)
+        self.debug = self.module._verbosity >= 4
+        self.client = client
+        if self.client is None:
+            try:
+                self.client = LXDClient(
+                    self.url, key_file=self.key_file, cert_file=self.cert_file,
+                    debug=self.debug, log=request_log(self.module.params, self.debug),
+                    limiter=request_limiter(self.module.params),
+                    retry_timeout=self.module.params.get('retry_timeout', None)
+                )
+            except LXDClientException as e:
+                self.module.fail_json(msg=e.msg)
+        self.cache = None
+        # The recursive listing of pools carries no ETags, it is always read
+        if self.pools is None and self.module.params.get('state_cache', None) is not None:
+            self.cache = LXDStateCache(self.module.params['state_cache'])
+        self.actions = []
+        self.pools_actions = {}
+        self.pools_old_state = {}
+        self.diffs = []
+        self.pending_creates = []
+
+    def _build_config(self):
+        self.config = {}
+        for attr in STORAGES_CONFIG_PARAMS:
+            param_val = self.module.params.get(attr, None)
+            if attr == 'config':
+                param_val = dict(STORAGES_CONFIG_DEFAULTS, **(param_val or {}))
+            if param_val is not None:
+                self.config[attr] = stringify(param_val)
+
+    @staticmethod
+    def _build_pool_config(pool):
+        config = {}
+        for attr in STORAGES_CONFIG_PARAMS:
+            param_val = pool.get(attr, None)
+            if attr == 'config':
+                param_val = dict(STORAGES_CONFIG_DEFAULTS, **(param_val or {}))
+            if param_val is not None:
+                config[attr] = stringify(param_val)
+        return config
+
+    def _storage_digest(self):
+        return state_digest(self.config, self.state, self.update_mode)
+
+    def _get_storage_json(self):
+        url = '/1.0/storage-pools/{0}'.format(self.name)
+        known_etag = None
+        if self.cache is not None:
+            known_etag = self.cache.etag(self.url + url, self._storage_digest())
+        return self.client.do(
+            'GET', url,
+            ok_error_codes=[404], known_etag=known_etag
+        )
+
+    def _get_storages_json(self):
+        return self.client.do('GET', '/1.0/storage-pools?recursion=1')
+
+    @staticmethod
+    def _storage_json_to_module_state(resp_json):
+        if resp_json['type'] == 'error':
+            return 'absent'
+        return 'present'
+
+    def _update_storage(self):
+        if self.state == 'present':
+            if self.old_state == 'absent':
+                self._create_storage()
+            else:
+                if self._needs_to_apply_storage_configs():
+                    self._apply_storage_configs()
+        elif self.state == 'absent':
+            if self.old_state == 'present':
+                self._delete_storage()
+
+    def _update_storages(self):
+        storages = dict(
+            (storage['name'], storage)
+            for storage in self.old_storages_json['metadata'] or []
+        )
+        for pool in self.pools:
+            self.name = pool['name']
+            self.driver = pool.get('driver', None)
+            self.state = pool['state']
+            self.config = self._build_pool_config(pool)
+            if self.name in storages:
+                self.old_storage_json = {'type': 'sync', 'metadata': storages[self.name]}
+            else:
+                self.old_storage_json = {'type': 'error'}
+            self.old_state = self._storage_json_to_module_state(self.old_storage_json)
+            self.pools_old_state[self.name] = self.old_state
+            self.actions = self.pools_actions.setdefault(self.name, [])
+            self._update_storage()
+        if self.pending_creates:
+            with self.client.timings.phase('write'):
+                self._create_storages()
+
+    def _diff_header(self):
+        return self.name if self.pools is not None else None
+
+    def _create_storage(self):
+        config = self.config.copy()
+        config['name'] = self.name
+        self.diffs.append(diff_to_result(
+            diff_object({}, self.config, STORAGES_CONFIG_PARAMS),
+            header=self._diff_header()
+        ))
+        if not self.module.check_mode:
+            if self.pools is not None and self.max_parallel > 1:
+                self.pending_creates.append((config, self.actions))
+                return
+            with self.client.timings.phase('write'):
+                self.client.do(
+                    'POST', '/1.0/storage-pools', config,
+                    wait_timeout=self.wait_timeout
+                )
+        self.actions.append('create')
+
+    def _create_storages(self):
+        calls = [
+            lambda client, config=config: client.do(
+                'POST', '/1.0/storage-pools', config, wait=False
+            )
+            for config, actions in self.pending_creates
+        ]
+        results = run_concurrently(self.client, calls, self.max_parallel)
+        errors = [e for resp_json, e in results if e is not None]
+        # Pools whose request failed are skipped, the others are awaited
+        # even if some failed, so actions reflect what LXD really did
+        operations = [
+            (resp_json, actions)
+            for (resp_json, e), (config, actions) in zip(results, self.pending_creates)
+            if e is None
+        ]
+        try:
+            self.client.wait_operations(
+                [resp_json for resp_json, actions in operations],
+                timeout=self.wait_timeout
+            )
+        finally:
+            for resp_json, actions in operations:
+                actions.append('create')
+            self.pending_creates = []
+        if errors:
+            raise errors[0]
+
+    def _needs_to_apply_storage_configs(self):
+        if self.client.not_modified(self.old_storage_json):
+            self.diff = {}
+            return False
+        self.diff = diff_object(
+            self.old_storage_json['metadata'], self.config,
+            STORAGES_UPDATE_PARAMS, self.update_mode, POOL_SERVER_KEYS
+        )
+        return len(self.diff) > 0
+
+    def _apply_storage_configs(self):
+        url = '/1.0/storage-pools/{}'.format(self.name)
+        if not self.module.check_mode:
+            if self.pools is not None:
+                # The recursive listing carries no ETags, so the pool is read
+                # again to make the update conditional
+                with self.client.timings.phase('read'):
+                    self.old_storage_json = self.client.do('GET', url)
+                if not self._needs_to_apply_storage_configs():
+                    return
+            if self.update_mode == 'patch':
+                config = build_patch(self.diff)
+            else:
+                config = build_put(
+                    self.old_storage_json['metadata'], self.config,
+                    STORAGES_UPDATE_PARAMS, POOL_SERVER_KEYS
+                )
+            with self.client.timings.phase('write'):
+                self.client.do(
+                    self.update_mode.upper(), url, config,
+                    etag=self.client.etags.get(url, None)
+                )
+        self.actions.append('apply_storage_configs')
+        self.diffs.append(diff_to_result(self.diff, header=self._diff_header()))
+
+    def _delete_storage(self):
+        self.diffs.append(diff_to_result(
+            diff_absent(self.old_storage_json['metadata'], STORAGES_CONFIG_PARAMS),
+            header=self._diff_header()
+        ))
+        if not self.module.check_mode:
+            with self.client.timings.phase('write'):
+                self.client.do(
+                    'DELETE', '/1.0/storage-pools/{}'.format(self.name),
+                    wait_timeout=self.wait_timeout
+                )
+        self.actions.append('delete')
+
+    def _update_cache(self):
+        url = '/1.0/storage-pools/{0}'.format(self.name)
+        etag = self.client.etags.get(url, None)
+        if self.old_state == 'present' and not self.actions and etag is not None:
+            self.cache.store(self.url + url, etag, self._storage_digest())
+        else:
+            self.cache.forget(self.url + url)
+        self.cache.save()
+
+    def _state_changed(self):
+        if self.pools is None:
+            return len(self.actions) > 0
+        return any(len(actions) > 0 for actions in self.pools_actions.values())
+
+    def _diff_result(self):
+        if self.pools is not None:
+            return self.diffs
+        return merge_results(self.diffs)
+
+    def schema_items(self):
+        """Return the configs checked against the schema of the server.
+
+        Pools without a driver given are not checked.
+
+        :returns: List of (label, entity, config) tuples.
+        :rtype: ``list``
+        """
+        if self.pools is None:
+            pools = [(self.name, self.driver, self.state, self.config)]
+        else:
+            pools = [
+                (pool['name'], pool.get('driver', None), pool['state'], self._build_pool_config(pool))
+                for pool in self.pools
+            ]
+        return [
+            (name, 'storage-{0}'.format(driver), config.get('config', {}))
+            for name, driver, state, config in pools
+            if state == 'present' and driver is not None
+        ]
+
+    def reconcile(self):
+        """Reconcile the storage pools.
+
+        :returns: The module result without logs.
+        :rtype: ``dict``
+        """
+        timings = self.client.timings
+        if self.trust_password is not None:
+            with timings.phase('authenticate'):
+                self.client.authenticate(
+                    self.trust_password, self.module.params.get('auth_cache', None)
+                )
+        if self.module.params.get('validate_config', False):
+            check_configs(self.client, self.module.params, self.schema_items())
+
+        if self.pools is None:
+            with timings.phase('read'):
+                self.old_storage_json = self._get_storage_json()
+
+            self.old_state = self._storage_json_to_module_state(self.old_storage_json)
+            with timings.phase('diff'):
+                self._update_storage()
+            if self.cache is not None and not self.module.check_mode:
+                with timings.phase('cache'):
+                    self._update_cache()
+        else:
+            with timings.phase('read'):
+                self.old_storages_json = self._get_storages_json()
+
+            with timings.phase('diff'):
+                self._update_storages()
+            self.old_state = self.pools_old_state
+            self.actions = self.pools_actions
+
+        return {
+            'changed': self._state_changed(),
+            'old_state': self.old_state,
+            'actions': self.actions,
+            'diff': self._diff_result()
+        }
+
+    def fail_params(self, e):
+        """Return the module failure result of an exception without logs."""
+        return {
+            'msg': e.msg,
+            'changed': self._state_changed(),
+            'actions': self.actions if self.pools is None else self.pools_actions
+        }
+
+    def run(self):
+        """Run the main method."""
+
+        if self.pools is not None:
+            warn_item_connection(self.module, 'pools', self.pools)
+        try:
+            result_json = self.reconcile()
+            report_timings(self.module, self.client, result_json)
+            if self.client.debug:
+                result_json['logs'] = self.client.logs
+            self.module.exit_json(**result_json)
+        except LXDClientException as e:
+            fail_params = self.fail_params(e)
+            report_timings(self.module, self.client, fail_params)
+            if self.client.debug:
+                fail_params['logs'] = e.kwargs['logs']
+            self.module.fail_json(**fail_params)
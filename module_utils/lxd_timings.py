@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2024, Mikhail Shurutov <shurutov@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import contextlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+# TIMINGS_FORMATS is a list of supported export formats.
+TIMINGS_FORMATS = [
+    'json', 'prometheus'
+]
+
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return ','.join(
+        '{0}="{1}"'.format(k, _label_value(v)) for k, v in sorted(labels.items())
+    )
+
+
+class LXDTimings(object):
+    def __init__(self):
+        """Timings of a module run.
+
+        Phases are timed exclusively: the time spent in a nested phase is
+        not counted in the enclosing one, so phase durations add up to the
+        time spent in all phases. Phases must only be entered by the
+        thread which created the timings, requests may be recorded by any
+        thread.
+        """
+        self.started = time.time()
+        self.phases = {}
+        self.calls = []
+        self.retries = 0
+        self.backoff = 0.0
+        self.lock = threading.Lock()
+        self._stack = []
+
+    @property
+    def current_phase(self):
+        return self._stack[-1][0] if self._stack else None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time the enclosed block as the phase name."""
+        frame = [name, time.time(), 0.0]
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            elapsed = time.time() - frame[1]
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed - frame[2]
+            if self._stack:
+                self._stack[-1][2] += elapsed
+
+    def record(self, method, url, status, elapsed, bytes_sent, bytes_received):
+        """Record a request sent to the LXD server."""
+        with self.lock:
+            self.calls.append({
+                'method': method,
+                'url': url,
+                'status': status,
+                'phase': self.current_phase,
+                'elapsed': round(elapsed, 6),
+                'bytes_sent': bytes_sent,
+                'bytes_received': bytes_received
+            })
+
+    def record_retry(self, delay):
+        """Record a request retried after delay seconds of backoff."""
+        with self.lock:
+            self.retries += 1
+            self.backoff += delay
+
+    def retries_result(self):
+        """Return the retries of transient errors as returned by modules.
+
+        :rtype: ``dict``
+        """
+        with self.lock:
+            return {'count': self.retries, 'backoff': round(self.backoff, 6)}
+
+    def result(self):
+        """Return the timings as returned by modules.
+
+        :rtype: ``dict``
+        """
+        retries = self.retries_result()
+        with self.lock:
+            calls = list(self.calls)
+        return {
+            'total': round(time.time() - self.started, 6),
+            'phases': dict((k, round(v, 6)) for k, v in self.phases.items()),
+            'requests': {
+                'count': len(calls),
+                'elapsed': round(sum(c['elapsed'] for c in calls), 6),
+                'bytes_sent': sum(c['bytes_sent'] for c in calls),
+                'bytes_received': sum(c['bytes_received'] for c in calls)
+            },
+            'retries': retries,
+            'calls': calls
+        }
+
+    @staticmethod
+    def _prometheus(timings, labels):
+        lines = [
+            '# HELP lxd_module_duration_seconds Wall time of the LXD module run.',
+            '# TYPE lxd_module_duration_seconds gauge',
+            'lxd_module_duration_seconds{{{0}}} {1}'.format(_labels(**labels), timings['total']),
+            '# HELP lxd_module_phase_seconds Time spent in a phase of the LXD module run.',
+            '# TYPE lxd_module_phase_seconds gauge',
+        ]
+        for phase, elapsed in sorted(timings['phases'].items()):
+            lines.append('lxd_module_phase_seconds{{{0}}} {1}'.format(
+                _labels(phase=phase, **labels), elapsed))
+        methods = {}
+        for call in timings['calls']:
+            count, elapsed, sent, received = methods.get(call['method'], (0, 0.0, 0, 0))
+            methods[call['method']] = (
+                count + 1, elapsed + call['elapsed'],
+                sent + call['bytes_sent'], received + call['bytes_received']
+            )
+        metrics = [
+            ('lxd_module_requests', 'Requests sent to the LXD server.', 0),
+            ('lxd_module_request_seconds', 'Time spent waiting for LXD responses.', 1),
+            ('lxd_module_request_sent_bytes', 'Bytes of request bodies sent to LXD.', 2),
+            ('lxd_module_request_received_bytes', 'Bytes of response bodies received from LXD.', 3),
+        ]
+        for metric, help_text, index in metrics:
+            lines.append('# HELP {0} {1}'.format(metric, help_text))
+            lines.append('# TYPE {0} gauge'.format(metric))
+            for method, values in sorted(methods.items()):
+                value = values[index]
+                if isinstance(value, float):
+                    value = round(value, 6)
+                lines.append('{0}{{{1}}} {2}'.format(
+                    metric, _labels(method=method, **labels), value))
+        lines.extend([
+            '# HELP lxd_module_retries Requests retried after transient LXD errors.',
+            '# TYPE lxd_module_retries gauge',
+            'lxd_module_retries{{{0}}} {1}'.format(_labels(**labels), timings['retries']['count']),
+            '# HELP lxd_module_backoff_seconds Time spent backing off before retries.',
+            '# TYPE lxd_module_backoff_seconds gauge',
+            'lxd_module_backoff_seconds{{{0}}} {1}'.format(_labels(**labels), timings['retries']['backoff']),
+        ])
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path, fmt, labels):
+        """Export the timings to a file.
+
+        The json format appends one JSON line per module run. The
+        prometheus format replaces the file atomically with a textfile for
+        the node exporter textfile collector.
+
+        :param path: The file path.
+        :type path: ``str``
+        :param fmt: One of TIMINGS_FORMATS.
+        :type fmt: ``str``
+        :param labels: Labels identifying the module run, such as the
+            module name and the LXD server URL.
+        :type labels: ``dict``
+        """
+        timings = self.result()
+        dirname = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        if fmt == 'json':
+            entry = dict(labels, time=round(self.started, 6), **timings)
+            with open(path, 'a') as f:
+                f.write(json.dumps(entry, sort_keys=True) + '\n')
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.lxd_timings')
+        with os.fdopen(fd, 'w') as f:
+            f.write(self._prometheus(timings, labels))
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
+
+
+def report_retries(client, result_json):
+    """Add the retries of transient errors to a module result if any.
+
+    :param client: The client the module run used.
+    :type client: ``LXDClient``
+    :param result_json: The module result or failure parameters.
+    :type result_json: ``dict``
+    """
+    retries = client.timings.retries_result()
+    if retries['count'] > 0:
+        result_json['retries'] = retries
+
+
+def report_timings(module, client, result_json):
+    """Add the timings and retries of the client to a module result and
+    export the timings.
+
+    :param module: Processed Ansible Module with the optional timings,
+        timings_format and timings_path options.
+    :type module: ``object``
+    :param client: The client the module run used.
+    :type client: ``LXDClient``
+    :param result_json: The module result or failure parameters.
+    :type result_json: ``dict``
+    """
+    params = module.params
+    report_retries(client, result_json)
+    if params.get('timings', False):
+        result_json['timings'] = client.timings.result()
+    if params.get('timings_path', None) is not None:
+        labels = {'module': getattr(module, '_name', 'lxd'), 'url': client.url}
+        try:
+            client.timings.export(
+                params['timings_path'], params.get('timings_format', None) or 'json', labels
+            )
+        except (IOError, OSError) as e:
+            module.warn('cannot export timings to {0}: {1}'.format(params['timings_path'], e))
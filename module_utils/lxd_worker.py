@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2024, Mikhail Shurutov <shurutov@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import hashlib
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+
+from ansible.module_utils.common.text.converters import to_bytes, to_text
+from ansible.module_utils.lxd_client import LXDClient, LXDClientException, request_limiter, request_log
+from ansible.module_utils.lxd_config_engine import LXDConfig
+from ansible.module_utils.lxd_converge_engine import LXDConverge
+from ansible.module_utils.lxd_network_engine import LXDNetworkManagement
+from ansible.module_utils.lxd_profile_engine import LXDProfileManagement, LXDProjectManagement
+from ansible.module_utils.lxd_storage_engine import LXDStorageManagement
+
+# WORKER_CODE_PREFIX is the prefix of the modules whose sources make the
+# code digest of the worker. A worker getting a request of a module
+# shipped with other sources retires, and the module starts a worker
+# running its own code.
+WORKER_CODE_PREFIX = 'ansible.module_utils.lxd_'
+
+# WORKER_KINDS maps the kinds of module runs the worker serves to their
+# reconciler classes.
+WORKER_KINDS = {
+    'config': LXDConfig,
+    'converge': LXDConverge,
+    'networks': LXDNetworkManagement,
+    'pools': LXDStorageManagement,
+    'profiles': LXDProfileManagement,
+    'projects': LXDProjectManagement
+}
+
+# WORKER_START_TIMEOUT is the number of seconds a module waits for the
+# worker it started to listen.
+WORKER_START_TIMEOUT = 5
+
+# WORKER_POLL_INTERVAL is the number of seconds between two checks of
+# the idle timeout and of the socket file by the worker.
+WORKER_POLL_INTERVAL = 1
+
+
+class LXDWorkerExit(Exception):
+    def __init__(self, failed, result):
+        self.failed = failed
+        self.result = result
+
+
+class LXDWorkerModule(object):
+    def __init__(self, request):
+        """Ansible module as seen by a reconciler run by the worker.
+
+        :param request: The request sent by the module.
+        :type request: ``dict``
+        """
+        self.params = request['params']
+        self.check_mode = request['check_mode']
+        self._name = request['name']
+        self._verbosity = request['verbosity']
+        self.warnings = []
+
+    def warn(self, warning):
+        self.warnings.append(warning)
+
+    def exit_json(self, **kwargs):
+        raise LXDWorkerExit(False, kwargs)
+
+    def fail_json(self, **kwargs):
+        raise LXDWorkerExit(True, kwargs)
+
+
+class LXDWorker(object):
+    def __init__(self, path, idle_timeout):
+        """Worker running module requests with warm LXD clients.
+
+        Clients are kept per LXD server and client certificate, with their
+        connection, TLS session and server metadata. Clients of one server
+        share the limiter of the first request to it, so concurrent module
+        runs together stay under its max_requests. Every request gets a new
+        reconciler, so nothing else is kept between requests.
+
+        :param path: Path of the unix domain socket listened on.
+        :type path: ``str``
+        :param idle_timeout: Seconds without requests the worker exits after.
+        :type idle_timeout: ``int``
+        """
+        self.path = path
+        self.idle_timeout = idle_timeout
+        self.clients = {}
+        self.limiters = {}
+        self.lock = threading.Lock()
+        self.active = 0
+        self.last_active = time.time()
+        self.retired = False
+        self.inode = None
+        self.threads = []
+        # The worker is forked from the module which started it, so this
+        # is the digest of the code it runs
+        self.code = code_digest()
+
+    def _take_client(self, params, debug):
+        key = (params['url'], params.get('client_cert', None), params.get('client_key', None))
+        log = request_log(params, debug)
+        retry_timeout = params.get('retry_timeout', None)
+        with self.lock:
+            idle = self.clients.get(key, None)
+            client = idle.pop() if idle else None
+            limiter = self.limiters.setdefault(params['url'], request_limiter(params))
+        if client is None:
+            client = LXDClient(
+                params['url'], key_file=params.get('client_key', None),
+                cert_file=params.get('client_cert', None), debug=debug, log=log,
+                limiter=limiter, retry_timeout=retry_timeout
+            )
+        else:
+            client.reset(debug=debug, log=log, retry_timeout=retry_timeout)
+        return key, client
+
+    def _release_client(self, key, client):
+        if client.log is not None:
+            client.log.close()
+        with self.lock:
+            self.clients.setdefault(key, []).append(client)
+
+    def handle(self, request):
+        """Run the reconciler of one request.
+
+        :param request: The request sent by the module.
+        :type request: ``dict``
+        :returns: The response, with the module result and whether it failed.
+        :rtype: ``dict``
+        """
+        if request.get('code', None) != self.code or request.get('kind', None) not in WORKER_KINDS:
+            self._retire()
+            return {'code': self.code, 'unsupported': True}
+        module = LXDWorkerModule(request)
+        debug = module._verbosity >= 4
+        try:
+            key, client = self._take_client(module.params, debug)
+        except LXDClientException as e:
+            return {'failed': True, 'result': {'msg': e.msg}, 'warnings': []}
+        try:
+            WORKER_KINDS[request['kind']](module, client=client).run()
+            failed, result = True, {'msg': 'the reconciler returned without a result'}
+        except LXDWorkerExit as e:
+            failed, result = e.failed, e.result
+        finally:
+            self._release_client(key, client)
+        return {'failed': failed, 'result': result, 'warnings': module.warnings}
+
+    def _serve_connection(self, conn):
+        try:
+            conn.settimeout(None)
+            stream = conn.makefile('rwb')
+            line = stream.readline()
+            if line:
+                try:
+                    response = self.handle(json.loads(to_text(line, errors='surrogate_or_strict')))
+                except Exception:
+                    # The worker outlives a failing request
+                    response = {
+                        'failed': True,
+                        'result': {'msg': 'LXD worker error', 'exception': traceback.format_exc()},
+                        'warnings': []
+                    }
+                stream.write(to_bytes(json.dumps(response)) + b'\n')
+                stream.flush()
+            stream.close()
+        except (IOError, OSError, socket.error):
+            # The module went away, it fails on its own
+            pass
+        finally:
+            conn.close()
+            with self.lock:
+                self.active -= 1
+                self.last_active = time.time()
+
+    def _start(self, conn):
+        with self.lock:
+            self.active += 1
+        thread = threading.Thread(target=self._serve_connection, args=(conn,))
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+
+    def _owns_socket(self):
+        try:
+            return os.stat(self.path).st_ino == self.inode
+        except OSError:
+            return False
+
+    def _retire(self):
+        """Stop taking connections, the socket file is removed at once so
+        the module refused can start a new worker on it."""
+        with self.lock:
+            if not self.retired and self._owns_socket():
+                os.unlink(self.path)
+            self.retired = True
+
+    def _serving(self):
+        """Return whether new connections are accepted.
+
+        The socket file is removed once the worker retires or is idle, so
+        modules start a new worker, and connections already queued are
+        still served. A worker whose socket file was removed or replaced
+        exits as well.
+        """
+        if not self._owns_socket():
+            return False
+        with self.lock:
+            idle = self.active == 0 and time.time() - self.last_active >= self.idle_timeout
+        if self.retired or idle:
+            os.unlink(self.path)
+            return False
+        return True
+
+    def serve(self):
+        """Listen on the socket until the worker is idle for idle_timeout."""
+        probe = connect_worker(self.path)
+        if probe is not None:
+            # Another worker is already listening
+            probe.close()
+            return
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname, 0o700)
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o077)
+        try:
+            sock.bind(self.path)
+        finally:
+            os.umask(old_umask)
+        self.inode = os.stat(self.path).st_ino
+        sock.listen(64)
+        sock.settimeout(WORKER_POLL_INTERVAL)
+        while True:
+            try:
+                conn, dummy = sock.accept()
+            except socket.timeout:
+                if not self._serving():
+                    break
+                continue
+            self._start(conn)
+        sock.setblocking(False)
+        while True:
+            try:
+                conn, dummy = sock.accept()
+            except socket.error:
+                break
+            self._start(conn)
+        sock.close()
+        for thread in self.threads:
+            thread.join()
+        for clients in self.clients.values():
+            for client in clients:
+                client.close()
+
+
+def code_digest():
+    """Return the digest of the sources of the module_utils the worker runs.
+
+    They are the modules lxd_worker imports, directly or through other
+    ones, read by the loader they were imported with, so the zip Ansible
+    shipped them in.
+
+    :rtype: ``str``
+    """
+    names = set()
+    pending = [__name__]
+    while pending:
+        name = pending.pop()
+        if name in names or not name.startswith(WORKER_CODE_PREFIX) or name not in sys.modules:
+            continue
+        names.add(name)
+        for value in list(vars(sys.modules[name]).values()):
+            pending.append(getattr(value, '__module__', None) or '')
+    digest = hashlib.sha256()
+    for name in sorted(names):
+        module = sys.modules[name]
+        digest.update(to_bytes(name) + b'\n')
+        digest.update(to_bytes(module.__loader__.get_source(name) or '') + b'\n')
+    return digest.hexdigest()
+
+
+def connect_worker(path):
+    """Return a socket connected to the worker, None if none listens."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        sock.close()
+        return None
+    return sock
+
+
+def start_worker(path, idle_timeout):
+    """Start a worker daemon detached from the module process.
+
+    The worker is forked from the module, so it runs the module_utils the
+    module has already imported, even after Ansible removed them from the
+    host.
+    """
+    pid = os.fork()
+    if pid:
+        os.waitpid(pid, 0)
+        return
+    try:
+        os.setsid()
+        if os.fork():
+            os._exit(0)
+        os.chdir('/')
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+        LXDWorker(path, idle_timeout).serve()
+    finally:
+        os._exit(0)
+
+
+def _ask_worker(module, request):
+    """Send a request to the worker, which is started if none listens.
+
+    :returns: The response, None if no worker can be started.
+    :rtype: ``dict``
+    """
+    path = module.params['worker_socket']
+    sock = connect_worker(path)
+    if sock is None:
+        start_worker(path, module.params['worker_idle_timeout'])
+        deadline = time.time() + WORKER_START_TIMEOUT
+        while sock is None and time.time() < deadline:
+            time.sleep(0.05)
+            sock = connect_worker(path)
+        if sock is None:
+            module.warn('cannot start the LXD worker on {0}, running without it'.format(path))
+            return None
+    try:
+        stream = sock.makefile('rwb')
+        stream.write(to_bytes(json.dumps(request)) + b'\n')
+        stream.flush()
+        line = stream.readline()
+        stream.close()
+    except (IOError, OSError, socket.error) as e:
+        module.fail_json(msg='lost the connection to the LXD worker on {0}: {1}'.format(path, e))
+    finally:
+        sock.close()
+    if not line:
+        module.fail_json(msg='the LXD worker on {0} closed the connection'.format(path))
+    return json.loads(to_text(line, errors='surrogate_or_strict'))
+
+
+def run_in_worker(module, kind):
+    """Hand the module run to the worker listening on worker_socket.
+
+    A worker is started if none listens. A worker running other code than
+    the module, e.g. after the role was updated, retires and a new one is
+    started. The module exits with the result of the worker, unless no
+    worker can be reached or the worker does not serve the request, then
+    this returns and the module runs on its own.
+
+    :param module: Processed Ansible Module with the worker_socket and
+        worker_idle_timeout options.
+    :type module: ``object``
+    :param kind: One of WORKER_KINDS.
+    :type kind: ``str``
+    """
+    request = {
+        'code': code_digest(),
+        'kind': kind,
+        'name': module._name,
+        'params': module.params,
+        'check_mode': module.check_mode,
+        'verbosity': module._verbosity
+    }
+    response = _ask_worker(module, request)
+    if response is not None and response.get('unsupported', False):
+        # The worker retired, the one started now runs the code of the module
+        response = _ask_worker(module, request)
+    if response is None or response.get('unsupported', False):
+        return
+    for warning in response['warnings']:
+        module.warn(warning)
+    if response['failed']:
+        module.fail_json(**response['result'])
+    module.exit_json(**response['result'])
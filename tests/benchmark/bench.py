@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2024, Mikhail Shurutov <shurutov@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Benchmark of the LXD modules of the role against a stand-in daemon.
+
+Every module is run by ansible with 1, 100 and 1000 objects against the
+daemon of fake_lxd.py in three scenarios: create the objects on an empty
+server, update all of them and run again without changes. The wall time
+of ansible, the time reported in the timings of the module, the number of
+requests and the bytes transferred are recorded per run.
+
+    python3 tests/benchmark/bench.py --latency 0.001 --output baseline.json
+    python3 tests/benchmark/bench.py --latency 0.001 --compare baseline.json
+
+With --compare the exit code is 1 if a run sends more requests than in
+the baseline or gets slower by more than --tolerance.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import fake_lxd
+
+# ROLE_DIR is the root of the role the modules are taken from.
+ROLE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# BENCH_MODULES is a list of benchmarked modules.
+BENCH_MODULES = [
+    'lxd_config', 'lxd_storage', 'lxd_network'
+]
+
+# BENCH_SIZES is the default list of numbers of objects.
+BENCH_SIZES = [
+    1, 100, 1000
+]
+
+# BENCH_SCENARIOS is a list of scenarios run in order per module and size.
+BENCH_SCENARIOS = [
+    'create', 'update', 'noop'
+]
+
+# MIN_REGRESSION is the slowdown in seconds ignored as noise.
+MIN_REGRESSION = 0.05
+
+
+def module_args(module, size, scenario):
+    """Return the arguments converging size objects in a scenario.
+
+    :rtype: ``dict``
+    """
+    value = '2' if scenario in ('update', 'noop') else '1'
+    if module == 'lxd_config':
+        return {'config': dict(('user.bench{0:04d}'.format(i), value) for i in range(size))}
+    if module == 'lxd_storage':
+        return {'pools': [
+            {'name': 'pool{0:04d}'.format(i), 'driver': 'dir', 'config': {'rsync.bwlimit': value}}
+            for i in range(size)
+        ]}
+    return {'networks': [
+        {
+            'name': 'br{0:04d}'.format(i),
+            'type': 'bridge',
+            'config': {
+                'ipv4.address': '10.{0}.{1}.1/24'.format(i // 256, i % 256),
+                'user.bench': value
+            }
+        }
+        for i in range(size)
+    ]}
+
+
+def run_module(module, args, socket_path):
+    """Run a module by ansible against the stand-in daemon.
+
+    :returns: Tuple of the module result and the wall time in seconds.
+    :rtype: ``tuple``
+    """
+    args = dict(args, url='unix:{0}'.format(socket_path), timings=True)
+    env = dict(
+        os.environ,
+        ANSIBLE_LIBRARY=os.path.join(ROLE_DIR, 'library'),
+        ANSIBLE_MODULE_UTILS=os.path.join(ROLE_DIR, 'module_utils'),
+        ANSIBLE_CALLBACK_RESULT_FORMAT='json',
+        ANSIBLE_NOCOLOR='1',
+        ANSIBLE_LOCALHOST_WARNING='0',
+        ANSIBLE_INVENTORY_UNPARSED_WARNING='0'
+    )
+    cmd = [
+        'ansible', 'localhost', '-m', module, '-a', json.dumps(args),
+        '-e', 'ansible_python_interpreter={0}'.format(sys.executable)
+    ]
+    started = time.time()
+    proc = subprocess.run(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    wall = time.time() - started
+    output = proc.stdout.decode('utf-8')
+    try:
+        # The ad hoc output is "localhost | CHANGED => {...}"
+        result = json.loads(output[output.index('=>') + 2:])
+    except ValueError:
+        raise RuntimeError('{0} failed: {1}{2}'.format(
+            module, output, proc.stderr.decode('utf-8')))
+    if proc.returncode != 0 or result.get('failed', False):
+        raise RuntimeError('{0} failed: {1}'.format(module, result.get('msg', result)))
+    return result, wall
+
+
+def bench(modules, sizes, latency, op_duration):
+    """Run all scenarios of modules for every size.
+
+    :returns: List of the measures of every run.
+    :rtype: ``list``
+    """
+    measures = []
+    socket_dir = tempfile.mkdtemp(prefix='lxd-bench')
+    socket_path = os.path.join(socket_dir, 'unix.socket')
+    try:
+        for module in modules:
+            for size in sizes:
+                server = fake_lxd.serve(socket_path, latency=latency, op_duration=op_duration)
+                try:
+                    for scenario in BENCH_SCENARIOS:
+                        server.state.reset_counters()
+                        result, wall = run_module(module, module_args(module, size, scenario), socket_path)
+                        measure = dict(
+                            server.state.counters(),
+                            module=module,
+                            objects=size,
+                            scenario=scenario,
+                            changed=result['changed'],
+                            wall=round(wall, 6),
+                            seconds=result['timings']['total'],
+                            phases=result['timings']['phases']
+                        )
+                        measures.append(measure)
+                        print_measure(measure)
+                finally:
+                    server.shutdown()
+                    server.server_close()
+    finally:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        os.rmdir(socket_dir)
+    return measures
+
+
+def print_measure(measure, baseline=None):
+    line = '{module:<12} {objects:>5} {scenario:<7} {wall:>9.3f} {seconds:>9.3f} {requests:>6} {bytes_received:>10} {bytes_sent:>10}'.format(**measure)
+    if baseline is not None:
+        line += '  {0:+.3f}s {1:+d} requests'.format(
+            measure['seconds'] - baseline['seconds'], measure['requests'] - baseline['requests'])
+    print(line)
+    sys.stdout.flush()
+
+
+def compare(measures, baseline, tolerance):
+    """Compare measures with a baseline.
+
+    :returns: List of regressions found.
+    :rtype: ``list``
+    """
+    known = dict(
+        ((m['module'], m['objects'], m['scenario']), m) for m in baseline
+    )
+    regressions = []
+    for measure in measures:
+        key = (measure['module'], measure['objects'], measure['scenario'])
+        base = known.get(key, None)
+        if base is None:
+            continue
+        print_measure(measure, base)
+        if measure['requests'] > base['requests']:
+            regressions.append('{0} {1} {2}: {3} requests instead of {4}'.format(
+                key[0], key[1], key[2], measure['requests'], base['requests']))
+        slower = measure['seconds'] - base['seconds']
+        if slower > MIN_REGRESSION and slower > base['seconds'] * tolerance:
+            regressions.append('{0} {1} {2}: {3:.3f}s instead of {4:.3f}s'.format(
+                key[0], key[1], key[2], measure['seconds'], base['seconds']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modules', default=','.join(BENCH_MODULES),
+                        help='comma separated modules to run')
+    parser.add_argument('--sizes', default=','.join(str(s) for s in BENCH_SIZES),
+                        help='comma separated numbers of objects')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds every request is delayed by the daemon')
+    parser.add_argument('--op-duration', type=float, default=0.0,
+                        help='seconds an operation of the daemon runs for')
+    parser.add_argument('--output', help='file the measures are written to')
+    parser.add_argument('--compare', help='file of measures to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slowdown as a fraction of the baseline')
+    args = parser.parse_args()
+
+    print('{0:<12} {1:>5} {2:<7} {3:>9} {4:>9} {5:>6} {6:>10} {7:>10}'.format(
+        'module', 'objs', 'run', 'wall s', 'module s', 'reqs', 'bytes in', 'bytes out'))
+    measures = bench(
+        [m for m in args.modules.split(',') if m],
+        [int(s) for s in args.sizes.split(',') if s],
+        args.latency, args.op_duration
+    )
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(measures, f, indent=2, sort_keys=True)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            regressions = compare(measures, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION {0}'.format(regression))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
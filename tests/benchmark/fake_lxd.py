@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2024, Mikhail Shurutov <shurutov@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Stand-in LXD daemon serving the REST API on a unix socket.
+
+Only what lxd_config, lxd_storage and lxd_network use is implemented:
+/1.0, /1.0/certificates, /1.0/storage-pools, /1.0/networks and
+/1.0/operations. Objects are kept in memory and every request is counted
+with its body sizes.
+
+Run it standalone with
+
+    python3 fake_lxd.py /tmp/lxd.socket --latency 0.005
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import socketserver
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler
+
+# COLLECTIONS is a list of object collections served under /1.0.
+COLLECTIONS = [
+    'networks', 'storage-pools'
+]
+
+
+def _etag(obj):
+    return hashlib.sha256(json.dumps(obj, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _sync(metadata, code=200):
+    return code, {
+        'type': 'sync', 'status': 'Success', 'status_code': 200,
+        'operation': '', 'error_code': 0, 'error': '', 'metadata': metadata
+    }
+
+
+def _error(msg, code):
+    return code, {
+        'type': 'error', 'status': '', 'status_code': 0,
+        'operation': '', 'error_code': code, 'error': msg, 'metadata': None
+    }
+
+
+class FakeLXDState(object):
+    def __init__(self, latency=0.0, op_duration=0.0, async_create=False):
+        """State of the stand-in daemon.
+
+        :param latency: Seconds every request is delayed by.
+        :type latency: ``float``
+        :param op_duration: Seconds an operation runs for.
+        :type op_duration: ``float``
+        :param async_create: Whether objects are created by operations.
+        :type async_create: ``bool``
+        """
+        self.latency = latency
+        self.op_duration = op_duration
+        self.async_create = async_create
+        self.lock = threading.Lock()
+        self.server = {
+            'api_version': '1.0',
+            'auth': 'trusted',
+            'config': {},
+            'environment': {'server_version': '5.21'}
+        }
+        self.collections = dict((name, {}) for name in COLLECTIONS)
+        self.operations = {}
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.requests = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.methods = {}
+
+    def counters(self):
+        """Return the requests counted since the last reset.
+
+        :rtype: ``dict``
+        """
+        return {
+            'requests': self.requests,
+            'bytes_received': self.bytes_received,
+            'bytes_sent': self.bytes_sent,
+            'methods': dict(self.methods)
+        }
+
+    def operation(self, description):
+        op_id = str(uuid.uuid4())
+        self.operations[op_id] = {
+            'id': op_id,
+            'description': description,
+            'status': 'Running',
+            'status_code': 103,
+            'err': '',
+            'done_at': time.time() + self.op_duration
+        }
+        return 202, {
+            'type': 'async', 'status': 'Operation created', 'status_code': 100,
+            'operation': '/1.0/operations/{0}'.format(op_id),
+            'metadata': self.operations[op_id]
+        }
+
+
+class FakeLXDHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _handle(self):
+        state = self.server.state
+        length = int(self.headers.get('Content-Length') or 0)
+        data = self.rfile.read(length) if length else b''
+        body = json.loads(data.decode('utf-8')) if data else None
+        if state.latency:
+            time.sleep(state.latency)
+        path, dummy, query = self.path.partition('?')
+        with state.lock:
+            code, resp_json, etag = self._route(state, self.command, path, query, body)
+            out = json.dumps(resp_json).encode('utf-8')
+            state.requests += 1
+            state.bytes_received += len(data)
+            state.bytes_sent += len(out)
+            state.methods[self.command] = state.methods.get(self.command, 0) + 1
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(out)))
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(out)
+
+    do_DELETE = do_GET = do_PATCH = do_POST = do_PUT = _handle
+
+    def _route(self, state, method, path, query, body):
+        if path == '/1.0':
+            return self._server(state, method, body)
+        if path == '/1.0/certificates' and method == 'POST':
+            state.server['auth'] = 'trusted'
+            return _sync({}) + (None,)
+        m = re.match(r'^/1\.0/operations/([^/]+)(/wait)?$', path)
+        if m:
+            return self._operation(state, m.group(1), m.group(2) is not None, query)
+        m = re.match(r'^/1\.0/([a-z-]+)$', path)
+        if m and m.group(1) in state.collections:
+            return self._collection(state, m.group(1), method, query, body)
+        m = re.match(r'^/1\.0/([a-z-]+)/([^/]+)$', path)
+        if m and m.group(1) in state.collections:
+            return self._object(state, m.group(1), m.group(2), method, body)
+        return _error('not found', 404) + (None,)
+
+    def _server(self, state, method, body):
+        if method == 'GET':
+            return _sync(state.server) + (_etag(state.server['config']),)
+        if method == 'PUT':
+            state.server['config'] = dict(body.get('config', None) or {})
+        elif method == 'PATCH':
+            config = dict(state.server['config'], **(body.get('config', None) or {}))
+            state.server['config'] = dict((k, v) for k, v in config.items() if v != '')
+        else:
+            return _error('not allowed', 405) + (None,)
+        return _sync({}) + (None,)
+
+    def _operation(self, state, op_id, wait, query):
+        op = state.operations.get(op_id, None)
+        if op is None:
+            return _error('not found', 404) + (None,)
+        if wait:
+            m = re.search(r'timeout=(-?\d+)', query)
+            limit = int(m.group(1)) if m else -1
+            delay = max(0.0, op['done_at'] - time.time())
+            if limit >= 0:
+                delay = min(delay, limit)
+            # Other requests are served while the operation is awaited
+            state.lock.release()
+            try:
+                time.sleep(delay)
+            finally:
+                state.lock.acquire()
+        if time.time() >= op['done_at']:
+            op.update(status='Success', status_code=200)
+        return _sync(op) + (None,)
+
+    def _collection(self, state, kind, method, query, body):
+        objects = state.collections[kind]
+        if method == 'GET':
+            if 'recursion=1' in query:
+                return _sync(list(objects.values())) + (None,)
+            return _sync(['/1.0/{0}/{1}'.format(kind, name) for name in objects]) + (None,)
+        if method != 'POST':
+            return _error('not allowed', 405) + (None,)
+        name = body['name']
+        if name in objects:
+            return _error('{0} already exists'.format(name), 409) + (None,)
+        obj = dict(body)
+        obj['config'] = dict(obj.get('config', None) or {})
+        obj.setdefault('description', '')
+        if kind == 'storage-pools':
+            obj['config'].setdefault('source', '/var/lib/lxd/storage-pools/{0}'.format(name))
+            obj['status'] = 'Created'
+        else:
+            obj.setdefault('type', 'bridge')
+            obj['managed'] = True
+        objects[name] = obj
+        if state.async_create:
+            return state.operation('Creating {0}'.format(name)) + (None,)
+        return _sync({}, 201) + (None,)
+
+    def _object(self, state, kind, name, method, body):
+        objects = state.collections[kind]
+        obj = objects.get(name, None)
+        if obj is None:
+            return _error('not found', 404) + (None,)
+        etag = _etag(obj)
+        if_match = self.headers.get('If-Match', None)
+        if method in ('PUT', 'PATCH') and if_match is not None and if_match != etag:
+            return _error("ETag doesn't match", 412) + (None,)
+        if method == 'GET':
+            return _sync(obj) + (etag,)
+        if method == 'DELETE':
+            del objects[name]
+        elif method == 'POST':
+            obj['name'] = body['name']
+            objects[body['name']] = objects.pop(name)
+        elif method == 'PUT':
+            obj['config'] = dict(body.get('config', None) or {})
+            obj['description'] = body.get('description', '')
+        elif method == 'PATCH':
+            obj['config'].update(body.get('config', None) or {})
+            if 'description' in body:
+                obj['description'] = body['description']
+        return _sync({}) + (None,)
+
+
+class FakeLXDServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(path, **kwargs):
+    """Serve a stand-in LXD daemon on a unix socket in a thread.
+
+    :param path: The unix domain socket path.
+    :type path: ``str``
+    :returns: The server, its state is in the state attribute.
+    :rtype: ``FakeLXDServer``
+    """
+    if os.path.exists(path):
+        os.unlink(path)
+    server = FakeLXDServer(path, FakeLXDHandler)
+    server.state = FakeLXDState(**kwargs)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('socket', help='the unix domain socket path')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds every request is delayed by')
+    parser.add_argument('--op-duration', type=float, default=0.0,
+                        help='seconds an operation runs for')
+    parser.add_argument('--async-create', action='store_true',
+                        help='create objects by operations')
+    args = parser.parse_args()
+    server = serve(
+        args.socket, latency=args.latency, op_duration=args.op_duration,
+        async_create=args.async_create
+    )
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
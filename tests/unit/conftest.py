@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2024, Mikhail Shurutov <shurutov@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Import the module_utils of the role the way Ansible ships them.
+
+The LXD module_utils import each other as ansible.module_utils.<name>, so
+the module_utils directory of the role is added to that package.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+
+import ansible.module_utils
+
+# MODULE_UTILS_DIR is the module_utils directory of the role.
+MODULE_UTILS_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'module_utils')
+
+if MODULE_UTILS_DIR not in ansible.module_utils.__path__:
+    ansible.module_utils.__path__.append(MODULE_UTILS_DIR)
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2024, Mikhail Shurutov <shurutov@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Tests of the domain XML comparison of libvirt_domains.
+
+    python3 -m pytest tests/unit
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import sys
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'module_utils'))
+
+from libvirt_domain import build_domain, canonicalize, domain_differs  # noqa: E402
+
+
+def _disk(dev):
+    return {'name': 'disk', 'attrs': {'type': 'file', 'device': 'disk'}, 'parameters': [
+        {'name': 'source', 'attrs': {'file': '/var/lib/libvirt/images/{0}.qcow2'.format(dev)}},
+        {'name': 'target', 'attrs': {'dev': dev, 'bus': 'virtio'}}
+    ]}
+
+
+def _vm(devices):
+    return {
+        'general': [{'name': 'name', 'value': 'vm1'}, {'name': 'memory', 'value': 1024, 'attrs': {'unit': 'MiB'}}],
+        'devices': devices
+    }
+
+
+def _defined(xml):
+    """Return a domain as libvirt reports it, in canonical form."""
+    return canonicalize(ET.fromstring(xml))
+
+
+def test_equal_domain_does_not_differ():
+    actual = _defined(
+        '<domain type="kvm" id="3"><name>vm1</name><uuid>8c1d</uuid>'
+        '<memory unit="KiB">1048576</memory><devices>'
+        '<controller type="pci" index="0" model="pcie-root"/>'
+        '<disk type="file" device="disk"><driver name="qemu" type="qcow2"/>'
+        '<source file="/var/lib/libvirt/images/vda.qcow2"/><target dev="vda" bus="virtio"/></disk>'
+        '<input type="mouse" bus="ps2"/></devices></domain>'
+    )
+    assert not domain_differs(canonicalize(build_domain(_vm([_disk('vda')]))), actual)
+
+
+def test_removed_device_differs():
+    actual = _defined(
+        '<domain type="kvm"><name>vm1</name><memory unit="KiB">1048576</memory><devices>'
+        '<disk type="file" device="disk">'
+        '<source file="/var/lib/libvirt/images/vda.qcow2"/><target dev="vda" bus="virtio"/></disk>'
+        '<disk type="file" device="disk">'
+        '<source file="/var/lib/libvirt/images/vdb.qcow2"/><target dev="vdb" bus="virtio"/></disk>'
+        '</devices></domain>'
+    )
+    assert domain_differs(canonicalize(build_domain(_vm([_disk('vda')]))), actual)
+
+
+def test_removed_device_tag_differs():
+    actual = _defined(
+        '<domain type="kvm"><name>vm1</name><memory unit="KiB">1048576</memory><devices>'
+        '<emulator>/usr/bin/qemu-system-x86_64</emulator>'
+        '<disk type="file" device="disk">'
+        '<source file="/var/lib/libvirt/images/vda.qcow2"/><target dev="vda" bus="virtio"/></disk>'
+        '<interface type="network"><source network="default"/><model type="virtio"/></interface>'
+        '<hostdev mode="subsystem" type="pci"><source><address bus="0x01" slot="0x00"/></source></hostdev>'
+        '<memballoon model="virtio"/></devices></domain>'
+    )
+    assert domain_differs(canonicalize(build_domain(_vm([_disk('vda')]))), actual)
+    for tag in ('interface', 'hostdev'):
+        actual.find('devices').remove(actual.find('devices').find(tag))
+    assert not domain_differs(canonicalize(build_domain(_vm([_disk('vda')]))), actual)
+
+
+def _tuned_vm(tuning):
+    return dict(_vm([]), general=[
+        {'name': 'name', 'value': 'vm1'}, {'name': 'vcpu', 'value': 4},
+        {'name': 'memory', 'value': 1024, 'attrs': {'unit': 'MiB'}}
+    ], tuning=tuning)
+
+
+def test_hugepage_size_is_compared_in_kib():
+    desired = build_domain(_tuned_vm({'hugepages': {'size': 2, 'unit': 'M', 'nodeset': '0'}}))
+    actual = _defined(
+        '<domain type="kvm"><name>vm1</name><vcpu>4</vcpu><memory unit="KiB">1048576</memory>'
+        '<memoryBacking><hugepages><page size="2048" unit="KiB" nodeset="0"/></hugepages></memoryBacking>'
+        '</domain>'
+    )
+    assert not domain_differs(canonicalize(desired), actual)
+    desired = build_domain(_tuned_vm({'hugepages': {'size': 1, 'unit': 'G', 'nodeset': '0'}}))
+    assert domain_differs(canonicalize(desired), actual)
+
+
+def test_cpusets_are_compared_as_ranges():
+    desired = build_domain(_tuned_vm({
+        'vcpupin': {0: '2,0,1', 1: '0-3,^3'}, 'emulatorpin': '4,^5,5-6',
+        'numatune': {'nodeset': '1,0'}
+    }))
+    actual = _defined(
+        '<domain type="kvm"><name>vm1</name><vcpu>4</vcpu><memory unit="KiB">1048576</memory>'
+        '<cputune><vcpupin vcpu="0" cpuset="0-2"/><vcpupin vcpu="1" cpuset="0-2"/>'
+        '<emulatorpin cpuset="4,6"/></cputune>'
+        '<numatune><memory mode="strict" nodeset="0-1"/></numatune></domain>'
+    )
+    assert not domain_differs(canonicalize(desired), actual)
+    desired = build_domain(_tuned_vm({'vcpupin': {0: '0,2'}}))
+    assert domain_differs(canonicalize(desired), actual)
+
+
+def test_removed_tuning_differs():
+    actual = _defined(
+        '<domain type="kvm"><name>vm1</name><vcpu>4</vcpu><memory unit="KiB">1048576</memory>'
+        '<iothreads>2</iothreads>'
+        '<memoryBacking><hugepages><page size="2048" unit="KiB" nodeset="0"/></hugepages></memoryBacking>'
+        '<cputune><vcpupin vcpu="0" cpuset="0-2"/><emulatorpin cpuset="4"/></cputune>'
+        '</domain>'
+    )
+    tuning = {
+        'iothreads': 2, 'hugepages': {'size': 2, 'unit': 'M', 'nodeset': '0'},
+        'vcpupin': {0: '0-2'}, 'emulatorpin': '4'
+    }
+    assert not domain_differs(canonicalize(build_domain(_tuned_vm(tuning))), actual)
+    assert domain_differs(canonicalize(build_domain(_tuned_vm({}))), actual)
+    for key in tuning:
+        kept = dict((k, v) for k, v in tuning.items() if k != key)
+        assert domain_differs(canonicalize(build_domain(_tuned_vm(kept))), actual), key
+    hugepages = dict(tuning, hugepages={})
+    assert domain_differs(canonicalize(build_domain(_tuned_vm(hugepages))), actual)
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2024, Mikhail Shurutov <shurutov@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Tests of the retries and the authentication of the LXD client.
+
+    python3 -m pytest tests/unit
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import errno
+import json
+import socket
+
+import pytest
+
+from ansible.module_utils import lxd_client
+from ansible.module_utils.lxd_cache import LXDAuthCache
+from ansible.module_utils.lxd_client import (
+    LXDClient, LXDClientException, LXDTransientException, LXDUntrustedException
+)
+
+URL = 'unix:/var/lib/lxd/unix.socket'
+
+
+def sync(metadata=None):
+    return 200, {'type': 'sync', 'status': 'Success', 'status_code': 200, 'metadata': metadata}
+
+
+def error(code, msg):
+    return code, {'type': 'error', 'error': msg, 'error_code': code, 'metadata': None}
+
+
+class StubResponse(object):
+    def __init__(self, status, headers=None):
+        self.status = status
+        self.headers = headers or {}
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
+
+
+class StubClient(LXDClient):
+    """A client answering requests from a script instead of a server.
+
+    Each answer is a (status, body) tuple, a body which is not a dict is
+    sent as is, an exception is raised by the connection.
+    """
+
+    def __init__(self, answers, **kwargs):
+        super(StubClient, self).__init__(URL, **kwargs)
+        self.answers = list(answers)
+        self.sent = []
+
+    def _request(self, method, url, body, headers):
+        self.sent.append((method, url))
+        answer = self.answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        status, data = answer
+        if isinstance(data, dict):
+            data = json.dumps(data)
+        return StubResponse(status), data.encode('utf-8'), True
+
+
+class Clock(object):
+    """Time which only passes while the client sleeps."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.sleeps.append(delay)
+        self.now += delay
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(lxd_client.time, 'time', clock.time)
+    monkeypatch.setattr(lxd_client.time, 'sleep', clock.sleep)
+    return clock
+
+
+@pytest.fixture
+def max_jitter(monkeypatch):
+    """Make the jitter return its upper bound, recording the bounds."""
+    bounds = []
+
+    def uniform(low, high):
+        bounds.append((low, high))
+        return high
+
+    monkeypatch.setattr(lxd_client.random, 'uniform', uniform)
+    return bounds
+
+
+@pytest.mark.parametrize('resp_json, transient', [
+    ({'error_code': 429, 'error': 'Too Many Requests'}, True),
+    ({'error_code': 502, 'error': ''}, True),
+    ({'error_code': 503, 'error': 'Service Unavailable'}, True),
+    ({'error_code': 504, 'error': None}, True),
+    ({'error_code': 500, 'error': 'Failed to begin transaction: database is locked'}, True),
+    ({'error_code': 500, 'error': 'database is busy'}, True),
+    ({'error_code': 500, 'error': 'no available dqlite leader server found'}, True),
+    ({'error_code': 400, 'error': 'Storage pool operation is in progress'}, True),
+    ({'error_code': 500, 'error': 'Instance is busy running a create operation'}, True),
+    ({'error_code': 500, 'error': 'Please try again later'}, True),
+    ({'error_code': 500, 'error': 'Failed to create network: file exists'}, False),
+    ({'error_code': 400, 'error': 'Invalid config key'}, False),
+    ({'error_code': 404, 'error': 'Network not found'}, False),
+    ({'error_code': 403, 'error': 'not authorized'}, False),
+    ({'error_code': 412, 'error': 'ETag does not match'}, False),
+])
+def test_is_transient(resp_json, transient):
+    assert LXDClient.is_transient(resp_json) is transient
+
+
+def test_transient_error_is_retried(clock, max_jitter):
+    client = StubClient([
+        error(503, 'Service Unavailable'),
+        error(500, 'database is locked'),
+        (502, '<html>Bad Gateway</html>'),
+        sync({'name': 'lxdbr0'}),
+    ])
+    resp_json = client.do('GET', '/1.0/networks/lxdbr0')
+    assert resp_json['metadata'] == {'name': 'lxdbr0'}
+    assert len(client.sent) == 4
+    assert max_jitter == [(0, 0.1), (0, 0.2), (0, 0.4)]
+    assert clock.sleeps == [0.1, 0.2, 0.4]
+    assert client.timings.retries_result()['count'] == 3
+
+
+def test_jitter_is_capped(clock, max_jitter):
+    client = StubClient([error(503, 'Service Unavailable')] * 9 + [sync()], retry_timeout=60)
+    client.do('GET', '/1.0')
+    assert [high for low, high in max_jitter] == [0.1, 0.2, 0.4, 0.8, 1.6, 3.2, 5, 5, 5]
+
+
+def test_jitter_is_random(clock):
+    client = StubClient([error(503, 'Service Unavailable')] * 50 + [sync()], retry_timeout=300)
+    client.do('GET', '/1.0')
+    assert all(0 <= delay <= 5 for delay in clock.sleeps)
+    assert len(set(clock.sleeps)) > 1
+
+
+def test_retries_end_at_retry_timeout(clock, max_jitter):
+    client = StubClient([error(503, 'Service Unavailable')] * 10, retry_timeout=1)
+    with pytest.raises(LXDTransientException) as e:
+        client.do('GET', '/1.0')
+    # 0.1 + 0.2 + 0.4 seconds were slept, 0.8 more would pass the deadline
+    assert e.value.msg == 'Service Unavailable (retried 3 times)'
+    assert len(client.sent) == 4
+
+
+def test_no_retry_without_retry_timeout(clock):
+    client = StubClient([error(503, 'Service Unavailable'), sync()], retry_timeout=0)
+    with pytest.raises(LXDTransientException) as e:
+        client.do('GET', '/1.0')
+    assert e.value.msg == 'Service Unavailable'
+    assert clock.sleeps == []
+
+
+def test_error_is_not_retried(clock):
+    client = StubClient([error(400, 'Invalid config key'), sync()])
+    with pytest.raises(LXDClientException) as e:
+        client.do('PATCH', '/1.0/networks/lxdbr0', {'config': {}})
+    assert not isinstance(e.value, LXDTransientException)
+    assert e.value.msg == 'Invalid config key'
+    assert client.sent == [('PATCH', '/1.0/networks/lxdbr0')]
+
+
+def test_lost_connection_is_retried_for_idempotent_requests(clock, max_jitter):
+    client = StubClient([socket.error(errno.ECONNRESET, 'reset'), sync()])
+    client.do('PUT', '/1.0/networks/lxdbr0', {'config': {}})
+    assert len(client.sent) == 2
+
+
+def test_lost_connection_is_not_retried_for_post(clock):
+    client = StubClient([socket.error(errno.ECONNRESET, 'reset'), sync()])
+    with pytest.raises(LXDClientException) as e:
+        client.do('POST', '/1.0/networks', {'name': 'lxdbr0'})
+    assert not isinstance(e.value, LXDTransientException)
+    assert client.sent == [('POST', '/1.0/networks')]
+
+
+def test_refused_connection_is_retried_for_post(clock, max_jitter):
+    client = StubClient([socket.error(errno.ECONNREFUSED, 'refused'), sync()])
+    client.do('POST', '/1.0/networks', {'name': 'lxdbr0'})
+    assert len(client.sent) == 2
+
+
+def test_auth_cache_key(tmp_path):
+    path = str(tmp_path / 'auth.json')
+    cache = LXDAuthCache(path)
+    cache.trust('https://lxd1:8443', 'f1')
+    cache.trust(URL, '')
+    cache.save()
+    cache = LXDAuthCache(path)
+    assert cache.trusted('https://lxd1:8443', 'f1')
+    assert not cache.trusted('https://lxd1:8443', 'f2')
+    assert not cache.trusted('https://lxd2:8443', 'f1')
+    assert cache.trusted(URL, '')
+    cache.forget('https://lxd1:8443')
+    cache.save()
+    cache = LXDAuthCache(path)
+    assert not cache.trusted('https://lxd1:8443', 'f1')
+    assert cache.trusted(URL, '')
+
+
+def test_authenticate_sends_password_when_untrusted(tmp_path):
+    path = str(tmp_path / 'auth.json')
+    client = StubClient([sync({'auth': 'untrusted'}), sync()])
+    client.authenticate('secret', path)
+    assert client.sent == [('GET', '/1.0'), ('POST', '/1.0/certificates')]
+    assert LXDAuthCache(path).trusted(URL, '')
+    # The trust is kept by the client and the cache
+    client.authenticate('secret', path)
+    client = StubClient([])
+    client.authenticate('secret', path)
+    assert client.sent == []
+
+
+def test_authenticate_again_after_403(tmp_path):
+    path = str(tmp_path / 'auth.json')
+    cache = LXDAuthCache(path)
+    cache.trust(URL, '')
+    cache.save()
+    client = StubClient([
+        error(403, 'not authorized'),
+        sync({'auth': 'untrusted'}),
+        sync(),
+        sync({'name': 'lxdbr0'}),
+    ])
+    client.authenticate('secret', path)
+    resp_json = client.do('GET', '/1.0/networks/lxdbr0')
+    assert resp_json['metadata'] == {'name': 'lxdbr0'}
+    assert client.sent == [
+        ('GET', '/1.0/networks/lxdbr0'),
+        ('GET', '/1.0'),
+        ('POST', '/1.0/certificates'),
+        ('GET', '/1.0/networks/lxdbr0'),
+    ]
+    assert LXDAuthCache(path).trusted(URL, '')
+
+
+def test_authenticate_again_once(tmp_path):
+    client = StubClient([
+        sync({'auth': 'trusted'}),
+        error(403, 'not authorized'),
+        sync({'auth': 'untrusted'}),
+        sync(),
+        error(403, 'not authorized'),
+    ])
+    client.authenticate('secret', str(tmp_path / 'auth.json'))
+    with pytest.raises(LXDUntrustedException):
+        client.do('GET', '/1.0/networks/lxdbr0')
+    assert len(client.sent) == 5
+
+
+def test_untrusted_get_server_authenticates_again():
+    client = StubClient([
+        sync({'auth': 'trusted'}),
+        sync({'auth': 'untrusted'}),
+        sync({'auth': 'untrusted'}),
+        sync(),
+        sync({'auth': 'trusted', 'config': {}}),
+    ])
+    client.authenticate('secret')
+    resp_json = client.do('GET', '/1.0')
+    assert resp_json['metadata']['auth'] == 'trusted'
+    assert client.server_json is resp_json
+
+
+def test_403_without_authenticate_is_raised():
+    client = StubClient([error(403, 'not authorized'), sync()])
+    with pytest.raises(LXDUntrustedException) as e:
+        client.do('GET', '/1.0/networks')
+    assert e.value.msg == 'not authorized'
+    assert len(client.sent) == 1
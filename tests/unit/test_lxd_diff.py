@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2024, Mikhail Shurutov <shurutov@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Tests of the comparison of LXD objects with their desired state.
+
+    python3 -m pytest tests/unit
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import pytest
+
+from ansible.module_utils.lxd_diff import (
+    build_patch, build_put, canonical_value, diff_object, values_equal
+)
+
+
+@pytest.mark.parametrize('value, canonical', [
+    (True, 'true'),
+    (False, 'false'),
+    ('yes', 'true'),
+    ('On', 'true'),
+    ('no', 'false'),
+    ('OFF', 'false'),
+    (1500, '1500'),
+    ('10GiB', '10737418240'),
+    ('10 GB', '10000000000'),
+    ('1.5MiB', '1572864'),
+    ('512B', '512'),
+    ('10.0.3.1/24', '10.0.3.1/24'),
+    ('fd42:0000:0000::1/64', 'fd42::1/64'),
+    ('fd42:0:0:0:0:0:0:1', 'fd42::1'),
+    ('8.8.8.8, 1.1.1.1', '8.8.8.8,1.1.1.1'),
+    ('yes,fd42:0::1', 'true,fd42::1'),
+    ('auto', 'auto'),
+    ('10Gb', '10Gb'),
+    ('eth0', 'eth0'),
+])
+def test_canonical_value(value, canonical):
+    assert canonical_value(value) == canonical
+
+
+def test_canonical_value_of_dicts_and_lists():
+    assert canonical_value({'size': '1GiB', 'shared': True}) == {'size': '1073741824', 'shared': 'true'}
+    assert canonical_value(['on', '1kB']) == ['true', '1000']
+
+
+@pytest.mark.parametrize('key, before, after, equal', [
+    ('security.nesting', 'true', True, True),
+    ('security.nesting', 'false', 'yes', False),
+    ('size', '1073741824', '1GiB', True),
+    ('size', '1000000000', '1GiB', False),
+    ('ipv6.address', 'fd42::1/64', 'fd42:0:0::1/64', True),
+    ('ipv4.address', '10.0.3.1/24', 'auto', True),
+    ('ipv4.address', 'none', 'auto', False),
+    ('ipv4.address', None, 'auto', False),
+    ('ipv4.address', '', 'auto', False),
+    ('ipv4.nat.address', '10.0.0.1', 'auto', True),
+    ('description', 'old', 'auto', False),
+    ('limits.cpu', None, '2', False),
+])
+def test_values_equal(key, before, after, equal):
+    assert values_equal(key, before, after) is equal
+
+
+def test_diff_object_reports_changed_keys_only():
+    old = {
+        'description': 'bridge',
+        'config': {'ipv4.address': '10.0.3.1/24', 'ipv4.nat': 'true', 'volatile.uuid': 'x'}
+    }
+    desired = {'description': 'bridge', 'config': {'ipv4.address': 'auto', 'ipv4.nat': False}}
+    diff = diff_object(old, desired, ['config', 'description'])
+    assert diff == {'config': {'changes': {'ipv4.nat': {'before': 'true', 'after': 'false'}}}}
+    assert build_patch(diff) == {'config': {'ipv4.nat': 'false'}}
+
+
+def test_put_removes_unlisted_keys_and_keeps_server_keys():
+    old = {'config': {'ipv4.nat': 'true', 'dns.domain': 'lxd', 'volatile.uuid': 'x'}}
+    desired = {'config': {'ipv4.nat': 'yes'}}
+    diff = diff_object(old, desired, ['config'], 'put')
+    assert diff == {'config': {'changes': {'dns.domain': {'before': 'lxd', 'after': None}}}}
+    assert build_put(old, desired, ['config']) == {'config': {'ipv4.nat': 'yes', 'volatile.uuid': 'x'}}
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2024, Mikhail Shurutov <shurutov@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Tests of the LXD event listener, fed with recorded event frames.
+
+    python3 -m pytest tests/unit
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import io
+import json
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+from ansible.module_utils import lxd_events
+from ansible.module_utils.lxd_events import LXDEventListener
+
+# Events as /1.0/events streams them, trimmed to the fields used
+CREATED = {
+    'type': 'operation', 'timestamp': '2024-05-02T10:00:00.000000000Z', 'project': 'default',
+    'metadata': {
+        'id': '6916c8a6-9b7d-4abd-90b3-aeb9cc4d3916', 'class': 'task',
+        'description': 'Creating instance', 'status': 'Running', 'status_code': 103, 'err': ''
+    }
+}
+SUCCESS = {
+    'type': 'operation', 'timestamp': '2024-05-02T10:00:01.000000000Z', 'project': 'default',
+    'metadata': dict(CREATED['metadata'], status='Success', status_code=200)
+}
+FAILURE = {
+    'type': 'operation', 'timestamp': '2024-05-02T10:00:01.000000000Z', 'project': 'default',
+    'metadata': {
+        'id': 'a1b4e6d2-3b6e-4b0e-8f0e-6f3f8d0a5c11', 'class': 'task',
+        'description': 'Starting instance', 'status': 'Failure', 'status_code': 400,
+        'err': 'Failed to start device "eth0"'
+    }
+}
+STARTED = {
+    'type': 'lifecycle', 'timestamp': '2024-05-02T10:00:02.000000000Z', 'project': 'default',
+    'metadata': {
+        'action': 'instance-started', 'source': '/1.0/instances/c1?project=default',
+        'context': {}
+    }
+}
+
+
+def frame(payload, opcode=lxd_events.WEBSOCKET_TEXT, fin=True, mask=None):
+    """Return a websocket frame, unmasked as the server sends them."""
+    if not isinstance(payload, bytes):
+        payload = json.dumps(payload).encode('utf-8')
+    header = bytearray([(0x80 if fin else 0) | opcode])
+    mask_bit = 0x80 if mask is not None else 0
+    if len(payload) < 126:
+        header.append(mask_bit | len(payload))
+    elif len(payload) < 0x10000:
+        header.append(mask_bit | 126)
+        header += struct.pack('!H', len(payload))
+    else:
+        header.append(mask_bit | 127)
+        header += struct.pack('!Q', len(payload))
+    if mask is not None:
+        header += mask
+        payload = bytes(bytearray(b ^ mask[i % 4] for i, b in enumerate(bytearray(payload))))
+    return bytes(header) + payload
+
+
+class StubSocket(object):
+    def __init__(self):
+        self.sent = []
+
+    def sendall(self, data):
+        self.sent.append(data)
+
+
+class StubClient(object):
+    def clone(self):
+        return self
+
+    def close(self):
+        pass
+
+
+def listen(*frames):
+    """Return a listener which read frames until the stream ended."""
+    listener = LXDEventListener(StubClient())
+    listener.sock = StubSocket()
+    listener.stream = io.BytesIO(b''.join(frames))
+    listener.connected = True
+    listener._run()
+    return listener
+
+
+def test_expected_operation_is_kept():
+    listener = LXDEventListener(StubClient())
+    listener.expect(SUCCESS['metadata']['id'])
+    listener.sock = StubSocket()
+    listener.stream = io.BytesIO(frame(CREATED) + frame(SUCCESS))
+    listener.connected = True
+    listener._run()
+    assert not listener.connected
+    assert listener.unexpected == {}
+    assert listener.wait_operation(SUCCESS['metadata']['id']) == SUCCESS['metadata']
+    assert listener.operations == {}
+    assert listener.expected == set()
+
+
+def test_running_operation_is_not_kept():
+    listener = listen(frame(CREATED))
+    assert listener.operations == {}
+    assert listener.unexpected == {}
+    assert listener.wait_operation(CREATED['metadata']['id']) is None
+
+
+def test_unexpected_operation_is_kept_until_expected():
+    listener = listen(frame(SUCCESS), frame(FAILURE))
+    assert list(listener.unexpected) == [SUCCESS['metadata']['id'], FAILURE['metadata']['id']]
+    # The response which started the operation came after its event
+    listener.expect(FAILURE['metadata']['id'])
+    assert list(listener.unexpected) == [SUCCESS['metadata']['id']]
+    assert listener.wait_operation(FAILURE['metadata']['id']) == FAILURE['metadata']
+
+
+def test_unexpected_operation_is_forgotten(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(lxd_events.time, 'time', lambda: now[0])
+    listener = LXDEventListener(StubClient())
+    listener._dispatch(SUCCESS)
+    now[0] += lxd_events.OPERATION_KEEP_TIMEOUT
+    listener._dispatch(FAILURE)
+    assert list(listener.unexpected) == [SUCCESS['metadata']['id'], FAILURE['metadata']['id']]
+    now[0] += 1
+    listener._dispatch(dict(SUCCESS, metadata=dict(SUCCESS['metadata'], id='other')))
+    # The operation of another client is not kept for ever
+    assert list(listener.unexpected) == [FAILURE['metadata']['id'], 'other']
+    listener.expect(SUCCESS['metadata']['id'])
+    assert listener.operations == {}
+
+
+def test_lifecycle_action_is_kept():
+    listener = listen(frame(STARTED))
+    assert listener.last_action('/1.0/instances/c1') == 'instance-started'
+    assert listener.last_action('/1.0/instances/c2') is None
+
+
+def test_fragmented_and_long_frames():
+    payload = json.dumps(dict(SUCCESS, metadata=dict(SUCCESS['metadata'], err='x' * 70000)))
+    payload = payload.encode('utf-8')
+    listener = listen(
+        frame(payload[:100], fin=False),
+        frame(payload[100:300], opcode=lxd_events.WEBSOCKET_CONTINUATION, fin=False),
+        frame(payload[300:], opcode=lxd_events.WEBSOCKET_CONTINUATION),
+        frame(STARTED, mask=bytearray(b'\x01\x02\x03\x04')),
+    )
+    assert listener.unexpected[SUCCESS['metadata']['id']][1]['err'] == 'x' * 70000
+    assert listener.last_action('/1.0/instances/c1') == 'instance-started'
+
+
+def test_ping_is_answered():
+    listener = listen(frame(b'beat', opcode=lxd_events.WEBSOCKET_PING), frame(STARTED))
+    pong = bytearray(listener.sock.sent[0])
+    assert pong[0] == 0x80 | lxd_events.WEBSOCKET_PONG
+    assert pong[1] == 0x80 | 4
+    mask = pong[2:6]
+    assert bytes(bytearray(b ^ mask[i % 4] for i, b in enumerate(pong[6:]))) == b'beat'
+    assert listener.last_action('/1.0/instances/c1') == 'instance-started'
+
+
+def test_close_frame_ends_stream():
+    listener = listen(frame(b'', opcode=lxd_events.WEBSOCKET_CLOSE), frame(STARTED))
+    assert not listener.connected
+    assert listener.lifecycle == {}
+
+
+def test_bad_event_ends_stream():
+    listener = listen(frame(b'{"type": '), frame(STARTED))
+    assert not listener.connected
+    assert listener.lifecycle == {}
+
+
+@pytest.fixture
+def streaming():
+    """A listener reading the frames written to the other end of a socket."""
+    server, client = socket.socketpair()
+    listener = LXDEventListener(StubClient())
+    listener.sock = client
+    listener.stream = client.makefile('rb')
+    listener.connected = True
+    listener.thread = threading.Thread(target=listener._run)
+    listener.thread.daemon = True
+    listener.thread.start()
+    yield listener, server
+    server.close()
+    listener.thread.join()
+    listener.stream.close()
+    client.close()
+
+
+def test_wait_operation_wakes_up_on_event(streaming):
+    listener, server = streaming
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(
+        listener.wait_operation(SUCCESS['metadata']['id'], time.time() + 5)))
+    waiter.start()
+    server.sendall(frame(CREATED) + frame(FAILURE) + frame(SUCCESS))
+    waiter.join()
+    assert results == [SUCCESS['metadata']]
+    assert list(listener.unexpected) == [FAILURE['metadata']['id']]
+
+
+def test_wait_operation_deadline(streaming):
+    listener, server = streaming
+    assert listener.wait_operation(SUCCESS['metadata']['id'], time.time() + 0.1) is None
+    assert listener.expected == set()
+
+
+def test_wait_operation_ends_with_stream(streaming):
+    listener, server = streaming
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(
+        listener.wait_operation(SUCCESS['metadata']['id'])))
+    waiter.start()
+    server.sendall(frame(b'', opcode=lxd_events.WEBSOCKET_CLOSE))
+    waiter.join(5)
+    assert results == [None]
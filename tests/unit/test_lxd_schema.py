@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2024, Mikhail Shurutov <shurutov@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Tests of the validation of configs against the LXD config key schema.
+
+    python3 -m pytest tests/unit
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import copy
+
+import pytest
+
+from ansible.module_utils.lxd_client import LXDClientException
+from ansible.module_utils.lxd_network_engine import LXDNetworkManagement
+from ansible.module_utils.lxd_schema import LXDConfigSchema, check_configs
+from ansible.module_utils.lxd_timings import LXDTimings
+
+# CONFIGURATION is a reduced GET /1.0/metadata/configuration response.
+CONFIGURATION = {
+    'type': 'sync', 'status': 'Success', 'status_code': 200,
+    'metadata': {'configs': {
+        'server': {
+            'core': {'keys': [
+                {'core.https_address': {'type': 'string'}},
+                {'core.debug_address': {'type': 'string'}},
+            ]},
+            'images': {'keys': [
+                {'images.auto_update_interval': {'type': 'integer'}},
+                {'images.compression_algorithm': {'type': 'string'}},
+            ]},
+        },
+        'instance': {
+            'instance-miscellaneous': {'keys': [
+                {'environment.<name>': {'type': 'string'}},
+                {'security.nesting': {'type': 'bool'}},
+            ]},
+        },
+        'storage-zfs': {
+            'pool-conf': {'keys': [
+                {'size': {'type': 'string'}},
+                {'zfs.pool_name': {'type': 'string'}},
+            ]},
+            'volume-conf': {'keys': [
+                {'size': {'type': 'string'}},
+                {'zfs.blocksize': {'type': 'string'}},
+                {'security.shifted': {'type': 'bool'}},
+            ]},
+        },
+        'storage-dir': {
+            'pool-conf': {'keys': [
+                {'source': {'type': 'string'}},
+                {'rsync.bwlimit': {'type': 'string'}},
+            ]},
+            'volume-conf': {'keys': [
+                {'size': {'type': 'string'}},
+                {'security.shifted': {'type': 'bool'}},
+            ]},
+        },
+        'network-bridge': {
+            'network-conf': {'keys': [
+                {'bridge.mtu': {'type': 'integer'}},
+                {'ipv4.address': {'type': 'string'}},
+                {'ipv4.nat': {'type': 'bool'}},
+                {'ipv6.address': {'type': 'string'}},
+            ]},
+        },
+        'network-macvlan': {
+            'network-conf': {'keys': [
+                {'mtu': {'type': 'integer'}},
+                {'parent': {'type': 'string'}},
+            ]},
+        },
+    }},
+}
+
+
+@pytest.fixture
+def schema():
+    return LXDConfigSchema(CONFIGURATION['metadata']['configs'])
+
+
+class StubClient(object):
+    """A client answering GET /1.0 and the config key schema."""
+
+    def __init__(self, configuration=CONFIGURATION, networks=None):
+        self.url = 'unix:/var/lib/lxd/unix.socket'
+        self.server_cache = {}
+        self.server_json = None
+        self.timings = LXDTimings()
+        self.configuration = configuration
+        self.networks = networks or []
+        self.requests = []
+
+    def do(self, method, url, body=None, ok_error_codes=None, **kwargs):
+        self.requests.append((method, url))
+        if url == '/1.0':
+            return {'type': 'sync', 'metadata': {'environment': {'server_version': '5.21'}}}
+        if url == '/1.0/metadata/configuration':
+            return copy.deepcopy(self.configuration)
+        if url == '/1.0/networks?recursion=1':
+            return {'type': 'sync', 'metadata': copy.deepcopy(self.networks)}
+        raise AssertionError('unexpected request {0} {1}'.format(method, url))
+
+    @staticmethod
+    def not_modified(resp_json):
+        return False
+
+
+class StubModule(object):
+    check_mode = False
+    _verbosity = 0
+
+    def __init__(self, **params):
+        self.params = dict(
+            client_cert=None, client_key=None, name=None, new_name=None, rename=False,
+            state='present', trust_password=None, type=None, update_mode='patch',
+            url='unix:/var/lib/lxd/unix.socket', wait_timeout=None, **params
+        )
+
+    def fail_json(self, **kwargs):
+        raise AssertionError(kwargs['msg'])
+
+
+def test_server_keys(schema):
+    config = {'core.https_address': ':8443', 'images.auto_update_interval': '6'}
+    assert schema.validate('server', config, 'config') == []
+    assert schema.validate('server', {'core.https_adress': ':8443'}, 'config') == [
+        'config: unknown key core.https_adress for server'
+    ]
+
+
+def test_placeholder_keys(schema):
+    assert schema.validate('instance', {'environment.HTTP_PROXY': 'http://proxy'}, 'c1') == []
+    assert schema.validate('instance', {'environments.HTTP_PROXY': 'x'}, 'c1') == [
+        'c1: unknown key environments.HTTP_PROXY for instance'
+    ]
+
+
+def test_free_keys(schema):
+    config = {'user.comment': 'anything', 'volatile.uuid': 'x'}
+    assert schema.validate('server', config, 'config') == []
+    assert schema.validate('network-bridge', config, 'lxdbr0') == []
+
+
+def test_unknown_entity_is_not_checked(schema):
+    assert schema.validate('network-ovn', {'bridge.anything': 'x'}, 'ovn0') == []
+    assert schema.validate('server', {}, 'config') == []
+
+
+def test_pool_conf_keys(schema):
+    assert schema.validate('storage-zfs', {'size': '10GiB', 'zfs.pool_name': 'tank'}, 'default') == []
+    # size is a volume key of the dir driver, the pool has none
+    assert schema.validate('storage-dir', {'size': '10GiB'}, 'default') == [
+        'default: unknown key size for storage-dir'
+    ]
+    assert schema.validate('storage-dir', {'zfs.blocksize': '8KiB'}, 'default') == [
+        'default: unknown key zfs.blocksize for storage-dir'
+    ]
+
+
+def test_volume_conf_keys(schema):
+    config = {'source': '/srv/lxd', 'volume.size': '10GiB', 'volume.security.shifted': 'true'}
+    assert schema.validate('storage-dir', config, 'default') == []
+    assert schema.validate('storage-zfs', {'volume.zfs.blocksize': '8KiB'}, 'default') == []
+    # Volume keys of another driver are not defaults of the volumes
+    assert schema.validate('storage-dir', {'volume.zfs.blocksize': '8KiB'}, 'default') == [
+        'default: unknown key volume.zfs.blocksize for storage-dir'
+    ]
+
+
+def test_missing_pool_group_checks_all_keys():
+    configs = {'storage-dir': {'': {'keys': [{'source': {}}, {'size': {}}]}}}
+    schema = LXDConfigSchema(configs)
+    assert schema.validate('storage-dir', {'source': '/srv', 'size': '1GiB'}, 'default') == []
+
+
+def test_network_type_keys(schema):
+    assert schema.validate('network-macvlan', {'parent': 'eth0', 'mtu': 1500}, 'macvlan0') == []
+    assert schema.validate('network-macvlan', {'ipv4.nat': 'true'}, 'macvlan0') == [
+        'macvlan0: unknown key ipv4.nat for network-macvlan'
+    ]
+    assert schema.validate('network-bridge', {'ipv4.nat': 'true'}, 'lxdbr0') == []
+
+
+@pytest.mark.parametrize('config, errors', [
+    ({'ipv4.nat': True}, []),
+    ({'ipv4.nat': 'yes'}, []),
+    ({'ipv4.nat': 'maybe'}, ['lxdbr0: ipv4.nat must be a boolean, got maybe']),
+    ({'bridge.mtu': 1500}, []),
+    ({'bridge.mtu': '1500'}, []),
+    ({'bridge.mtu': ''}, []),
+    ({'bridge.mtu': 'large'}, ['lxdbr0: bridge.mtu must be an integer, got large']),
+    ({'bridge.mtu': '15.5'}, ['lxdbr0: bridge.mtu must be an integer, got 15.5']),
+    ({'ipv4.address': 'auto'}, []),
+])
+def test_value_types(schema, config, errors):
+    assert schema.validate('network-bridge', config, 'lxdbr0') == errors
+
+
+def test_check_configs_lists_all_errors():
+    client = StubClient()
+    items = [
+        ('config', 'server', {'core.https_address': ':8443', 'core.unknown': 'x'}),
+        ('lxdbr0', 'network-bridge', {'ipv4.nat': 'maybe'}),
+    ]
+    with pytest.raises(LXDClientException) as e:
+        check_configs(client, {}, items)
+    assert e.value.msg == (
+        'invalid config: config: unknown key core.unknown for server; '
+        'lxdbr0: ipv4.nat must be a boolean, got maybe'
+    )
+
+
+def test_check_configs_reads_the_schema_once():
+    client = StubClient()
+    check_configs(client, {}, [('config', 'server', {'core.https_address': ':8443'})])
+    check_configs(client, {}, [('lxdbr0', 'network-bridge', {'ipv4.nat': 'true'})])
+    assert client.requests == [('GET', '/1.0'), ('GET', '/1.0/metadata/configuration')]
+
+
+def test_check_configs_reuses_server_json():
+    client = StubClient()
+    client.server_json = {'type': 'sync', 'metadata': {'environment': {'server_version': '5.21'}}}
+    check_configs(client, {}, [('config', 'server', {'core.https_address': ':8443'})])
+    assert client.requests == [('GET', '/1.0/metadata/configuration')]
+
+
+def test_check_configs_without_schema():
+    client = StubClient(configuration={'type': 'error', 'error_code': 404, 'metadata': None})
+    check_configs(client, {}, [('config', 'server', {'core.unknown': 'x'})])
+
+
+def test_network_items_take_the_server_type():
+    client = StubClient(networks=[
+        {'name': 'macvlan0', 'type': 'macvlan', 'config': {'parent': 'eth0'}},
+        {'name': 'lxdbr0', 'type': 'bridge', 'config': {}},
+    ])
+    networks = [
+        {'name': 'macvlan0', 'state': 'present', 'config': {'mtu': '1500'}},
+        {'name': 'lxdbr0', 'state': 'present', 'config': {'ipv4.nat': 'true'}},
+        {'name': 'lxdbr1', 'state': 'present', 'config': {}},
+        {'name': 'eth1', 'type': 'physical', 'state': 'present', 'config': {}},
+    ]
+    engine = LXDNetworkManagement(StubModule(networks=networks), client=client)
+    items = engine.schema_items()
+    assert [(label, entity) for label, entity, config in items] == [
+        ('macvlan0', 'network-macvlan'),
+        ('lxdbr0', 'network-bridge'),
+        ('lxdbr1', 'network-bridge'),
+        ('eth1', 'network-physical'),
+    ]
+    assert client.requests.count(('GET', '/1.0/networks?recursion=1')) == 1
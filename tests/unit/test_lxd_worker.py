@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+# (c) 2024, Mikhail Shurutov <shurutov@gmail.com>
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""Tests of the worker running LXD modules, against the stand-in daemon
+of tests/benchmark.
+
+    python3 -m pytest tests/unit
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmark'))
+
+import fake_lxd  # noqa: E402
+
+from ansible.module_utils import lxd_worker  # noqa: E402
+from ansible.module_utils.lxd_common import (  # noqa: E402
+    LXD_SCHEMA_ARGS, LXD_TIMINGS_ARGS, LXD_WORKER_ARGS, lxd_argument_spec
+)
+from ansible.module_utils.lxd_config_engine import LXDConfig  # noqa: E402
+
+
+class ModuleExit(Exception):
+    def __init__(self, failed, result):
+        self.failed = failed
+        self.result = result
+
+
+class StubModule(object):
+    """The lxd_config module with its parameters processed."""
+
+    _name = 'lxd_config'
+    _verbosity = 0
+    check_mode = False
+
+    def __init__(self, **params):
+        argument_spec = lxd_argument_spec(LXD_TIMINGS_ARGS, LXD_WORKER_ARGS, LXD_SCHEMA_ARGS)
+        self.params = dict((name, spec.get('default', None)) for name, spec in argument_spec.items())
+        self.params.update(
+            auth_cache=None, schema_cache=None, state_cache=None,
+            update_mode='patch', validate_config=True
+        )
+        self.params.update(params)
+        self.warnings = []
+
+    def warn(self, warning):
+        self.warnings.append(warning)
+
+    def exit_json(self, **kwargs):
+        raise ModuleExit(False, kwargs)
+
+    def fail_json(self, **kwargs):
+        raise ModuleExit(True, kwargs)
+
+
+@pytest.fixture
+def tmpdir_short():
+    # Unix socket paths are short, pytest temporary directories are not
+    path = tempfile.mkdtemp(prefix='lxdw')
+    yield path
+    shutil.rmtree(path)
+
+
+@pytest.fixture
+def server(tmpdir_short):
+    server = fake_lxd.serve(os.path.join(tmpdir_short, 'lxd.sock'))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def config_module(server, tmpdir_short, **params):
+    return StubModule(
+        url='unix:{0}'.format(server.server_address),
+        worker_socket=os.path.join(tmpdir_short, 'worker.sock'),
+        worker_idle_timeout=2,
+        **params
+    )
+
+
+def run_in_worker(module):
+    with pytest.raises(ModuleExit) as e:
+        lxd_worker.run_in_worker(module, 'config')
+    return e.value
+
+
+def test_module_runs_in_worker(server, tmpdir_short):
+    module = config_module(server, tmpdir_short, config={'core.https_address': ':8443'})
+    result = run_in_worker(module)
+    assert not result.failed
+    assert result.result['changed']
+    assert server.state.server['config'] == {'core.https_address': ':8443'}
+    assert os.path.exists(module.params['worker_socket'])
+    # The worker keeps running for the next module
+    result = run_in_worker(module)
+    assert not result.result['changed']
+    assert module.warnings == []
+
+
+def test_worker_retires_on_other_code(tmpdir_short):
+    path = os.path.join(tmpdir_short, 'worker.sock')
+    worker = lxd_worker.LXDWorker(path, 2)
+    response = worker.handle({'code': 'other', 'kind': 'config'})
+    assert response == {'code': worker.code, 'unsupported': True}
+    assert worker.retired
+    assert worker.code == lxd_worker.code_digest()
+
+
+def test_code_change_respawns_worker(server, tmpdir_short, monkeypatch):
+    module = config_module(server, tmpdir_short, config={'core.https_address': ':8443'})
+    run_in_worker(module)
+    # The role was updated, modules now ship other module_utils
+    monkeypatch.setattr(lxd_worker, 'code_digest', lambda: 'updated')
+    module = config_module(server, tmpdir_short, config={'core.https_address': ':9443'})
+    result = run_in_worker(module)
+    # Only a worker started with the updated code serves it
+    assert not result.failed
+    assert result.result['changed']
+    assert server.state.server['config'] == {'core.https_address': ':9443'}
+    assert module.warnings == []
+
+
+def test_unreachable_worker_runs_in_module(server, tmpdir_short, monkeypatch):
+    monkeypatch.setattr(lxd_worker, 'WORKER_START_TIMEOUT', 0.2)
+    blocker = os.path.join(tmpdir_short, 'file')
+    open(blocker, 'w').close()
+    # No worker can listen in a directory which is a file
+    module = config_module(server, tmpdir_short, config={'core.https_address': ':8443'})
+    module.params['worker_socket'] = os.path.join(blocker, 'worker.sock')
+    assert lxd_worker.run_in_worker(module, 'config') is None
+    assert module.warnings == [
+        'cannot start the LXD worker on {0}, running without it'.format(module.params['worker_socket'])
+    ]
+    with pytest.raises(ModuleExit) as e:
+        LXDConfig(module=module).run()
+    assert e.value.result['changed']
+    assert server.state.server['config'] == {'core.https_address': ':8443'}